@@ -0,0 +1,74 @@
+"""Headless batch throughput against the local fake Anthropic server, per concurrency level.
+
+Usage: python benchmarks/bench_batch.py [--prompts N] [--concurrency 1 4 16] [--tokens-per-sec R] [--out results.json]
+
+Each level runs the same generated prompt set through batch.run_batch(),
+the code behind scripts/run_batch.py, with the real SDK talking to the
+fake server and a fresh write-behind database. The server paces replies,
+so prompts per second should grow with concurrency until the client or
+the database becomes the limit; "ideal_prompts_per_sec" is what perfect
+overlap of the server's pacing would give.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+from typing import Any
+
+import anthropic
+from common import write_results  # also puts src/ on sys.path
+from fake_anthropic import FakeAnthropicServer
+from generate_data import paragraph
+
+from batch import batch_defaults, read_prompts, run_batch
+from storage import ConversationStorage
+
+
+def prompt_lines(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [json.dumps({'id': i, 'prompt': paragraph(rng, 2)}) for i in range(count)]
+
+
+def run(prompts: int, levels: list[int], tokens_per_sec: float, ttft: float, reply_tokens: int,
+        seed: int) -> dict[str, Any]:
+    lines = prompt_lines(prompts, seed)
+    results: dict[str, Any] = {}
+    with FakeAnthropicServer(tokens_per_sec=tokens_per_sec or None, ttft=ttft,
+                             reply_tokens=reply_tokens) as server, tempfile.TemporaryDirectory() as tmp:
+        client = anthropic.Anthropic(api_key='fake', base_url=server.base_url, max_retries=0)
+        per_prompt = ttft + (reply_tokens / tokens_per_sec if tokens_per_sec else 0)
+        for concurrency in levels:
+            storage = ConversationStorage(os.path.join(tmp, f'batch_{concurrency}.db'), write_behind=True)
+            defaults = batch_defaults({}, max_tokens=reply_tokens)
+            summary = run_batch(client, storage, read_prompts(lines), io.StringIO(), defaults, concurrency)
+            if per_prompt:
+                summary['ideal_prompts_per_sec'] = round(concurrency / per_prompt, 2)
+            results[f'concurrency_{concurrency}'] = summary
+            sys.stderr.write(f"concurrency {concurrency:4}  {summary['prompts_per_sec']:8.2f} prompts/s  "
+                             f"errors {summary['errors']}\n")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--prompts', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--tokens-per-sec', type=float, default=400, help='Server pace; 0 for unthrottled')
+    parser.add_argument('--ttft', type=float, default=0.1, help='Server delay before the first token')
+    parser.add_argument('--reply-tokens', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='Write results to this JSON file instead of stdout')
+    args = parser.parse_args()
+
+    parameters = vars(args).copy()
+    parameters.pop('out')
+    write_results('batch', parameters,
+                  run(args.prompts, args.concurrency, args.tokens_per_sec, args.ttft, args.reply_tokens, args.seed),
+                  args.out)
+
+
+if __name__ == '__main__':
+    main()
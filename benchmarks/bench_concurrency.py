@@ -0,0 +1,224 @@
+"""Multi-session write load test: throughput, latency and lock errors per storage mode.
+
+Usage: python benchmarks/bench_concurrency.py [--processes P] [--sessions S] [--writes W] [--out results.json]
+
+Each of P processes (like app servers behind a load balancer) runs S threads
+(like Streamlit browser sessions) against one shared database. Every
+session creates a conversation, adds W messages to it (starting a new
+conversation every --messages-per-conversation) and reads its newest
+messages back after each write. The same load runs once per mode:
+
+    direct               every session writes on its own thread (the default)
+    single_writer        writes go through one writer thread per process
+    single_writer+lock   ... and the processes' writers take turns on a lock file
+
+Writes that fail with "database is locked" (or any other sqlite3 error) are
+counted rather than retried; error_rate is failed / attempted writes.
+
+Meanwhile one more thread per process runs the writes that commit in steps
+of their own: it restores conversations archived beforehand, runs an
+archive pass, re-imports a small export and hits the response cache, over
+and over. maintenance_errors counts its failures; single-writer modes must
+keep it at 0 too.
+
+Afterwards every process saves a setting and, once all have, reads the
+settings and the conversation list back through its (warm) read cache.
+stale_reads counts what it missed of the other processes' writes; it should
+always be 0.
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any
+
+from common import summarize, write_results  # also puts src/ on sys.path
+from generate_data import paragraph
+
+from storage import ConversationStorage
+
+MODES = ('direct', 'single_writer', 'single_writer+lock')
+READ_WINDOW = 20
+# Archived conversations each process's maintenance thread restores, one per round
+MAINTENANCE_ROUNDS = 5
+
+
+def open_storage(db_path: str, mode: str) -> ConversationStorage:
+    return ConversationStorage(db_path, single_writer=mode != 'direct', write_lock=mode == 'single_writer+lock')
+
+
+def stale_reads(storage: ConversationStorage, db_path: str, processes: int) -> int:
+    """Count the other processes' writes that this process's cached reads don't show."""
+    settings = storage.get_all_settings()
+    missing = sum(f'bench_process_{p}' not in settings for p in range(processes))
+    conn = sqlite3.connect(db_path)
+    try:
+        stored = conn.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+    finally:
+        conn.close()
+    return missing + abs(stored - len(storage.get_all_conversations()))
+
+
+def run_process(db_path: str, mode: str, process: int, processes: int, sessions: int, writes: int,
+                per_conversation: int, archived: list[int], export: str, barrier, done, results):
+    """Run `sessions` threads of writes and reads, then put this process's samples on results."""
+    storage = open_storage(db_path, mode)
+    # Warm the read cache, so the check afterwards shows whether it noticed the other processes
+    storage.get_all_settings()
+    storage.get_all_conversations()
+    write_seconds: list[float] = []
+    read_seconds: list[float] = []
+    errors: Counter = Counter()
+    lock = threading.Lock()
+
+    def session(index: int):
+        rng = random.Random(process * 1000 + index)
+        writes_done, reads_done, failed = [], [], Counter()
+        conversation_id = None
+        barrier.wait()
+        for n in range(writes):
+            start = time.perf_counter()
+            try:
+                if conversation_id is None or n % per_conversation == 0:
+                    conversation_id = storage.create_conversation(f'Load test {process}.{index}')
+                else:
+                    storage.add_message(conversation_id, 'user' if n % 2 else 'assistant', paragraph(rng, 2))
+            except sqlite3.Error as e:
+                failed[str(e)] += 1
+                continue
+            writes_done.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            storage.get_messages(conversation_id, limit=READ_WINDOW)
+            reads_done.append(time.perf_counter() - start)
+        with lock:
+            write_seconds.extend(writes_done)
+            read_seconds.extend(reads_done)
+            errors.update(failed)
+
+    def maintenance():
+        failed = Counter()
+        barrier.wait()
+        for conversation_id in archived[process::processes]:
+            for write, args in ((storage.restore_conversation, (conversation_id,)),
+                                (storage.archive_conversations, (3650,)),
+                                (storage.import_all, (io.StringIO(export),)),
+                                (storage.get_cached_response, ('bench',))):
+                try:
+                    write(*args)
+                except sqlite3.Error as e:
+                    failed[str(e)] += 1
+        with lock:
+            maintenance_errors.update(failed)
+
+    maintenance_errors: Counter = Counter()
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    threads.append(threading.Thread(target=maintenance))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    storage.save_setting(f'bench_process_{process}', process)
+    done.wait()
+    results.put({'write': write_seconds, 'read': read_seconds, 'errors': dict(errors),
+                 'maintenance_errors': dict(maintenance_errors),
+                 'stale_reads': stale_reads(storage, db_path, processes)})
+
+
+def run_mode(mode: str, db_path: str, processes: int, sessions: int, writes: int,
+             per_conversation: int) -> dict[str, Any]:
+    """Run the load once against a fresh database and summarize it."""
+    setup = open_storage(db_path, 'direct')  # create the schema before the processes race to
+    archived = [setup.create_conversation(f'Archived {i}') for i in range(processes * MAINTENANCE_ROUNDS)]
+    setup.put_cached_response('bench', None, 'Cached reply')
+    setup.archive_conversations(older_than_days=-1)
+    # The export to re-import holds conversations of another database
+    other = open_storage(db_path + '.export', 'direct')
+    for i in range(3):
+        other.add_message(other.create_conversation(f'Imported {i}'), 'user', 'Imported message')
+    export = io.StringIO()
+    other.export_all(export)
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes * (sessions + 1) + 1)
+    done = context.Barrier(processes)
+    results = context.Queue()
+    workers = [
+        context.Process(target=run_process,
+                        args=(db_path, mode, p, processes, sessions, writes, per_conversation, archived,
+                              export.getvalue(), barrier, done, results))
+        for p in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    samples = [results.get() for _ in workers]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+
+    write_seconds = [s for sample in samples for s in sample['write']]
+    read_seconds = [s for sample in samples for s in sample['read']]
+    errors: Counter = Counter()
+    maintenance_errors: Counter = Counter()
+    for sample in samples:
+        errors.update(sample['errors'])
+        maintenance_errors.update(sample['maintenance_errors'])
+    attempted = processes * sessions * writes
+    result = {
+        'seconds': round(elapsed, 3),
+        'writes_per_sec': round(len(write_seconds) / elapsed, 1),
+        'errors': sum(errors.values()),
+        'error_rate': round(sum(errors.values()) / attempted, 4),
+        'error_messages': dict(errors),
+        'maintenance_errors': sum(maintenance_errors.values()),
+        'maintenance_error_messages': dict(maintenance_errors),
+        'stale_reads': sum(sample['stale_reads'] for sample in samples),
+    }
+    if write_seconds:
+        result['write'] = summarize(write_seconds)
+    if read_seconds:
+        result['read'] = summarize(read_seconds)
+    sys.stderr.write(f"{mode:20} {result['writes_per_sec']:9.1f} writes/s  "
+                     f"p95 {result.get('write', {}).get('p95_ms', 0):9.2f} ms  "
+                     f"errors {result['errors']}  maintenance errors {result['maintenance_errors']}  "
+                     f"stale reads {result['stale_reads']}\n")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4, help='App processes sharing the database')
+    parser.add_argument('--sessions', type=int, default=8, help='Concurrent sessions (threads) per process')
+    parser.add_argument('--writes', type=int, default=100, help='Writes per session')
+    parser.add_argument('--messages-per-conversation', type=int, default=20)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--out', help='Write results to this JSON file instead of stdout')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes:
+            db_path = os.path.join(tmp, f"{mode.replace('+', '_')}.db")
+            results[mode] = run_mode(mode, db_path, args.processes, args.sessions, args.writes,
+                                     args.messages_per_conversation)
+
+    parameters = {
+        'processes': args.processes,
+        'sessions': args.sessions,
+        'writes': args.writes,
+        'messages_per_conversation': args.messages_per_conversation,
+    }
+    write_results('concurrency', parameters, results, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Round-trip benchmark: bulk JSONL export/import vs per-conversation JSON export.
+
+Usage: python benchmarks/bench_export.py [--conversations N] [--messages M] [--out results.json]
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from common import timed, write_results  # also puts src/ on sys.path
+
+from storage import ConversationStorage, open_archive
+
+
+def populate(storage: ConversationStorage, conversations: int, messages: int):
+    """Fill a database with synthetic turns."""
+    for i in range(conversations):
+        conversation_id = None
+        for j in range(messages // 2):
+            conversation_id = storage.save_turn(
+                conversation_id,
+                f'Question {j} in conversation {i}: how does SQLite handle WAL checkpoints?',
+                f'Answer {j}: ' + 'WAL appends pages to a separate log file. ' * 20,
+                input_tokens=50,
+                output_tokens=200,
+                model='claude-haiku-4-5-20251001'
+            )
+
+
+def run(conversations: int, messages: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        source = ConversationStorage(os.path.join(tmp, 'source.db'))
+        populate(source, conversations, messages)
+        results = {}
+
+        def per_conversation_json():
+            path = os.path.join(tmp, 'per_conversation.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                for conv in source.get_all_conversations():
+                    f.write(json.dumps(source.export_conversation_to_json(conv['id']), indent=2))
+            return os.path.getsize(path)
+
+        seconds, size = timed(per_conversation_json)
+        results['per_conversation_json'] = {'export_seconds': round(seconds, 4), 'bytes': size}
+
+        for suffix in ('.jsonl', '.jsonl.gz', '.jsonl.zst'):
+            path = os.path.join(tmp, 'archive' + suffix)
+            try:
+                with open_archive(path, 'w') as f:
+                    export_seconds, _ = timed(lambda f=f: source.export_all(f))
+            except ImportError:
+                continue
+
+            target = ConversationStorage(os.path.join(tmp, f'target{suffix}.db'))
+            with open_archive(path) as f:
+                import_seconds, counts = timed(lambda f=f, target=target: target.import_all(f))
+            with open_archive(path) as f:
+                reimport_seconds, _ = timed(lambda f=f, target=target: target.import_all(f))
+
+            results[suffix.lstrip('.')] = {
+                'export_seconds': round(export_seconds, 4),
+                'import_seconds': round(import_seconds, 4),
+                'reimport_seconds': round(reimport_seconds, 4),
+                'bytes': os.path.getsize(path),
+                'imported': counts,
+            }
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=20, help='Messages per conversation')
+    parser.add_argument('--out', help='Write results to this JSON file instead of stdout')
+    args = parser.parse_args()
+
+    write_results('export', {'conversations': args.conversations, 'messages': args.messages},
+                  run(args.conversations, args.messages), args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Semantic search costs: embedding, vector index load and refresh, and top-k queries.
+
+Usage: python benchmarks/bench_semantic.py [--conversations N] [--messages M] [--dimensions D] [--repeat R] [--out results.json]
+
+A temporary database is filled by generate_data.py with an embedder set,
+so every message is embedded as it is saved. The vector index is then
+loaded from scratch ("cold_load"), refreshed after a few new messages
+("refresh"), and queried through a warm index; "bytes_per_vector" is the
+stored blob size.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from typing import Any
+
+from common import sample, summarize, timed, write_results  # also puts src/ on sys.path
+from generate_data import generate, paragraph
+
+from semantic import HashingEmbedder, VectorIndex
+from storage import ConversationStorage
+
+
+def benchmark(storage: ConversationStorage, embedder: HashingEmbedder, repeat: int,
+              seed: int = 0) -> dict[str, Any]:
+    rng = random.Random(seed)
+    results: dict[str, Any] = {}
+
+    def case(name: str, fn, repeat: int = repeat):
+        results[name] = summarize(sample(fn, repeat))
+        sys.stderr.write(f"{name:40} p50 {results[name]['p50_ms']:10.3f} ms\n")
+
+    case('embed[sentence]', lambda: embedder(paragraph(rng, 1)))
+    case('embed[paragraph]', lambda: embedder(paragraph(rng, 8)))
+
+    seconds, loaded = timed(VectorIndex(storage, embedder).refresh)
+    results['cold_load'] = {**summarize([seconds]), 'vectors': loaded}
+    index = VectorIndex(storage, embedder)
+    index.refresh()
+    ids = [conv['id'] for conv in storage.get_all_conversations()]
+
+    case('refresh[nothing new]', index.refresh)
+    case('refresh[5 new messages]', lambda: (
+        [storage.add_message(rng.choice(ids), 'user', paragraph(rng, 2)) for _ in range(5)],
+        index.refresh()
+    ))
+    case('search[top 10 messages]', lambda: index.search(paragraph(rng, 1), 10))
+    case('search_conversations[top 10]', lambda: index.search_conversations(paragraph(rng, 1), 10))
+    case('related[top 5]', lambda: index.related(rng.choice(ids), 5))
+    # What each rerun of the same conversation costs until new vectors arrive
+    case('related[top 5, memoized]', lambda: index.related(ids[0], 5))
+    results['bytes_per_vector'] = embedder.dimensions * 4
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=2000, help='Size of the generated database')
+    parser.add_argument('--messages', type=int, default=20, help='Messages per generated conversation')
+    parser.add_argument('--dimensions', type=int, default=256, help='Vector size')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed calls per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='Write results to this JSON file instead of stdout')
+    args = parser.parse_args()
+
+    embedder = HashingEmbedder(args.dimensions)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = ConversationStorage(os.path.join(tmp, 'semantic.db'), embedder=embedder)
+        generate(storage, args.conversations, args.messages, args.seed)
+        parameters = {
+            'conversations': args.conversations,
+            'messages': args.conversations * args.messages,
+            'dimensions': args.dimensions,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        }
+        write_results('semantic', parameters, benchmark(storage, embedder, args.repeat, args.seed), args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""App start-up cost: module imports, cold start, and per-rerun overhead before and after caching.
+
+Usage: python benchmarks/bench_startup.py [--repeat R] [--out results.json]
+
+Streamlit re-executes src/assis.py on every rerun. This measures what the
+script pays before its first element can paint, in two shapes:
+
+    before   every rerun: load_dotenv(), a new ConversationStorage with its
+             schema check, and a new anthropic.Anthropic client, with the
+             SDK imported up front
+    after    the same objects from process-wide caches (st.cache_resource
+             in the app; functools.cache stands in for it here), with the
+             SDK imported only when a prompt is sent
+
+"cold_start" runs each shape in a fresh interpreter, imports included;
+"per_rerun" repeats it in one warm process. Packages that aren't installed
+are left out of both shapes and listed under "missing". With streamlit
+installed, "app" also times the real script through streamlit's AppTest.
+"""
+import argparse
+import functools
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Any, Callable
+
+from common import ROOT, sample, summarize, write_results  # also puts src/ on sys.path
+
+import storage as storage_module
+from storage import ConversationStorage
+
+# Third-party modules the app imports, then its own
+MODULES = ('streamlit', 'anthropic', 'dotenv', 'config', 'storage', 'chat', 'context',
+           'compare', 'streaming', 'metrics', 'sidebar')
+
+# Run in a fresh interpreter: {setup} is one of the shapes below, timed from
+# interpreter start-up to the point where the app would paint
+COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {src!r})
+{setup}
+print(json.dumps(time.perf_counter() - start))
+"""
+BEFORE = """
+import streamlit
+import anthropic
+from dotenv import load_dotenv
+from storage import ConversationStorage
+load_dotenv()
+ConversationStorage({db!r})
+anthropic.Anthropic(api_key='fake')
+"""
+AFTER = """
+import streamlit
+from dotenv import load_dotenv
+from storage import ConversationStorage
+load_dotenv()
+ConversationStorage({db!r})
+"""
+
+
+def installed(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+def without_missing(code: str, missing: list[str]) -> str:
+    """Drop the lines of a shape that use a package that isn't installed."""
+    return '\n'.join(line for line in code.splitlines()
+                     if not any(name in line for name in missing))
+
+
+def run_child(code: str) -> float:
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                            text=True, cwd=ROOT).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def cold_import(module: str, repeat: int) -> dict[str, Any]:
+    """Import time of one module in a fresh interpreter (its dependencies included)."""
+    code = COLD_START.format(src=str(ROOT / 'src'), setup=f'import {module}')
+    return summarize([run_child(code) for _ in range(repeat)])
+
+
+def cold_start(shape: str, db: str, missing: list[str], repeat: int) -> dict[str, Any]:
+    setup = without_missing(shape.format(db=db), missing)
+    return summarize([run_child(COLD_START.format(src=str(ROOT / 'src'), setup=setup))
+                      for _ in range(repeat)])
+
+
+def rerun_shapes(db: str, missing: list[str]) -> dict[str, Callable[[], Any]]:
+    """One rerun's worth of start-up work, before and after caching."""
+    load_dotenv = None if 'dotenv' in missing else importlib.import_module('dotenv').load_dotenv
+    anthropic = None if 'anthropic' in missing else importlib.import_module('anthropic')
+
+    def before():
+        if load_dotenv:
+            load_dotenv()
+        storage = ConversationStorage(db)
+        storage._init_database()  # ran on every construction before it was cached per process
+        if anthropic:
+            anthropic.Anthropic(api_key='fake')
+
+    @functools.cache
+    def load_api_key():
+        if load_dotenv:
+            load_dotenv()
+        return os.environ.get('ANTHROPIC_API_KEY')
+
+    @functools.cache
+    def get_storage():
+        return ConversationStorage(db)
+
+    def after():
+        load_api_key()
+        get_storage()
+
+    return {'before': before, 'after': after, 'ConversationStorage()': lambda: ConversationStorage(db)}
+
+
+def app_runs(tmp: str, repeat: int) -> dict[str, Any]:
+    """The real script under AppTest: its first run, then reruns of the same session."""
+    from streamlit.testing.v1 import AppTest
+
+    cwd = os.getcwd()
+    os.chdir(tmp)  # the app keeps assis_data.db in the working directory
+    try:
+        app = AppTest.from_file(str(ROOT / 'src' / 'assis.py'), default_timeout=60)
+        first = summarize(sample(app.run, 1))
+        return {'first_run': first, 'rerun': summarize(sample(app.run, repeat))}
+    finally:
+        os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per cold measurement')
+    parser.add_argument('--reruns', type=int, default=200, help='Timed reruns per warm measurement')
+    parser.add_argument('--out', help='Write results to this JSON file instead of stdout')
+    args = parser.parse_args()
+
+    missing = [name for name in ('streamlit', 'anthropic', 'dotenv') if not installed(name)]
+    results: dict[str, Any] = {'missing': missing, 'imports': {}, 'cold_start': {}, 'per_rerun': {}}
+
+    for module in MODULES:
+        if module in missing or (module == 'sidebar' and 'streamlit' in missing):
+            continue
+        results['imports'][module] = cold_import(module, args.repeat)
+        sys.stderr.write(f"import {module:20} p50 {results['imports'][module]['p50_ms']:10.2f} ms\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'startup.db')
+        results['cold_start']['new database'] = cold_start(AFTER, db, missing, 1)
+        for name, shape in (('before', BEFORE), ('after', AFTER)):
+            results['cold_start'][name] = cold_start(shape, db, missing, args.repeat)
+
+        storage_module._initialized.clear()
+        for name, fn in rerun_shapes(db, missing).items():
+            results['per_rerun'][name] = summarize(sample(fn, args.reruns))
+
+        if 'streamlit' not in missing:
+            results['app'] = app_runs(tmp, args.repeat)
+
+    for section in ('cold_start', 'per_rerun'):
+        for name, stats in results[section].items():
+            sys.stderr.write(f"{section + ' ' + name:35} p50 {stats['p50_ms']:10.3f} ms\n")
+    write_results('startup', {'repeat': args.repeat, 'reruns': args.reruns}, results, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""Per-method microbenchmarks for ConversationStorage.
+
+Usage: python benchmarks/bench_storage.py [--conversations N] [--messages M] [--repeat R] [--db PATH] [--out results.json]
+
+A temporary database is filled by generate_data.py first; pass --db to run
+against an existing (e.g. much larger, pre-generated) database instead.
+That database is written to: each write benchmark adds a few rows.
+
+Memoized reads are timed twice: cold, with the read cache dropped before
+every call so each one reaches SQLite, and "[cached]" with it left warm.
+Every public method should appear here; any that don't are listed under
+"not_benchmarked" in the results. "reused_generation_ids" is 1 if a
+generation started after another ended got the ended one's ID.
+"""
+import argparse
+import inspect
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from common import sample, summarize, timed, write_results  # also puts src/ on sys.path
+from generate_data import archive_lines, generate, paragraph
+
+import storage as storage_module
+from semantic import HashingEmbedder
+from storage import ConversationStorage
+
+MODEL = 'claude-haiku-4-5-20251001'
+
+
+class Bench:
+    """Collects timings for named cases."""
+
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results: dict[str, Any] = {}
+
+    def case(self, name: str, fn: Callable[[], Any], setup: Optional[Callable[[], Any]] = None,
+             repeat: Optional[int] = None):
+        self.results[name] = summarize(sample(fn, repeat or self.repeat, setup))
+        sys.stderr.write(f"{name:45} p50 {self.results[name]['p50_ms']:10.3f} ms\n")
+
+
+def benchmark(storage: ConversationStorage, repeat: int, seed: int = 0) -> dict[str, Any]:
+    rng = random.Random(seed)
+    bench = Bench(repeat)
+    ids = [conv['id'] for conv in storage.get_all_conversations()]
+    if not ids:
+        raise SystemExit('The database has no conversations; fill it with generate_data.py first')
+
+    def pick() -> int:
+        return rng.choice(ids)
+
+    def text() -> str:
+        return paragraph(rng, 4)
+
+    def cold():
+        storage._read_cache.bump()
+
+    def cold_exports():
+        storage._read_cache.bump()
+        storage_module._export_cache.clear()
+
+    def read(name: str, fn: Callable[[], Any], repeat: Optional[int] = None):
+        bench.case(name, fn, cold, repeat)
+        bench.case(f'{name}[cached]', fn, repeat=repeat)
+
+    # Conversations
+    bench.case('create_conversation', lambda: ids.append(storage.create_conversation('Benchmark')))
+    bench.case('update_conversation_title', lambda: storage.update_conversation_title(pick(), 'Renamed'))
+    bench.case('update_conversation_model', lambda: storage.update_conversation_model(pick(), MODEL))
+    read('get_conversation', lambda: storage.get_conversation(ids[len(ids) // 2]))
+    read('list_conversations[first page]', lambda: storage.list_conversations(limit=10))
+    middle = storage.get_conversation(ids[len(ids) // 2])
+    read('list_conversations[deep page]',
+         lambda: storage.list_conversations(limit=10, cursor=(middle['updated_at'], middle['id'])))
+    read('get_all_conversations', storage.get_all_conversations, repeat=max(1, repeat // 10))
+
+    # Messages and turns
+    conversation_id = ids[len(ids) // 2]
+    bench.case('add_message', lambda: storage.add_message(pick(), 'user', text(), input_tokens=10))
+    bench.case('save_turn', lambda: storage.save_turn(pick(), text(), text(), input_tokens=100,
+                                                       output_tokens=200, model=MODEL))
+    bench.case('save_compare_turn', lambda: storage.save_compare_turn(pick(), text(), [
+        {'content': text(), 'model': MODEL, 'output_tokens': 200},
+        {'content': text(), 'model': 'claude-sonnet-4-5-20250929', 'output_tokens': 250},
+    ]))
+    writer = ConversationStorage(storage.db_path, write_behind=True)
+    bench.case('queue_turn+flush_writes[50 turns]', lambda: (
+        [writer.queue_turn(pick(), text(), text(), output_tokens=200) for _ in range(50)],
+        writer.flush_writes()
+    ), repeat=max(1, repeat // 10))
+    bench.case('get_messages', lambda: storage.get_messages(conversation_id))
+    bench.case('get_messages[newest 50]', lambda: storage.get_messages(conversation_id, limit=50))
+    middle_id = storage.get_messages(conversation_id)[-10]['id']
+    bench.case('get_messages[50 before id]',
+               lambda: storage.get_messages(conversation_id, limit=50, before_id=middle_id))
+    bench.case('get_messages[after id]', lambda: storage.get_messages(conversation_id, after_id=middle_id))
+    bench.case('iter_messages', lambda: sum(1 for _ in storage.iter_messages(conversation_id)))
+
+    # Summaries
+    bench.case('save_summary', lambda: storage.save_summary(conversation_id, middle_id, text()))
+    read('get_latest_summary', lambda: storage.get_latest_summary(conversation_id))
+
+    # Branches: a separate conversation forked into four branches halfway through
+    branched = ids[len(ids) // 3]
+    fork_at = storage.get_messages(branched)[len(storage.get_messages(branched)) // 2]['id']
+    heads = [storage.get_conversation(branched)['head_id']]
+    for _ in range(3):
+        storage.switch_branch(branched, fork_at)
+        for _ in range(5):
+            storage.save_turn(branched, text(), text(), output_tokens=200, model=MODEL)
+        heads.append(storage.get_conversation(branched)['head_id'])
+    bench.case('switch_branch', lambda: storage.switch_branch(branched, rng.choice(heads)))
+    read('list_branches', lambda: storage.list_branches(branched))
+    bench.case('get_messages[branch]', lambda: storage.get_messages(branched, limit=50, head_id=heads[0]))
+
+    # Background generations: a reply checkpointed while it streams, then saved
+    running = []
+    bench.case('create_generation', lambda: running.append(
+        storage.create_generation(conversation_id, text(), MODEL, 'bench')))
+    bench.case('checkpoint_generation', lambda: storage.checkpoint_generation(rng.choice(running), text(), 'bench'))
+    bench.case('get_generation', lambda: storage.get_generation(rng.choice(running)))
+    bench.case('get_generations', lambda: storage.get_generations(conversation_id))
+    bench.case('fail_generation', lambda: storage.fail_generation(rng.choice(running), text(), 'Benchmark', 'bench'))
+    bench.case('claim_generation', lambda: storage.claim_generation(rng.choice(running), 'bench', ''))
+    bench.case('finish_generation', lambda: storage.finish_generation(running.pop(), text(), output_tokens=200,
+                                                                       model=MODEL),
+               repeat=len(running) // 2)
+    bench.case('discard_generation', lambda: storage.discard_generation(running.pop()), repeat=len(running))
+    # The worker of an ended generation may still hold its ID, so a new one
+    # started meanwhile must not get it back
+    ended = storage.create_generation(conversation_id, text(), MODEL, 'bench')
+    storage.discard_generation(ended)
+    started = storage.create_generation(conversation_id, text(), MODEL, 'bench')
+    storage.discard_generation(started)
+    bench.results['reused_generation_ids'] = int(started <= ended)
+
+    # Search
+    read('search[common word]', lambda: storage.search('sqlite'))
+    read('search[two words, prefix]', lambda: storage.search('query pla'))
+    read('search[no match]', lambda: storage.search('zebra'))
+
+    # Message vectors: a second handle with an embedder backfills the whole
+    # database once, then embeds each message it adds
+    vectors = ConversationStorage(storage.db_path, embedder=HashingEmbedder())
+    seconds, indexed = timed(vectors.index_message_vectors)
+    bench.results['index_message_vectors'] = {**summarize([seconds]), 'indexed': indexed}
+    bench.case('add_message[embedded]', lambda: vectors.add_message(pick(), 'user', text(), input_tokens=10))
+    bench.case('get_message_vectors[10000]', lambda: vectors.get_message_vectors(0, 10_000),
+               repeat=max(1, repeat // 10))
+    bench.case('count_message_vectors', vectors.count_message_vectors)
+
+    # Response cache
+    keys = [f'bench-{i}' for i in range(repeat)]
+    key_iter = iter(keys)
+    bench.case('put_cached_response', lambda: storage.put_cached_response(
+        next(key_iter), MODEL, text(), 100, 200, max_entries=1000, max_bytes=20 * 1024 * 1024, max_age_days=30))
+    bench.case('get_cached_response[hit]', lambda: storage.get_cached_response(rng.choice(keys), max_age_days=30))
+    bench.case('get_cached_response[miss]', lambda: storage.get_cached_response('absent', max_age_days=30))
+    bench.case('response_cache_stats', storage.response_cache_stats)
+    bench.case('clear_response_cache', storage.clear_response_cache, repeat=1)
+
+    # Turn metrics
+    turn = {'conversation_id': conversation_id, 'model': MODEL, 'source': 'api', 'ttft_seconds': 0.4,
+            'total_seconds': 3.2, 'output_tokens': 300, 'storage_calls': {'save_turn': {'calls': 1}}}
+    bench.case('record_turn_metrics+flush_writes[50 turns]', lambda: (
+        [storage.record_turn_metrics(turn, max_rows=10_000) for _ in range(50)],
+        storage.flush_writes()
+    ), repeat=max(1, repeat // 10))
+    bench.case('record_render_stats+flush_writes', lambda: (
+        storage.record_render_stats(1, {'render_seconds': 0.02, 'renders': 30}),
+        storage.flush_writes()
+    ))
+    read('turn_metrics_summary', lambda: storage.turn_metrics_summary(100))
+
+    # Usage rollups
+    read('usage_by_day[30 days]', lambda: storage.usage_by_day(30))
+    read('usage_by_day[all]', lambda: storage.usage_by_day(None))
+    read('usage_totals[by model]', lambda: storage.usage_totals(None))
+    read('usage_totals[by day]', lambda: storage.usage_totals(None, group_by='day'))
+    bench.case('rebuild_usage_rollups', storage.rebuild_usage_rollups, repeat=1)
+
+    # Settings
+    bench.case('save_setting', lambda: storage.save_setting('temperature', rng.random()))
+    bench.case('get_all_settings', storage.get_all_settings,
+               lambda: setattr(storage._read_cache, 'settings', None))
+    bench.case('get_all_settings[cached]', storage.get_all_settings)
+    bench.case('get_setting', lambda: storage.get_setting('temperature'))
+    bench.case('delete_setting', lambda: storage.delete_setting('absent'))
+
+    # Schema and maintenance
+    bench.case('schema_migrations', storage.schema_migrations)
+    bench.case('rewrite_message_bodies', storage.rewrite_message_bodies, repeat=1)
+
+    # Exports
+    bench.case('iter_conversation_markdown',
+               lambda: sum(1 for _ in storage.iter_conversation_markdown(conversation_id)))
+    bench.case('iter_conversation_json', lambda: sum(1 for _ in storage.iter_conversation_json(conversation_id)))
+    bench.case('export_conversation[markdown]',
+               lambda: storage.export_conversation(conversation_id, 'markdown'), cold_exports)
+    bench.case('export_conversation[json]',
+               lambda: storage.export_conversation(conversation_id, 'json'), cold_exports)
+    bench.case('get_cached_export[hit]', lambda: storage.get_cached_export(conversation_id, 'markdown'))
+    bench.case('export_conversation_to_markdown',
+               lambda: storage.export_conversation_to_markdown(conversation_id), cold_exports)
+    bench.case('export_conversation_to_json', lambda: storage.export_conversation_to_json(conversation_id))
+
+    # Bulk paths: a full export scales with the whole database, so it runs once
+    with open(os.devnull, 'w', encoding='utf-8') as sink:
+        seconds, _ = timed(lambda: storage.export_all(sink))
+    bench.results['export_all'] = summarize([seconds])
+    seeds = iter(range(seed + 1000, seed + 1000 + repeat))
+    bench.case('import_all[10 conversations]',
+               lambda: storage.import_all(archive_lines(10, 20, next(seeds))), repeat=max(1, repeat // 10))
+
+    seconds, _ = timed(storage.vacuum)
+    bench.results['vacuum'] = summarize([seconds])
+
+    # Archive: the oldest tenth of the conversations moves once, then single
+    # conversations are restored and the archive is read through fallbacks
+    updated = sorted(datetime.fromisoformat(conv['updated_at']) for conv in storage.get_all_conversations())
+    idle_days = (datetime.now() - updated[len(updated) // 10]).total_seconds() / 86400
+    seconds, archived = timed(lambda: storage.archive_conversations(idle_days, exclude=[conversation_id]))
+    bench.results['archive_conversations'] = {**summarize([seconds]), 'archived': archived}
+    archived_ids = [conv['id'] for conv in storage.list_conversations(limit=repeat + 1, archived=True)[0]]
+    read('list_conversations[archived]', lambda: storage.list_conversations(limit=10, archived=True))
+    read('get_conversation[archived]', lambda: storage.get_conversation(archived_ids[-1]))
+    bench.case('get_messages[archived]', lambda: storage.get_messages(archived_ids[-1], limit=50))
+    bench.case('restore_conversation', lambda: storage.restore_conversation(archived_ids.pop()),
+               repeat=min(repeat, len(archived_ids) - 1))
+
+    doomed = []
+    bench.case('delete_conversation', lambda: storage.delete_conversation(doomed.pop()),
+               lambda: doomed.append(storage.save_turn(None, text(), text())))
+    writer.flush_writes()
+
+    covered = {method for name in bench.results for method in name.split('[')[0].split('+')}
+    public = {name for name, _ in inspect.getmembers(ConversationStorage, inspect.isfunction)
+              if not name.startswith('_')}
+    bench.results['not_benchmarked'] = sorted(public - covered)
+    return bench.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=2000, help='Size of the generated database')
+    parser.add_argument('--messages', type=int, default=20, help='Messages per generated conversation')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed calls per method')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='Benchmark this existing database instead of generating one')
+    parser.add_argument('--out', help='Write results to this JSON file instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.db:
+            storage = ConversationStorage(args.db)
+        else:
+            storage = ConversationStorage(os.path.join(tmp, 'bench.db'))
+            generate(storage, args.conversations, args.messages, args.seed)
+        counts = storage.get_all_conversations()
+        parameters = {
+            'db': args.db,
+            'conversations': len(counts),
+            'messages': sum(conv['message_count'] for conv in counts),
+            'repeat': args.repeat,
+            'seed': args.seed,
+        }
+        write_results('storage', parameters, benchmark(storage, args.repeat, args.seed), args.out)
+
+
+if __name__ == '__main__':
+    main()
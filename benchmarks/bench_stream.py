@@ -0,0 +1,112 @@
+"""End-to-end chat latency against the local fake Anthropic server.
+
+Usage: python benchmarks/bench_stream.py [--runs N] [--tokens-per-sec R] [--reply-tokens T] [--out results.json]
+
+Each run goes through the app's own path: build_request() over a synthetic
+history, client.messages.stream() through the real SDK, stream_text() into
+a StreamRenderer. The placeholder only records what would be drawn, so the
+numbers are client-side overhead plus the server's configured pacing. One
+result set is produced per render interval, to show the redraw trade-off.
+"""
+import argparse
+import time
+
+import anthropic
+from common import summarize, write_results  # also puts src/ on sys.path
+from fake_anthropic import FakeAnthropicServer
+
+from chat import build_request, stream_text, usage_counts
+from streaming import StreamRenderer
+
+RENDER_INTERVALS = (0.0, 0.05, 0.1, 0.25)
+
+
+class RecordingPlaceholder:
+    """Stands in for st.empty(): counts redraws and the characters they carry."""
+
+    def __init__(self):
+        self.renders = 0
+        self.chars = 0
+
+    def markdown(self, text: str):
+        self.renders += 1
+        self.chars += len(text)
+
+
+def history(turns: int) -> list[dict[str, str]]:
+    messages = []
+    for i in range(turns):
+        messages.append({'role': 'user', 'content': f'Question {i}: how do WAL checkpoints work? ' * 4})
+        messages.append({'role': 'assistant', 'content': f'Answer {i}: ' + 'WAL appends pages to a log. ' * 30})
+    messages.append({'role': 'user', 'content': 'And how does that interact with readers?'})
+    return messages
+
+
+def run_once(client, request: dict, interval: float) -> dict:
+    placeholder = RecordingPlaceholder()
+    renderer = StreamRenderer(placeholder, interval=interval)
+    first_token = None
+    started = time.perf_counter()
+
+    def write(text: str):
+        nonlocal first_token
+        if first_token is None:
+            first_token = time.perf_counter()
+        renderer.write(text)
+
+    with client.messages.stream(**request) as stream:
+        final_message = stream_text(stream, write)
+    renderer.finish()
+    finished = time.perf_counter()
+
+    return {
+        'ttft': first_token - started if first_token else None,
+        'latency': finished - started,
+        'renders': placeholder.renders,
+        'rendered_chars': placeholder.chars,
+        'output_tokens': usage_counts(final_message.usage)['output_tokens'],
+    }
+
+
+def run(runs: int, tokens_per_sec: float, ttft: float, reply_tokens: int, turns: int) -> dict:
+    results = {}
+    with FakeAnthropicServer(tokens_per_sec=tokens_per_sec or None, ttft=ttft,
+                             reply_tokens=reply_tokens) as server:
+        client = anthropic.Anthropic(api_key='fake', base_url=server.base_url, max_retries=0)
+        request = build_request('claude-haiku-4-5-20251001', reply_tokens, 0.7,
+                                'You are a helpful assistant.', history(turns))
+        run_once(client, request, 0.1)  # warm up the connection pool and SDK imports
+
+        expected = ttft + (reply_tokens / tokens_per_sec if tokens_per_sec else 0)
+        for interval in RENDER_INTERVALS:
+            samples = [run_once(client, request, interval) for _ in range(runs)]
+            latencies = [s['latency'] for s in samples]
+            results[f'interval_{interval}'] = {
+                'ttft': summarize([s['ttft'] for s in samples if s['ttft'] is not None]),
+                'latency': summarize(latencies),
+                'overhead_ms': round((sum(latencies) / runs - expected) * 1000, 3),
+                'renders': sum(s['renders'] for s in samples) / runs,
+                'rendered_chars': sum(s['rendered_chars'] for s in samples) / runs,
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--tokens-per-sec', type=float, default=200, help='Server pace; 0 for unthrottled')
+    parser.add_argument('--ttft', type=float, default=0.05, help='Server delay before the first token')
+    parser.add_argument('--reply-tokens', type=int, default=400)
+    parser.add_argument('--turns', type=int, default=10, help='Turns of history sent with each request')
+    parser.add_argument('--out', help='Write results to this JSON file instead of stdout')
+    args = parser.parse_args()
+
+    parameters = vars(args).copy()
+    parameters.pop('out')
+    write_results('stream', parameters,
+                  run(args.runs, args.tokens_per_sec, args.ttft, args.reply_tokens, args.turns),
+                  args.out)
+
+
+if __name__ == '__main__':
+    main()
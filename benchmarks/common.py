@@ -0,0 +1,88 @@
+"""Shared helpers for the benchmark scripts: timing, statistics and JSON results.
+
+Importing this module puts src/ on sys.path, so benchmarks can import the
+app modules directly.
+"""
+import json
+import math
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'src'))
+
+
+def timed(fn: Callable[[], Any]) -> tuple[float, Any]:
+    """Run fn once and return (seconds, result)."""
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def sample(fn: Callable[[], Any], repeat: int, setup: Optional[Callable[[], Any]] = None) -> list[float]:
+    """Time `repeat` calls of fn, running the untimed setup() before each one."""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        seconds, _ = timed(fn)
+        samples.append(seconds)
+    return samples
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of values, q in 0..100."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples: list[float]) -> dict[str, Any]:
+    """Millisecond statistics for a list of timings in seconds."""
+    return {
+        'n': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 4),
+        'p50_ms': round(percentile(samples, 50) * 1000, 4),
+        'p95_ms': round(percentile(samples, 95) * 1000, 4),
+        'min_ms': round(min(samples) * 1000, 4),
+        'max_ms': round(max(samples) * 1000, 4),
+    }
+
+
+def environment() -> dict[str, Any]:
+    """Where and when the results were produced."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+    }
+
+
+def write_results(benchmark: str, parameters: dict[str, Any], results: dict[str, Any],
+                  out: Optional[str] = None):
+    """Write results as JSON to `out`, or stdout, for compare_results.py."""
+    text = json.dumps({
+        'benchmark': benchmark,
+        'environment': environment(),
+        'parameters': parameters,
+        'results': results,
+    }, indent=2)
+    if out:
+        Path(out).write_text(text + '\n', encoding='utf-8')
+    else:
+        sys.stdout.write(text + '\n')
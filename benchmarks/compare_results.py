@@ -0,0 +1,71 @@
+"""Compare two benchmark result files and flag regressions.
+
+Usage: python benchmarks/compare_results.py BASELINE.json CURRENT.json [--threshold 0.2] [--metric p50_ms]
+
+Every timing present in both files is compared; lower is better. Exits
+with status 1 if any timing got slower by more than the threshold
+(a fraction: 0.2 means 20%), so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+
+def timings(results: dict[str, Any], metric: str, prefix: str = '') -> Iterator[tuple[str, float]]:
+    """Yield (dotted name, value) for every `metric` entry in a results tree."""
+    for name, value in results.items():
+        if isinstance(value, dict):
+            if isinstance(value.get(metric), (int, float)):
+                yield prefix + name, value[metric]
+            else:
+                yield from timings(value, metric, f'{prefix}{name}.')
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], metric: str,
+            threshold: float) -> list[dict[str, Any]]:
+    before = dict(timings(baseline['results'], metric))
+    after = dict(timings(current['results'], metric))
+    rows = []
+    for name in sorted(before.keys() & after.keys()):
+        change = (after[name] - before[name]) / before[name] if before[name] else 0.0
+        rows.append({
+            'name': name,
+            'before': before[name],
+            'after': after[name],
+            'change': change,
+            'regressed': change > threshold,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--metric', default='p50_ms')
+    args = parser.parse_args()
+
+    baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+    current = json.loads(Path(args.current).read_text(encoding='utf-8'))
+    if baseline.get('benchmark') != current.get('benchmark'):
+        sys.exit(f"Results are from different benchmarks: {baseline.get('benchmark')} vs {current.get('benchmark')}")
+
+    rows = compare(baseline, current, args.metric, args.threshold)
+    width = max((len(row['name']) for row in rows), default=4)
+    for row in rows:
+        flag = '  REGRESSION' if row['regressed'] else ''
+        sys.stdout.write(f"{row['name']:{width}}  {row['before']:12.3f}  {row['after']:12.3f}  "
+                         f"{row['change']:+8.1%}{flag}\n")
+
+    regressions = sum(row['regressed'] for row in rows)
+    sys.stdout.write(f'\n{len(rows)} timings compared ({args.metric}), '
+                     f'{regressions} regressed by more than {args.threshold:.0%}\n')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Local stand-in for the Anthropic Messages API, for offline benchmarks.
+
+Usage: python benchmarks/fake_anthropic.py [--port 8765] [--tokens-per-sec 80] [--ttft 0.3]
+
+Serves POST /v1/messages both as a server-sent event stream (the
+message_start / content_block_delta / message_delta / message_stop sequence
+that client.messages.stream() consumes) and as a plain JSON reply. Replies
+are filler words, one per output token, paced at --tokens-per-sec after a
+--ttft delay. The text is seeded by the request body, so identical requests
+get identical replies. Point the app or the SDK at it with:
+
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=fake streamlit run src/assis.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+FILLER = [
+    'the', 'a', 'of', 'to', 'and', 'in', 'is', 'that', 'for', 'it', 'as', 'with', 'on', 'be',
+    'by', 'this', 'are', 'from', 'at', 'or', 'an', 'which', 'query', 'index', 'cache', 'stream',
+    'token', 'model', 'page', 'batch', 'commit', 'thread', 'write', 'read', 'row',
+]
+CHARS_PER_TOKEN = 4
+
+
+class FakeAnthropicServer(ThreadingHTTPServer):
+    """HTTP server answering /v1/messages with paced, deterministic filler replies.
+
+    tokens_per_sec of None streams as fast as possible. error_rate is the
+    fraction of requests answered with a 529 overloaded error, for exercising
+    retries.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, tokens_per_sec: Optional[float] = 80,
+                 ttft: float = 0.3, reply_tokens: int = 300, tokens_per_delta: int = 1,
+                 error_rate: float = 0.0):
+        super().__init__((host, port), FakeAnthropicHandler)
+        self.tokens_per_sec = tokens_per_sec
+        self.ttft = ttft
+        self.reply_tokens = reply_tokens
+        self.tokens_per_delta = tokens_per_delta
+        self.error_rate = error_rate
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeAnthropicServer':
+        """Serve from a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-anthropic', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count_request(self) -> int:
+        with self._lock:
+            self.requests_served += 1
+            return self.requests_served
+
+
+class FakeAnthropicHandler(BaseHTTPRequestHandler):
+    server: FakeAnthropicServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/v1/messages':
+            self._send_json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}})
+            return
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        request = json.loads(body or b'{}')
+        self.server.count_request()
+
+        # Errors are drawn independently of the body, so a retry can succeed
+        if random.random() < self.server.error_rate:
+            self._send_json(529, {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Overloaded'}})
+            return
+
+        rng = random.Random(hashlib.sha256(body).digest())
+
+        max_tokens = request.get('max_tokens') or self.server.reply_tokens
+        tokens = [rng.choice(FILLER) + ' ' for _ in range(min(self.server.reply_tokens, max_tokens))]
+        usage = {
+            'input_tokens': max(1, len(body) // CHARS_PER_TOKEN),
+            'output_tokens': len(tokens),
+            'cache_creation_input_tokens': 0,
+            'cache_read_input_tokens': 0,
+        }
+        message = {
+            'id': f'msg_{uuid.uuid4().hex[:24]}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': request.get('model', 'fake-model'),
+            'content': [],
+            'stop_reason': None,
+            'stop_sequence': None,
+            'usage': usage,
+        }
+        stop_reason = 'max_tokens' if len(tokens) >= max_tokens else 'end_turn'
+
+        if request.get('stream'):
+            self._stream(message, tokens, stop_reason)
+        else:
+            time.sleep(self.server.ttft + self._seconds_for(len(tokens)))
+            message['content'] = [{'type': 'text', 'text': ''.join(tokens)}]
+            message['stop_reason'] = stop_reason
+            self._send_json(200, message)
+
+    def _seconds_for(self, tokens: int) -> float:
+        rate = self.server.tokens_per_sec
+        return tokens / rate if rate else 0.0
+
+    def _stream(self, message: dict[str, Any], tokens: list[str], stop_reason: str):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        usage = message['usage']
+        self._event('message_start', {'type': 'message_start',
+                                      'message': {**message, 'usage': {**usage, 'output_tokens': 1}}})
+        self._event('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                            'content_block': {'type': 'text', 'text': ''}})
+        self._event('ping', {'type': 'ping'})
+
+        # Pace deltas against a fixed schedule so write overhead doesn't accumulate
+        step = self.server.tokens_per_delta
+        started = time.perf_counter() + self.server.ttft
+        for start in range(0, len(tokens), step):
+            delay = started + self._seconds_for(start) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._event('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                                'delta': {'type': 'text_delta',
+                                                          'text': ''.join(tokens[start:start + step])}})
+
+        self._event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        self._event('message_delta', {'type': 'message_delta',
+                                      'delta': {'stop_reason': stop_reason, 'stop_sequence': None},
+                                      'usage': {'output_tokens': usage['output_tokens']}})
+        self._event('message_stop', {'type': 'message_stop'})
+
+    def _event(self, name: str, data: dict[str, Any]):
+        self.wfile.write(f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode())
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: dict[str, Any]):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--tokens-per-sec', type=float, default=80, help='Output pace; 0 for unthrottled')
+    parser.add_argument('--ttft', type=float, default=0.3, help='Seconds before the first token')
+    parser.add_argument('--reply-tokens', type=int, default=300, help='Tokens per reply (capped by max_tokens)')
+    parser.add_argument('--tokens-per-delta', type=int, default=1)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 529')
+    args = parser.parse_args()
+
+    server = FakeAnthropicServer(args.host, args.port, args.tokens_per_sec or None, args.ttft,
+                                 args.reply_tokens, args.tokens_per_delta, args.error_rate)
+    sys.stderr.write(f'Fake Anthropic API on {server.base_url} (Ctrl+C to stop)\n')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Fill an assis database with synthetic conversations.
+
+Usage: python benchmarks/generate_data.py [--db assis_data.db] [--conversations N] [--messages M] [--seed S]
+
+Rows go in through ConversationStorage.import_all(), the same batched path
+as a restored backup, so indexes, search triggers and totals all match a
+database filled by the app. Output is deterministic for a given seed;
+running again with the same seed adds nothing, with a new seed it appends.
+"""
+import argparse
+import json
+import random
+import sys
+import uuid
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+
+from common import timed  # also puts src/ on sys.path
+
+from config import model_options
+from storage import ARCHIVE_FORMAT, ARCHIVE_VERSION, ConversationStorage
+
+WORDS = [
+    'sqlite', 'wal', 'checkpoint', 'index', 'query', 'plan', 'cursor', 'transaction', 'commit',
+    'rollback', 'page', 'cache', 'python', 'streamlit', 'session', 'state', 'token', 'model',
+    'prompt', 'context', 'summary', 'stream', 'latency', 'thread', 'lock', 'queue', 'batch',
+    'vector', 'embedding', 'search', 'ranking', 'snippet', 'export', 'import', 'archive',
+    'migration', 'schema', 'column', 'trigger', 'view', 'blob', 'compression', 'benchmark',
+    'profile', 'memory', 'disk', 'network', 'request', 'response', 'retry', 'timeout', 'error',
+    'function', 'class', 'module', 'package', 'test',
+]
+
+# Fixed rather than now(), so a seed always yields the same rows.
+END = datetime(2026, 1, 1)
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    text = ' '.join(rng.choices(WORDS, k=words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def paragraph(rng: random.Random, sentences: int) -> str:
+    return ' '.join(sentence(rng, rng.randint(6, 18)) for _ in range(sentences))
+
+
+def archive_lines(conversations: int, messages: int, seed: int = 0) -> Iterator[str]:
+    """Yield an export_all()-style JSONL archive of synthetic conversations.
+
+    Each conversation has `messages` alternating user/assistant messages
+    (rounded down to whole turns), short questions and longer replies, a
+    random model and timestamps spread over the year before END.
+    """
+    rng = random.Random(seed)
+    yield json.dumps({'type': 'header', 'format': ARCHIVE_FORMAT, 'version': ARCHIVE_VERSION})
+
+    for _ in range(conversations):
+        conversation_uuid = str(uuid.UUID(int=rng.getrandbits(128)))
+        model = rng.choice(model_options)
+        started = END - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+        timestamp = started
+        records = []
+        for _ in range(messages // 2):
+            timestamp += timedelta(seconds=rng.randint(5, 600))
+            records.append({
+                'type': 'message', 'conversation_uuid': conversation_uuid,
+                'role': 'user', 'content': paragraph(rng, rng.randint(1, 3)),
+                'timestamp': timestamp.isoformat(),
+            })
+            timestamp += timedelta(seconds=rng.randint(2, 60))
+            input_tokens = rng.randint(50, 4000)
+            records.append({
+                'type': 'message', 'conversation_uuid': conversation_uuid,
+                'role': 'assistant', 'content': paragraph(rng, rng.randint(3, 15)),
+                'timestamp': timestamp.isoformat(),
+                'input_tokens': input_tokens, 'output_tokens': rng.randint(20, 1500),
+                'cache_read_tokens': rng.randint(0, input_tokens), 'model': model,
+            })
+
+        yield json.dumps({
+            'type': 'conversation', 'uuid': conversation_uuid,
+            'title': sentence(rng, rng.randint(2, 6))[:50],
+            'created_at': started.isoformat(), 'updated_at': timestamp.isoformat(),
+            'model_used': model,
+        })
+        for record in records:
+            yield json.dumps(record)
+
+
+def generate(storage: ConversationStorage, conversations: int, messages: int,
+             seed: int = 0, batch_size: int = 5000) -> dict[str, int]:
+    """Import synthetic conversations into storage and return the import counts."""
+    return storage.import_all(archive_lines(conversations, messages, seed), batch_size=batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='assis_data.db', help='Database to fill (created if missing)')
+    parser.add_argument('--conversations', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20, help='Messages per conversation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=5000, help='Records per transaction')
+    args = parser.parse_args()
+
+    storage = ConversationStorage(args.db)
+    seconds, counts = timed(lambda: generate(storage, args.conversations, args.messages,
+                                             args.seed, args.batch_size))
+    rate = counts['messages'] / seconds if seconds else 0
+    sys.stderr.write(f"{counts['conversations']} conversations, {counts['messages']} messages "
+                     f'in {seconds:.1f}s ({rate:,.0f} messages/s)\n')
+
+
+if __name__ == '__main__':
+    main()
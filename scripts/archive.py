@@ -0,0 +1,37 @@
+"""Back up or migrate the whole database as a JSONL archive.
+
+Usage:
+    python scripts/archive.py export backup.jsonl.gz [--db assis_data.db]
+    python scripts/archive.py import backup.jsonl.gz [--db assis_data.db]
+
+Archives ending in .gz are gzip-compressed; .zst needs the zstandard package.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from storage import ConversationStorage, open_archive  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('action', choices=['export', 'import'])
+    parser.add_argument('path', help='Archive file (.jsonl, .jsonl.gz or .jsonl.zst)')
+    parser.add_argument('--db', default='assis_data.db', help='Database file (default: assis_data.db)')
+    args = parser.parse_args()
+
+    storage = ConversationStorage(args.db)
+    if args.action == 'export':
+        with open_archive(args.path, 'w') as f:
+            counts = storage.export_all(f)
+    else:
+        with open_archive(args.path, 'r') as f:
+            counts = storage.import_all(f)
+    sys.stdout.write(json.dumps(counts) + '\n')
+
+
+if __name__ == '__main__':
+    main()
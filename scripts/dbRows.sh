@@ -21,6 +21,8 @@ echo -n "  Conversations: "
 sqlite3 assis_data.db "SELECT COUNT(*) FROM conversations;"
 echo -n "  Messages: "
 sqlite3 assis_data.db "SELECT COUNT(*) FROM messages;"
+echo -n "  Message blobs: "
+sqlite3 assis_data.db "SELECT COUNT(*) FROM message_blobs;"
 echo -n "  Settings: "
 sqlite3 assis_data.db "SELECT COUNT(*) FROM settings;"
 echo ""
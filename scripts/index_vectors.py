@@ -0,0 +1,38 @@
+"""Embed the messages of an existing database for semantic search.
+
+Usage:
+    python scripts/index_vectors.py [--db assis_data.db] [--dimensions 256] [--batch-size 500]
+
+New messages are embedded as they are saved once the app runs with an
+embedder; this backfills the ones saved before (see
+ConversationStorage.index_message_vectors()). It only embeds messages that
+have no vector yet, in short transactions, so it can be stopped and rerun
+and can share the database with a running app.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from config import semantic_dimensions  # noqa: E402
+from semantic import HashingEmbedder  # noqa: E402
+from storage import ConversationStorage  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='assis_data.db', help='Database file (default: assis_data.db)')
+    parser.add_argument('--dimensions', type=int, default=semantic_dimensions, help='Vector size')
+    parser.add_argument('--batch-size', type=int, default=500, help='Messages per transaction')
+    args = parser.parse_args()
+
+    storage = ConversationStorage(args.db, embedder=HashingEmbedder(args.dimensions))
+    indexed = storage.index_message_vectors(batch_size=args.batch_size)
+    result = {'indexed': indexed, 'vectors': storage.count_message_vectors()}
+    sys.stdout.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Convert an existing database to compressed, deduplicated message storage.
+
+Usage:
+    python scripts/rewrite_messages.py [--db assis_data.db] [--codec zlib|zstd] [--no-vacuum]
+
+Moves message bodies stored inline into message_blobs (see
+ConversationStorage.rewrite_message_bodies()), recompresses blobs written with
+another codec, then vacuums so the file actually shrinks. The rewrite runs in
+short transactions and can share the database with a running app; the vacuum
+needs it to be idle.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from storage import BLOB_CODEC, BLOB_CODECS, ConversationStorage  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='assis_data.db', help='Database file (default: assis_data.db)')
+    parser.add_argument('--codec', choices=BLOB_CODECS, default=BLOB_CODEC, help='Compression for message blobs')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Messages per transaction')
+    parser.add_argument('--no-vacuum', action='store_true', help='Skip the final VACUUM')
+    args = parser.parse_args()
+
+    size_before = os.path.getsize(args.db)
+    storage = ConversationStorage(args.db, codec=args.codec)
+    counts = storage.rewrite_message_bodies(batch_size=args.batch_size)
+    if not args.no_vacuum:
+        storage.vacuum()
+    counts['bytes_before'] = size_before
+    counts['bytes_after'] = os.path.getsize(args.db)
+    sys.stdout.write(json.dumps(counts) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Run a JSONL file of prompts through the chat pipeline, headless and concurrently.
+
+Usage:
+    python scripts/run_batch.py prompts.jsonl [--out results.jsonl] [--db assis_data.db]
+        [--concurrency 8] [--model M] [--preset P] [--system S] [--temperature T] [--max-tokens N]
+
+Prompts use the format described in src/batch.py; "-" reads them from
+stdin. Every prompt is saved as a conversation turn like one sent from the
+app, and one result line (reply, latency and token counts) is written per
+prompt as it finishes, to --out or stdout. Batch totals go to stderr.
+
+The API key is read like the app reads it (ANTHROPIC_API_KEY, or .env).
+To run offline against the local fake server:
+
+    python benchmarks/fake_anthropic.py --port 8765 &
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=fake \\
+        python scripts/run_batch.py prompts.jsonl --db /tmp/batch.db
+"""
+import argparse
+import json
+import os
+import sys
+from contextlib import ExitStack
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+import anthropic  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+
+from batch import batch_defaults, read_prompts, run_batch  # noqa: E402
+from config import batch_concurrency, message_codec, model_pricing, semantic_dimensions  # noqa: E402
+from semantic import HashingEmbedder  # noqa: E402
+from storage import ConversationStorage  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='Prompts file (.jsonl), or - for stdin')
+    parser.add_argument('--out', help='Write result lines to this file instead of stdout')
+    parser.add_argument('--db', default='assis_data.db', help='Database file (default: assis_data.db)')
+    parser.add_argument('--concurrency', type=int, default=batch_concurrency, help='Prompts in flight at once')
+    parser.add_argument('--model', help='Default model (else the saved setting)')
+    parser.add_argument('--preset', help='Default system message preset (else the saved setting)')
+    parser.add_argument('--system', help='Default system message, instead of a preset')
+    parser.add_argument('--temperature', type=float, help='Default temperature (else the saved setting)')
+    parser.add_argument('--max-tokens', type=int, help='Default max_tokens (else the saved setting)')
+    parser.add_argument('--base-url', help='API base URL (default: ANTHROPIC_BASE_URL or the real API)')
+    parser.add_argument('--max-retries', type=int, default=2, help='SDK retries per request')
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = anthropic.Anthropic(
+        api_key=os.environ.get('ANTHROPIC_API_KEY'),
+        base_url=args.base_url,
+        max_retries=args.max_retries,
+    )
+    storage = ConversationStorage(args.db, write_behind=True, codec=message_codec, pricing=model_pricing,
+                                  embedder=HashingEmbedder(semantic_dimensions))
+    defaults = batch_defaults(storage.get_all_settings(), model=args.model, preset=args.preset,
+                              system=args.system, temperature=args.temperature, max_tokens=args.max_tokens)
+
+    with ExitStack() as stack:
+        source = sys.stdin if args.input == '-' else stack.enter_context(open(args.input, encoding='utf-8'))
+        out = stack.enter_context(open(args.out, 'w', encoding='utf-8')) if args.out else sys.stdout
+        summary = run_batch(client, storage, read_prompts(source), out, defaults, args.concurrency)
+    sys.stderr.write(json.dumps(summary) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Compact the database and switch it to incremental auto-vacuum.
+
+Usage:
+    python scripts/vacuum.py [--db assis_data.db]
+
+Databases created before auto_vacuum=incremental keep their free pages
+until a VACUUM converts them, so archiving idle conversations never shrinks
+the file. Run this once on such a database (see
+ConversationStorage.vacuum()); afterwards archiving returns freed space on
+its own. VACUUM copies the whole file under an exclusive lock, so stop the
+app first.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from storage import ConversationStorage  # noqa: E402
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def auto_vacuum_mode(db_path: str) -> str:
+    conn = sqlite3.connect(db_path)
+    try:
+        return AUTO_VACUUM_MODES[conn.execute('PRAGMA auto_vacuum').fetchone()[0]]
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='assis_data.db', help='Database file (default: assis_data.db)')
+    args = parser.parse_args()
+
+    result = {'auto_vacuum_before': auto_vacuum_mode(args.db), 'bytes_before': os.path.getsize(args.db)}
+    ConversationStorage(args.db).vacuum()
+    result['auto_vacuum_after'] = auto_vacuum_mode(args.db)
+    result['bytes_after'] = os.path.getsize(args.db)
+    sys.stdout.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
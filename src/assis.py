@@ -1,15 +1,74 @@
 import os
 
-import anthropic
 import streamlit as st
 from dotenv import load_dotenv
 
-from sidebar import render_sidebar
-from storage import ConversationStorage
-
-# environment variable for Anthropic API key
-load_dotenv()  # Load variables from .env file if present to os.environ (apparently this loads to the OS)
-api_key = os.environ.get('ANTHROPIC_API_KEY')
+from chat import (
+    build_request,
+    message_window,
+)
+from compare import fan_out
+from config import (
+    context_token_budgets,
+    default_context_token_budget,
+    message_codec,
+    message_window_size,
+    model_pricing,
+    semantic_dimensions,
+    stream_render_interval,
+    stream_render_min_chars,
+    summary_max_tokens,
+    summary_model,
+    turn_metrics_max_rows,
+)
+from context import ContextManager, make_summarizer, with_summary
+from generation import (
+    follow,
+    get_generation,
+    pending_generations,
+    resume,
+    start_generation,
+)
+from metrics import TurnTimer, finish_profile, start_profile
+from semantic import HashingEmbedder
+from sidebar import load_conversation, render_sidebar
+from storage import TOKEN_FIELDS, ConversationStorage
+from streaming import StreamRenderer
+
+# Streamlit re-executes this script on every rerun of every session; the
+# resources below are created once per process and shared by all of them.
+
+@st.cache_resource(show_spinner=False)
+def load_api_key():
+    """Load .env into os.environ (once) and return the Anthropic API key."""
+    load_dotenv()
+    return os.environ.get('ANTHROPIC_API_KEY')
+
+@st.cache_resource(show_spinner=False)
+def get_storage():
+    """The process's ConversationStorage; its schema check runs once, here.
+
+    ASSIS_WRITE_BEHIND=1 saves turns from a background writer,
+    ASSIS_SINGLE_WRITER=1 sends every write through it, and
+    ASSIS_WRITE_LOCK=1 makes app processes sharing the database take turns writing.
+    New messages are embedded for semantic search as they are saved.
+    """
+    return ConversationStorage(
+        write_behind=os.environ.get('ASSIS_WRITE_BEHIND') == '1',
+        codec=message_codec,
+        single_writer=os.environ.get('ASSIS_SINGLE_WRITER') == '1',
+        write_lock=os.environ.get('ASSIS_WRITE_LOCK') == '1',
+        pricing=model_pricing,
+        embedder=HashingEmbedder(semantic_dimensions),
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_client(key):
+    """One Anthropic client (and HTTP connection pool) per API key."""
+    import anthropic
+    return anthropic.Anthropic(api_key=key)
+
+api_key = load_api_key()
 
 # Page Configuration
 st.set_page_config(
@@ -18,182 +77,327 @@ st.set_page_config(
     layout='wide'
 )
 
-# Initialize storage
-storage = ConversationStorage()
-
-st.title('🤖 My AI Learning Assistant')
-st.caption('Built while learning AI - Meta learning in action!')
+# With ASSIS_PROFILE set, profile this rerun if one is due (see metrics.py)
+profiler = start_profile(st.query_params)
+
+# Everything after this point runs under the profile; st.rerun() and st.stop()
+# end the run early by raising, so the profile is finished in a finally
+try:
+    storage = get_storage()
+
+    st.title('🤖 My AI Learning Assistant')
+    st.caption('Built while learning AI - Meta learning in action!')
+
+    def auto_scroll():
+        js = """
+        <script>
+            function scroll() {
+                window.scrollTo(0, document.body.scrollHeight);
+            }
+            scroll();
+        </script>
+        """
+        st.components.v1.html(js, height=0)
+
+    def render_replies(replies):
+        """Show a compare-mode turn as one column per model."""
+        for column, reply in zip(st.columns(len(replies)), replies):
+            with column:
+                st.caption(reply.get('model') or 'unknown model')
+                st.markdown(reply['content'])
+
+    def run_compare(models, request_for):
+        """Stream one request per model side by side and return the successful replies."""
+        columns = st.columns(len(models))
+        renderers = {}
+        for column, compare_model in zip(columns, models):
+            with column:
+                st.caption(compare_model)
+                renderers[compare_model] = StreamRenderer(
+                    st.empty(),
+                    interval=stream_render_interval,
+                    min_chars=stream_render_min_chars
+                )
 
-def auto_scroll():
-    js = """
-    <script>
-        function scroll() {
-            window.scrollTo(0, document.body.scrollHeight);
-        }
-        scroll();
-    </script>
-    """
-    st.components.v1.html(js, height=0)
-
-# Initialize session state for conversation history and token tracking
-if 'messages' not in st.session_state:
-    st.session_state.messages = []
-if 'token_usage' not in st.session_state:
-    st.session_state.token_usage = {'input_tokens': 0, 'output_tokens': 0}
-if 'model_used' not in st.session_state:
-    st.session_state.model_used = None
-if 'current_conversation_id' not in st.session_state:
-    st.session_state.current_conversation_id = None
-
-# Sidebar for API key and settings
-config = render_sidebar(storage)
-model = config['model']
-temperature = config['temperature']
-max_tokens = config['max_tokens']
-system_message = config['system_message']
-
-# Display conversation history
-for message in st.session_state.messages:
-    with st.chat_message(message['role']):
-        st.markdown(message['content'])
-
-if not api_key:
-    st.error('⚠️ Please enter your Anthropic API key in the sidebar!')
-    st.stop()
-# Create Anthropic client
-client = anthropic.Anthropic(api_key=api_key)
-
-# Chat input
-if prompt := st.chat_input('Ask me anything about AI, coding, or help building this app!'):
-
-    # Check if API key is provided
-
-    # Add user message to history
-    st.session_state.messages.append({'role': 'user', 'content': prompt})
-
-    # Display user message
-    with st.chat_message('user'):
-        st.markdown(prompt)
         auto_scroll()
-
-    # Get AI response
-    with st.chat_message('assistant'):
-        message_placeholder = st.empty()
-        full_response = ''
-
-        try:
-            # Prepare messages for API (convert session state format to API format)
-            api_messages = [
-                {'role': msg['role'], 'content': msg['content']}
-                for msg in st.session_state.messages
-            ]
-
-            # Stream the response
-            message_stream = client.messages.stream(
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                messages=api_messages,
-                system=system_message,
-            )
-
-            with message_stream as stream:
-                # Auto scroll to bottom
-                auto_scroll()
-                for chunk in stream:
-                    delta = getattr(chunk, 'delta', None)
-                    if delta is not None and getattr(delta, 'text', None):
-                        # Add the new text chunk to the response
-                        full_response += chunk.delta.text
-                        message_placeholder.markdown(full_response + '▌')
-                    # Capture model information
-                    model_used = getattr(getattr(chunk, 'message', None), 'model', None)
-                    if model_used:
-                        st.session_state.model_used = chunk.message.model
-                    # token usage (if present)
-                    usage = getattr(getattr(chunk, 'message', None), 'usage', None)
-                    if usage:
-                        # Update token usage when we get the final message
-                        usage = chunk.message.usage
-                        st.session_state.token_usage['input_tokens'] += usage.input_tokens
-                        st.session_state.token_usage['output_tokens'] += usage.output_tokens
-
-
-            # Display final response
-            message_placeholder.markdown(full_response)
-
-
-            # Add assistant response to history
-            st.session_state.messages.append({
-                'role': 'assistant',
-                'content': full_response
-            })
-
-            # Save to database
+        results = fan_out(
+            client,
+            {compare_model: request_for(compare_model) for compare_model in models},
+            on_delta=lambda compare_model, text: renderers[compare_model].write(text)
+        )
+
+        replies = []
+        for column, compare_model in zip(columns, models):
+            renderers[compare_model].finish()
+            result = results[compare_model]
+            if not isinstance(result, Exception):
+                result['render_stats'] = renderers[compare_model].stats()
+            with column:
+                if isinstance(result, Exception):
+                    st.error(f'Error: {str(result)}')
+                    continue
+                tokens_per_sec = f" · {result['tokens_per_sec']} tok/s" if result['tokens_per_sec'] else ''
+                st.caption(f"First token {result['ttft']}s · total {result['latency']}s{tokens_per_sec}")
+            replies.append(result)
+        return replies
+
+    # Initialize session state for conversation history and token tracking
+    if 'messages' not in st.session_state:
+        st.session_state.messages = []
+    if 'token_usage' not in st.session_state:
+        st.session_state.token_usage = {'input_tokens': 0, 'output_tokens': 0}
+    if 'model_used' not in st.session_state:
+        st.session_state.model_used = None
+    if 'current_conversation_id' not in st.session_state:
+        st.session_state.current_conversation_id = None
+    if 'earlier_messages_id' not in st.session_state:
+        st.session_state.earlier_messages_id = None
+
+    # Sidebar for API key and settings
+    config = render_sidebar(storage)
+    model = config['model']
+    temperature = config['temperature']
+    max_tokens = config['max_tokens']
+    system_message = config['system_message']
+    compare_models = config['compare_models']
+
+    # Display conversation history: only the loaded window of a long
+    # conversation, with older messages fetched a page at a time on request
+    if (st.session_state.earlier_messages_id is not None and st.session_state.current_conversation_id
+            and st.button('⬆️ Load earlier messages')):
+        earlier, st.session_state.earlier_messages_id = message_window(
+            storage,
+            st.session_state.current_conversation_id,
+            message_window_size,
+            before_id=st.session_state.earlier_messages_id
+        )
+        st.session_state.messages = earlier + st.session_state.messages
+        st.rerun()
+
+    for message in st.session_state.messages:
+        with st.chat_message(message['role']):
+            if message.get('replies'):
+                render_replies(message['replies'])
+            else:
+                st.markdown(message['content'])
+            # Forking moves the branch head back to before this prompt; the next
+            # prompt then starts a new branch that shares everything before it
+            if (message['role'] == 'user' and 'parent_id' in message and st.session_state.current_conversation_id
+                    and st.button('🌿', key=f"fork_{message['id']}", help='Ask this differently in a new branch')):
+                storage.switch_branch(st.session_state.current_conversation_id, message['parent_id'])
+                load_conversation(storage, storage.get_conversation(st.session_state.current_conversation_id))
+                st.rerun()
+
+    if not api_key:
+        st.error('⚠️ Please enter your Anthropic API key in the sidebar!')
+        st.stop()
+
+    # Replies still being generated for this conversation (by any session), or
+    # interrupted before they were saved
+    pending = (pending_generations(storage, st.session_state.current_conversation_id)
+               if st.session_state.current_conversation_id else [])
+    generation_settings = {
+        'model': model,
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'system_message': system_message,
+        'cache_responses': config['cache_responses'],
+    }
+
+    # Chat input, one turn at a time per conversation
+    if prompt := st.chat_input('Ask me anything about AI, coding, or help building this app!', disabled=bool(pending)):
+        # The SDK is only imported once there is a prompt to send, so the page
+        # paints without waiting for it
+        import anthropic
+        client = get_client(api_key)
+
+        if not compare_models:
+            # The reply is generated in the background and followed below, so a
+            # rerun mid-reply (any click) neither stops it nor loses its tokens
             if st.session_state.current_conversation_id is None:
-                # Create new conversation with first user message as title
-                first_msg = st.session_state.messages[0]['content'][:50]
-                conv_id = storage.create_conversation(first_msg)
-                st.session_state.current_conversation_id = conv_id
-
-            # Save the user message and assistant response
-            if st.session_state.current_conversation_id is not None:
-                storage.add_message(
-                    st.session_state.current_conversation_id,
-                    'user',
-                    prompt,
-                    input_tokens=0,
-                    output_tokens=0
-                )
-                storage.add_message(
-                    st.session_state.current_conversation_id,
-                    'assistant',
-                    full_response,
-                    input_tokens=usage.input_tokens if usage else 0,
-                    output_tokens=usage.output_tokens if usage else 0
-                )
+                st.session_state.current_conversation_id = storage.create_conversation(prompt[:50])
+            start_generation(client, storage, st.session_state.current_conversation_id, prompt, generation_settings)
+            pending = pending_generations(storage, st.session_state.current_conversation_id)
+        else:
+            # Add user message to history
+            st.session_state.messages.append({'role': 'user', 'content': prompt})
+
+            # Display user message
+            with st.chat_message('user'):
+                st.markdown(prompt)
+                auto_scroll()
 
-            # Update model used
-            if model_used and st.session_state.current_conversation_id is not None:
-                storage.update_conversation_model(
-                    st.session_state.current_conversation_id,
-                    model_used
+            # Get AI responses
+            with st.chat_message('assistant'), TurnTimer() as timer:
+                try:
+                    # Prepare messages for API: the newest turns that fit the
+                    # smallest budget of the models, with older ones folded into a
+                    # stored rolling summary
+                    # Another session may have archived this conversation since it was opened
+                    if st.session_state.current_conversation_id:
+                        storage.restore_conversation(st.session_state.current_conversation_id)
+                    context = ContextManager(
+                        storage,
+                        budget=min(
+                            context_token_budgets.get(name, default_context_token_budget)
+                            for name in compare_models
+                        ),
+                        summarize=make_summarizer(client, summary_model, summary_max_tokens)
+                    )
+                    api_messages, summary = context.build(
+                        st.session_state.current_conversation_id,
+                        [{'role': 'user', 'content': prompt}]
+                    )
+                    current_conv = (storage.get_conversation(st.session_state.current_conversation_id)
+                                    if st.session_state.current_conversation_id else None)
+                    st.session_state.context_stats = {
+                        'sent': len(api_messages),
+                        'total': (current_conv['message_count'] if current_conv else 0) + 1,
+                        'summarized': summary is not None
+                    }
+
+                    # Compare mode: every selected model answers the same context
+                    # concurrently; the response cache is bypassed
+                    replies = run_compare(
+                        compare_models,
+                        lambda name: build_request(
+                            name,
+                            max_tokens,
+                            temperature,
+                            with_summary(system_message, summary),
+                            api_messages
+                        )
+                    )
+                    if replies:
+                        for reply in replies:
+                            for key in TOKEN_FIELDS:
+                                st.session_state.token_usage[key] = st.session_state.token_usage.get(key, 0) + reply[key]
+                        st.session_state.model_used = replies[0]['model']
+                        st.session_state.compare_stats = {
+                            reply['model']: {key: reply[key] for key in ('ttft', 'latency', 'tokens_per_sec')}
+                            for reply in replies
+                        }
+
+                        # The first reply carries the conversation forward as context
+                        st.session_state.messages.append({
+                            'role': 'assistant',
+                            'content': replies[0]['content'],
+                            'model': replies[0]['model'],
+                            'replies': [{'model': reply['model'], 'content': reply['content']} for reply in replies]
+                        })
+                        with timer.db_write():
+                            st.session_state.current_conversation_id = storage.save_compare_turn(
+                                st.session_state.current_conversation_id,
+                                prompt,
+                                replies,
+                                title=st.session_state.messages[0]['content'][:50]
+                            )
+
+                        # Each model's own timings, recorded off the request path
+                        for reply in replies:
+                            storage.record_turn_metrics(timer.metrics(
+                                st.session_state.current_conversation_id,
+                                reply['model'],
+                                'compare',
+                                reply['output_tokens'],
+                                reply['render_stats'],
+                                ttft_seconds=reply['ttft'],
+                                stream_seconds=reply['latency'] - reply['ttft'],
+                                tokens_per_sec=reply['tokens_per_sec']
+                            ), max_rows=turn_metrics_max_rows)
+                except anthropic.APIError as e:
+                    st.error(f'API Error: {str(e)}')
+                except Exception as e:
+                    st.error(f'Error: {str(e)}')
+
+    # Attach to background replies: render what has been generated so far, then
+    # follow the rest as it streams. Once a reply is saved (or put aside) the
+    # conversation is reloaded so it shows as an ordinary turn.
+    reload_conversation = False
+    for pending_reply in pending:
+        with st.chat_message('user'):
+            st.markdown(pending_reply['prompt'])
+        with st.chat_message('assistant'):
+            if pending_reply['live']:
+                generation = get_generation(pending_reply['id'])
+                renderer = StreamRenderer(
+                    st.empty(),
+                    interval=stream_render_interval,
+                    min_chars=stream_render_min_chars
                 )
-
-        except anthropic.APIError as e:
-            st.error(f'API Error: {str(e)}')
-        except Exception as e:
-            st.error(f'Error: {str(e)}')
-
-# Help section in expander
-with st.expander('ℹ️ How to use this assistant'):
-    st.markdown("""
-    ### Getting Started
-    1. **Get API Key**: Visit [Anthropic Console](https://console.anthropic.com/) and create an API key
-    2. **Configure Settings**: Choose your model, temperature, and system message in the sidebar
-    3. **Start Chatting**: Ask questions about AI, get help with code, or discuss ideas!
-
-    ### New Features: Conversation Management
-    - **Auto-Save**: All conversations are automatically saved to a local database
-    - **Load History**: Click on any past conversation to resume it
-    - **Rename**: Edit conversation titles for better organization
-    - **Export**: Download conversations as Markdown or JSON files
-    - **Settings Persistence**: Your preferred settings are remembered across sessions
-
-    ### Tips for Learning
-    - Ask the assistant to explain AI concepts step by step
-    - Request code examples and explanations
-    - Use it to debug and improve this very app!
-    - Experiment with temperature settings to see different response styles
-    - Your conversation history is saved locally in `assis_data.db`
-
-    ### Meta-Learning Ideas
-    - Ask: "Explain how the conversation storage works in this app"
-    - Ask: "How does SQLite handle concurrent connections?"
-    - Ask: "What features should I add next to improve the UX?"
-    - Ask: "How can I add search functionality to find past conversations?"
-    """)
-
-# Footer
-st.divider()
-st.caption('Built with ❤️ while learning AI Engineering | Powered by Claude | 💾 All conversations auto-saved')
+                auto_scroll()
+                for delta in follow(storage, pending_reply['id']):
+                    if delta is None:
+                        # Another process took the reply over from its last checkpoint
+                        renderer.reset()
+                    else:
+                        renderer.write(delta)
+                renderer.finish()
+                st.session_state.stream_stats = renderer.stats()
+                if generation is not None:
+                    # Queued behind the turn's metrics row, which the worker
+                    # of this process recorded before the reply ended
+                    storage.record_render_stats(generation.id, st.session_state.stream_stats)
+                    if generation.context_stats:
+                        st.session_state.context_stats = generation.context_stats
+                reload_conversation = True
+                continue
+
+            st.markdown(pending_reply['content'] or '*No reply yet.*')
+            st.warning(pending_reply['error'] or 'Interrupted before the reply finished.')
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if st.button('▶️ Resume', key=f"resume_{pending_reply['id']}", use_container_width=True,
+                             help='Continue the reply from where it stopped'):
+                    resume(get_client(api_key), storage, pending_reply['id'], generation_settings)
+                    st.rerun()
+            with col2:
+                if st.button('💾 Keep', key=f"keep_{pending_reply['id']}", use_container_width=True,
+                             disabled=not pending_reply['content'].strip(), help='Save the reply as it is'):
+                    storage.finish_generation(pending_reply['id'], pending_reply['content'].rstrip(),
+                                              model=pending_reply['model'])
+                    reload_conversation = True
+            with col3:
+                if st.button('🗑️ Discard', key=f"discard_{pending_reply['id']}", use_container_width=True,
+                             help='Drop the prompt and the partial reply'):
+                    storage.discard_generation(pending_reply['id'])
+                    reload_conversation = True
+
+    if reload_conversation:
+        load_conversation(storage, storage.get_conversation(st.session_state.current_conversation_id))
+        st.rerun()
+
+    # Help section in expander
+    with st.expander('ℹ️ How to use this assistant'):
+        st.markdown("""
+        ### Getting Started
+        1. **Get API Key**: Visit [Anthropic Console](https://console.anthropic.com/) and create an API key
+        2. **Configure Settings**: Choose your model, temperature, and system message in the sidebar
+        3. **Start Chatting**: Ask questions about AI, get help with code, or discuss ideas!
+
+        ### New Features: Conversation Management
+        - **Auto-Save**: All conversations are automatically saved to a local database
+        - **Load History**: Click on any past conversation to resume it
+        - **Rename**: Edit conversation titles for better organization
+        - **Export**: Download conversations as Markdown or JSON files
+        - **Settings Persistence**: Your preferred settings are remembered across sessions
+
+        ### Tips for Learning
+        - Ask the assistant to explain AI concepts step by step
+        - Request code examples and explanations
+        - Use it to debug and improve this very app!
+        - Experiment with temperature settings to see different response styles
+        - Your conversation history is saved locally in `assis_data.db`
+
+        ### Meta-Learning Ideas
+        - Ask: "Explain how the conversation storage works in this app"
+        - Ask: "How does SQLite handle concurrent connections?"
+        - Ask: "What features should I add next to improve the UX?"
+        - Ask: "How can I add search functionality to find past conversations?"
+        """)
+
+    # Footer
+    st.divider()
+    st.caption('Built with ❤️ while learning AI Engineering | Powered by Claude | 💾 All conversations auto-saved')
+finally:
+    finish_profile(profiler)
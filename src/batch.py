@@ -0,0 +1,237 @@
+"""Run a file of prompts through the chat pipeline without the UI.
+
+Each prompt is one JSON object per line:
+
+    {"id": "q1", "prompt": "What is WAL mode?", "model": "...", "preset": "Code Tutor",
+     "system": "...", "temperature": 0, "max_tokens": 512, "conversation_id": 12, "title": "..."}
+
+Only "prompt" is required. Settings a line leaves out come from the batch
+defaults, which start from the settings saved in the sidebar, so a prompt
+gets the same model, system prompt and max_tokens as it would in the app.
+A "conversation_id" continues that conversation with its stored history;
+otherwise every prompt starts a new one.
+
+run_batch() streams prompts to the API from a bounded pool of threads and
+writes one result line per prompt as soon as it finishes. Turns are saved
+with queue_turn(), so a storage with write_behind group-commits the turns
+of all prompts in flight together.
+"""
+import json
+import statistics
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Optional, TextIO
+
+from chat import build_request, stream_text, usage_counts
+from config import (
+    context_token_budgets,
+    default_context_token_budget,
+    default_max_tokens,
+    default_preset,
+    default_temperature,
+    max_tokens_range,
+    model_options,
+    summary_max_tokens,
+    summary_model,
+    system_presets,
+    turn_metrics_max_rows,
+)
+from context import ContextManager, make_summarizer, with_summary
+from metrics import TurnTimer
+from storage import TOKEN_FIELDS
+
+# Per-prompt keys that override the batch defaults
+SETTING_FIELDS = ('model', 'preset', 'system', 'temperature', 'max_tokens')
+
+
+def batch_defaults(saved: dict[str, Any], **overrides) -> dict[str, Any]:
+    """Request settings for prompts that don't set their own.
+
+    Starts from the sidebar's saved settings with the sidebar's fallbacks;
+    keyword overrides that aren't None (e.g. from the command line) win.
+    """
+    defaults = {
+        'model': saved.get('model') if saved.get('model') in model_options else model_options[0],
+        'preset': saved.get('preset') if saved.get('preset') in system_presets else default_preset,
+        'system': None,
+        'temperature': saved.get('temperature', default_temperature),
+        'max_tokens': saved.get('max_tokens', default_max_tokens),
+    }
+    defaults.update({key: value for key, value in overrides.items() if value is not None})
+    return defaults
+
+
+def prompt_settings(item: dict[str, Any], defaults: dict[str, Any]) -> dict[str, Any]:
+    """Model, system message, temperature and max_tokens for one prompt.
+
+    A prompt's own "system" wins over its "preset"; a "preset" of its own
+    wins over a default system message. max_tokens is clamped to the range
+    the sidebar allows.
+    """
+    settings = {**defaults, **{key: item[key] for key in SETTING_FIELDS if item.get(key) is not None}}
+    if item.get('preset') is not None and item.get('system') is None:
+        settings['system'] = None
+    if settings['system'] is None:
+        if settings['preset'] not in system_presets:
+            raise ValueError(f"Unknown preset: {settings['preset']!r}")
+        settings['system'] = system_presets[settings['preset']]
+    low, high = max_tokens_range
+    settings['max_tokens'] = min(max(int(settings['max_tokens']), low), high)
+    settings['temperature'] = float(settings['temperature'])
+    return settings
+
+
+def read_prompts(lines: Iterable[str]) -> Iterator[dict[str, Any]]:
+    """Parse prompt lines lazily, skipping blank ones.
+
+    Prompts without an "id" get their line number. A line that isn't a
+    JSON object with a "prompt" string is yielded with an 'error' instead,
+    so it shows up in the results rather than stopping the batch.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {'id': number, 'error': f'Invalid JSON: {e}'}
+            continue
+        if not isinstance(item, dict) or not isinstance(item.get('prompt'), str):
+            yield {'id': number, 'error': 'Expected an object with a "prompt" string'}
+            continue
+        item.setdefault('id', number)
+        yield item
+
+
+def run_prompt(client, storage, item: dict[str, Any], defaults: dict[str, Any]) -> dict[str, Any]:
+    """Send one prompt the way the app does, save the turn and return its result line.
+
+    Context comes from ContextManager (summarizing old turns of a long
+    conversation), the request from build_request(), and the turn is saved
+    with queue_turn() and timed into turn_metrics with source 'batch'.
+    Errors are returned in the result rather than raised.
+    """
+    result: dict[str, Any] = {'id': item['id']}
+    if 'error' in item:
+        return {**result, 'status': 'error', 'error': item['error']}
+
+    conversation_id = item.get('conversation_id')
+    with TurnTimer() as timer:
+        try:
+            settings = prompt_settings(item, defaults)
+            result['model'] = settings['model']
+            if conversation_id is not None:
+                storage.restore_conversation(conversation_id)
+            context = ContextManager(
+                storage,
+                budget=context_token_budgets.get(settings['model'], default_context_token_budget),
+                summarize=make_summarizer(client, summary_model, summary_max_tokens)
+            )
+            api_messages, summary = context.build(conversation_id, [{'role': 'user', 'content': item['prompt']}])
+            request = build_request(
+                settings['model'],
+                settings['max_tokens'],
+                settings['temperature'],
+                with_summary(settings['system'], summary),
+                api_messages
+            )
+
+            parts: list[str] = []
+            with client.messages.stream(**request) as stream:
+                final_message = stream_text(stream, timer.on_delta(parts.append))
+                timer.stream_finished()
+            usage = usage_counts(final_message.usage)
+            reply = ''.join(parts)
+
+            with timer.db_write():
+                conversation_id = storage.queue_turn(
+                    conversation_id,
+                    item['prompt'],
+                    reply,
+                    **usage,
+                    model=final_message.model,
+                    title=item.get('title') or item['prompt'][:50]
+                ).result()
+        except Exception as e:
+            return {**result, 'status': 'error', 'error': f'{type(e).__name__}: {e}',
+                    'total_seconds': round(time.perf_counter() - timer.started, 3)}
+        metrics = timer.metrics(conversation_id, final_message.model, 'batch', usage['output_tokens'])
+
+    storage.record_turn_metrics(metrics, max_rows=turn_metrics_max_rows)
+    result.update({
+        'status': 'ok',
+        'conversation_id': conversation_id,
+        'model': final_message.model,
+        'stop_reason': final_message.stop_reason,
+        **usage,
+    })
+    for key in ('ttft_seconds', 'total_seconds', 'tokens_per_sec', 'db_write_seconds'):
+        result[key] = round(metrics[key], 3) if metrics[key] is not None else None
+    result['reply'] = reply
+    return result
+
+
+def run_batch(client, storage, prompts: Iterable[dict[str, Any]], out: TextIO,
+              defaults: dict[str, Any], concurrency: int = 8) -> dict[str, Any]:
+    """Run prompts with at most `concurrency` in flight, writing each result line to out.
+
+    Prompts are read from the iterable only as slots free up, so a large
+    file is never held in memory. Results are written (and flushed) in the
+    order prompts finish. Returns totals for the whole batch.
+    """
+    started = time.perf_counter()
+    results: list[dict[str, Any]] = []
+
+    def write(done):
+        for future in done:
+            result = future.result()
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()
+            result.pop('reply', None)
+            results.append(result)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='assis-batch') as executor:
+        pending: set = set()
+        for item in prompts:
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(done)
+            pending.add(executor.submit(run_prompt, client, storage, item, defaults))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            write(done)
+    storage.flush_writes()
+
+    return summarize_batch(results, time.perf_counter() - started)
+
+
+def summarize_batch(results: list[dict[str, Any]], seconds: float) -> dict[str, Any]:
+    """Counts, throughput and latency percentiles of a batch's result lines."""
+    ok = [result for result in results if result['status'] == 'ok']
+    summary: dict[str, Any] = {
+        'prompts': len(results),
+        'ok': len(ok),
+        'errors': len(results) - len(ok),
+        'seconds': round(seconds, 3),
+        'prompts_per_sec': round(len(results) / seconds, 2) if seconds else None,
+    }
+    for key in TOKEN_FIELDS:
+        summary[key] = sum(result[key] for result in ok)
+    summary['output_tokens_per_sec'] = round(summary['output_tokens'] / seconds, 1) if seconds else None
+    for key in ('ttft_seconds', 'total_seconds'):
+        values = [result[key] for result in ok if result[key] is not None]
+        summary[key] = percentiles(values)
+    return summary
+
+
+def percentiles(values: list[float]) -> Optional[dict[str, float]]:
+    """p50 and p95 of values, or None for none."""
+    if not values:
+        return None
+    if len(values) == 1:
+        return {'p50': values[0], 'p95': values[0]}
+    return {
+        'p50': round(statistics.median(values), 3),
+        'p95': round(statistics.quantiles(values, n=20, method='inclusive')[18], 3),
+    }
@@ -0,0 +1,123 @@
+import hashlib
+import json
+from collections.abc import Iterator
+from typing import Any, Optional
+
+# Marks a content block as the end of a cacheable prompt prefix.
+CACHE_CONTROL = {'type': 'ephemeral'}
+
+
+def build_request(model: str, max_tokens: int, temperature: float, system_message: str,
+                  api_messages: list[dict[str, Any]], cache: bool = True) -> dict[str, Any]:
+    """Build keyword arguments for client.messages.stream / create.
+
+    With `cache`, prompt-cache breakpoints go on the system prompt and on the
+    final message. The second one caches the whole history prefix, which the
+    next turn reads back because it starts with the same messages.
+    """
+    messages = [dict(msg) for msg in api_messages]
+    system: Any = system_message
+    if cache:
+        system = [{'type': 'text', 'text': system_message, 'cache_control': CACHE_CONTROL}]
+        if messages:
+            last = messages[-1]
+            last['content'] = [{'type': 'text', 'text': last['content'], 'cache_control': CACHE_CONTROL}]
+
+    return {
+        'model': model,
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'system': system,
+        'messages': messages,
+    }
+
+
+def usage_counts(usage) -> dict[str, int]:
+    """Token counts from an API usage object, with missing fields as 0."""
+    return {
+        'input_tokens': getattr(usage, 'input_tokens', 0) or 0,
+        'output_tokens': getattr(usage, 'output_tokens', 0) or 0,
+        'cache_creation_tokens': getattr(usage, 'cache_creation_input_tokens', 0) or 0,
+        'cache_read_tokens': getattr(usage, 'cache_read_input_tokens', 0) or 0,
+    }
+
+
+def stream_text(stream, write) -> Any:
+    """Pass each text delta of a messages stream to write() and return the final message."""
+    for chunk in stream:
+        delta = getattr(chunk, 'delta', None)
+        if delta is not None and getattr(delta, 'text', None):
+            write(delta.text)
+    return stream.get_final_message()
+
+
+def is_cacheable(temperature: float, opt_in: bool = False) -> bool:
+    """Only deterministic requests (temperature 0) are cached unless opted in."""
+    return opt_in or temperature == 0
+
+
+def response_cache_key(request: dict[str, Any]) -> str:
+    """Stable hash of everything that determines a reply."""
+    payload = {key: request[key] for key in ('model', 'system', 'temperature', 'max_tokens', 'messages')}
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def replay_chunks(text: str, size: int = 64) -> Iterator[str]:
+    """Split a cached reply into deltas so it replays through the streaming path."""
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def group_replies(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Fold stored messages into chat history, one entry per turn.
+
+    Compare-mode turns store several consecutive assistant replies; they are
+    kept under 'replies' on a single entry whose 'content' is the first
+    reply, which is the one sent back as context on later turns. Each entry's
+    'id' is the ID of the last stored message it covers and its 'parent_id'
+    (when stored) the parent of the first, where the turn could branch off.
+    """
+    history: list[dict[str, Any]] = []
+    for msg in messages:
+        entry = {'id': msg['id'], 'role': msg['role'], 'content': msg['content']}
+        if 'parent_id' in msg:
+            entry['parent_id'] = msg['parent_id']
+        if msg.get('model'):
+            entry['model'] = msg['model']
+        previous = history[-1] if history else None
+        if msg['role'] == 'assistant' and previous and previous['role'] == 'assistant':
+            previous.setdefault('replies', [{'model': previous.get('model'), 'content': previous['content']}])
+            previous['replies'].append({'model': entry.get('model'), 'content': entry['content']})
+            previous['id'] = msg['id']
+            continue
+        history.append(entry)
+    return history
+
+
+def turn_start(messages: list[dict[str, Any]]) -> int:
+    """Index of the first user message, or 0 if there is none.
+
+    Pages of history start there, so they never open mid-turn, e.g. between
+    the replies of a compare-mode turn.
+    """
+    for i, msg in enumerate(messages):
+        if msg['role'] == 'user':
+            return i
+    return 0
+
+
+def message_window(storage, conversation_id: int, size: int,
+                   before_id: Optional[int] = None) -> tuple[list[dict[str, Any]], Optional[int]]:
+    """Load the newest `size` messages before before_id as chat history.
+
+    Returns the grouped history and the cursor for the next page back (the
+    ID of its oldest message), or None once the start has been reached.
+    The page is trimmed to begin on a user message.
+    """
+    rows = storage.get_messages(conversation_id, limit=size + 1, before_id=before_id)
+    if len(rows) <= size:
+        return group_replies(rows), None
+    rows = rows[1:]
+    rows = rows[turn_start(rows):]
+    return group_replies(rows), rows[0]['id']
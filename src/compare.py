@@ -0,0 +1,70 @@
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from chat import usage_counts
+
+
+def stream_reply(client, request: dict[str, Any], on_event: Callable[[str, Any], None]):
+    """Stream one request, reporting ('delta', text) then ('done', result) or ('error', exc).
+
+    The result has the reply text, model, token usage and timings: time to
+    first token, total latency and output tokens per second of streaming.
+    """
+    started = time.perf_counter()
+    first_token = None
+    parts = []
+    try:
+        with client.messages.stream(**request) as stream:
+            for chunk in stream:
+                delta = getattr(chunk, 'delta', None)
+                text = getattr(delta, 'text', None) if delta is not None else None
+                if text:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    parts.append(text)
+                    on_event('delta', text)
+            final_message = stream.get_final_message()
+    except Exception as e:
+        on_event('error', e)
+        return
+
+    finished = time.perf_counter()
+    usage = usage_counts(final_message.usage)
+    streaming = finished - (first_token or started)
+    on_event('done', {
+        'content': ''.join(parts),
+        'model': final_message.model,
+        **usage,
+        'ttft': round((first_token or finished) - started, 3),
+        'latency': round(finished - started, 3),
+        'tokens_per_sec': round(usage['output_tokens'] / streaming, 1) if streaming > 0 else None,
+    })
+
+
+def fan_out(client, requests: dict[str, dict[str, Any]],
+            on_delta: Callable[[str, str], None]) -> dict[str, Any]:
+    """Stream several requests concurrently, keyed by model.
+
+    Each request runs on its own worker thread; deltas are handed back to
+    the calling thread through a queue, so `on_delta(model, text)` can safely
+    update Streamlit elements. Returns each model's result dict from
+    stream_reply(), or the exception it raised. Wall time is roughly that of
+    the slowest model rather than the sum.
+    """
+    events: queue.Queue = queue.Queue()
+    results: dict[str, Any] = {}
+
+    with ThreadPoolExecutor(max_workers=len(requests), thread_name_prefix='assis-compare') as executor:
+        for model, request in requests.items():
+            executor.submit(stream_reply, client, request,
+                            lambda kind, payload, model=model: events.put((model, kind, payload)))
+
+        while len(results) < len(requests):
+            model, kind, payload = events.get()
+            if kind == 'delta':
+                on_delta(model, payload)
+            else:
+                results[model] = payload
+    return results
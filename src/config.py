@@ -15,3 +15,93 @@ system_presets = {
         'AI Teacher': 'You are an AI learning companion. Break down complex topics, use analogies, and encourage hands-on experimentation.',
         'Project Mentor': 'You are a project mentor helping build and improve this AI assistant. Suggest improvements, explain architectural decisions, and guide development.'
     }
+
+# Request settings used until others are saved from the sidebar, and the
+# range its Max Tokens field allows.
+default_preset = 'Default'
+default_temperature = 0.7
+default_max_tokens = 1024
+max_tokens_range = (100, 4096)
+
+# Prompts in flight at once for scripts/run_batch.py.
+batch_concurrency = 8
+
+# Chat replies are generated on background threads, up to
+# `generation_workers` at once per process across all sessions, and the text
+# so far of every queued or running reply is saved every
+# `generation_checkpoint_interval` seconds. A reply not checkpointed for
+# `generation_stale_seconds` is treated as interrupted (its process stopped)
+# and can be resumed.
+generation_workers = 16
+generation_checkpoint_interval = 1.0
+generation_stale_seconds = 120
+
+# Streaming render cadence for assistant replies: redraw at most every
+# `stream_render_interval` seconds, or once `stream_render_min_chars` new
+# characters are buffered. Set either to None to disable that trigger.
+stream_render_interval = 0.1
+stream_render_min_chars = None
+
+# Input-token budget for the conversation history sent with each request.
+# Older turns beyond it are folded into a rolling summary written by
+# `summary_model`, so long conversations stay within the model's limits.
+context_token_budgets = {
+  'claude-haiku-4-5-20251001': 100_000,
+  'claude-3-5-haiku-20241022': 100_000,
+  'claude-sonnet-4-5-20250929': 150_000,
+  'claude-sonnet-4-20250514': 150_000,
+  'claude-opus-4-1-20250805': 150_000,
+  'claude-opus-4-20250514': 150_000,
+  'claude-3-7-sonnet-20250219': 150_000,
+  'claude-3-haiku-20240307': 100_000,
+}
+default_context_token_budget = 100_000
+
+# Estimated USD price per million tokens, for the usage dashboard: input,
+# output, cache writes and cache reads. Costs are recorded as messages are
+# saved; after changing a price, ConversationStorage.rebuild_usage_rollups()
+# re-costs past usage.
+model_pricing = {
+  'claude-haiku-4-5-20251001': (1.00, 5.00, 1.25, 0.10),
+  'claude-3-5-haiku-20241022': (0.80, 4.00, 1.00, 0.08),
+  'claude-sonnet-4-5-20250929': (3.00, 15.00, 3.75, 0.30),
+  'claude-sonnet-4-20250514': (3.00, 15.00, 3.75, 0.30),
+  'claude-opus-4-1-20250805': (15.00, 75.00, 18.75, 1.50),
+  'claude-opus-4-20250514': (15.00, 75.00, 18.75, 1.50),
+  'claude-3-7-sonnet-20250219': (3.00, 15.00, 3.75, 0.30),
+  'claude-3-haiku-20240307': (0.25, 1.25, 0.30, 0.03),
+}
+
+# Messages shown when a conversation is opened; "Load earlier messages"
+# fetches older ones a page of this size at a time.
+message_window_size = 50
+summary_model = 'claude-haiku-4-5-20251001'
+summary_max_tokens = 1024
+
+# Local cache of replies to deterministic requests (temperature 0, or any
+# request when "Cache responses" is ticked). Least recently used entries are
+# evicted beyond these limits.
+response_cache_max_entries = 1000
+response_cache_max_bytes = 20 * 1024 * 1024
+response_cache_max_age_days = 30
+
+# Compression for long message bodies: 'zlib', or 'zstd' with the zstandard
+# package installed. Existing blobs stay readable after a change; run
+# scripts/rewrite_messages.py to recompress them.
+message_codec = 'zlib'
+
+# Default idle time, in days, before the sidebar's Archive button moves a
+# conversation to the archive database (assis_data.archive.db).
+archive_after_days = 90
+
+# Offline semantic search: every message is embedded locally (hashed word
+# and trigram features, no network) into a vector of this many float32s.
+# Changing it leaves existing vectors unused until they are re-embedded.
+semantic_dimensions = 256
+related_conversations_limit = 5
+
+# Per-turn timings kept in turn_metrics, and how many recent turns per model
+# the sidebar's p50/p95 panel covers. Set ASSIS_PROFILE to a directory to
+# profile the first rerun (and any rerun opened with ?profile) with cProfile.
+turn_metrics_max_rows = 10_000
+turn_metrics_window = 100
@@ -0,0 +1,187 @@
+from typing import Any, Callable, Optional
+
+from chat import group_replies, turn_start
+
+# Rough token estimate for English prose and code; good enough for budgeting
+# without a tokenizer round trip.
+CHARS_PER_TOKEN = 4
+
+# Fixed per-message overhead for role markers and formatting.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    'Summarize the conversation below so it can replace the original messages as '
+    'context for continuing it. Keep facts, decisions, names, code identifiers and '
+    'open questions; drop pleasantries. Write concise prose or bullet points.'
+)
+
+# Stored history is read newest first in pages of this many messages.
+HISTORY_PAGE_SIZE = 200
+
+Summarizer = Callable[[Optional[str], list[dict[str, Any]]], str]
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a piece of text."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def message_tokens(message: dict[str, Any]) -> int:
+    return estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def make_summarizer(client, model: str, max_tokens: int = 1024) -> Summarizer:
+    """Build a summarizer that folds messages into a running summary with `client`."""
+    def summarize(previous_summary: Optional[str], messages: list[dict[str, Any]]) -> str:
+        parts = []
+        if previous_summary:
+            parts.append(f'Summary of the conversation so far:\n{previous_summary}\n')
+        parts.append('Messages to add to the summary:')
+        for msg in messages:
+            parts.append(f"{msg['role'].upper()}: {msg['content']}")
+
+        response = client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=0,
+            system=SUMMARY_PROMPT,
+            messages=[{'role': 'user', 'content': '\n\n'.join(parts)}],
+        )
+        return ''.join(block.text for block in response.content if getattr(block, 'text', None))
+
+    return summarize
+
+
+class ContextManager:
+    """Keeps the history sent to the API within a token budget.
+
+    The newest messages are sent verbatim (a sliding window). Once the
+    history no longer fits, it is cut back to `target_ratio` of the budget
+    and the dropped messages are folded into a rolling summary that is
+    stored with the conversation, so later turns reuse it until the window
+    has to move again.
+
+    History comes from storage rather than the chat view, which may only
+    hold a window of a long conversation: just the messages after the
+    latest summary are read, and no more than twice the budget's worth.
+    Before a new summary is written the rest of them are read too, so every
+    message it marks as covered has been folded into it, a budget's worth
+    per summarizer call.
+    """
+
+    def __init__(self, storage, budget: int, summarize: Optional[Summarizer] = None,
+                 target_ratio: float = 0.5):
+        self.storage = storage
+        self.budget = budget
+        self.summarize = summarize
+        self.target_ratio = target_ratio
+
+    def build(self, conversation_id: Optional[int],
+              new_messages: list[dict[str, Any]]) -> tuple[list[dict[str, Any]], Optional[str]]:
+        """Return the API messages to send and the summary covering the rest (if any).
+
+        `new_messages` (the new user prompt) are not stored yet and go after
+        the conversation's stored history.
+        """
+        summary = None
+        after_id = None
+        history: list[dict[str, Any]] = []
+        truncated = False
+        if conversation_id is not None:
+            # Turns saved by the background writer must be readable first
+            self.storage.flush_writes()
+            summary = self.storage.get_latest_summary(conversation_id)
+            after_id = summary['last_message_id'] if summary else None
+            history, truncated = self._load_history(conversation_id, after_id)
+        new_history = [{'role': msg['role'], 'content': msg['content']} for msg in new_messages]
+        messages = history + new_history
+        summary_text = summary['summary'] if summary else None
+        start = 0
+
+        if self._tokens(messages, summary_text) > self.budget:
+            if truncated and self.summarize is not None:
+                # The summary about to be written covers every message before
+                # the cut, including those the capped read left out
+                history, _ = self._load_history(conversation_id, after_id, complete=True)
+                messages = history + new_history
+            cut = self._cut_point(messages, start)
+            if self.summarize is not None and cut > start and messages[cut - 1].get('id') is not None:
+                try:
+                    summary_text = self._fold(summary_text, messages[start:cut])
+                except Exception:
+                    # Without a fresh summary the dropped messages are simply
+                    # left out; the previous summary still covers the rest.
+                    pass
+                else:
+                    self.storage.save_summary(conversation_id, messages[cut - 1]['id'], summary_text)
+            start = cut
+
+        api_messages = [
+            {'role': msg['role'], 'content': msg['content']}
+            for msg in messages[start:]
+        ]
+        return api_messages, summary_text
+
+    def _load_history(self, conversation_id: int, after_id: Optional[int],
+                      complete: bool = False) -> tuple[list[dict[str, Any]], bool]:
+        """Stored messages after after_id, and whether older ones among them were left unread.
+
+        They are read back until twice the budget is covered, or all of them
+        with complete.
+        """
+        rows: list[dict[str, Any]] = []
+        tokens = 0
+        before_id = None
+        while True:
+            page = self.storage.get_messages(conversation_id, limit=HISTORY_PAGE_SIZE,
+                                             before_id=before_id, after_id=after_id)
+            rows[:0] = page
+            tokens += sum(message_tokens(msg) for msg in page)
+            if len(page) < HISTORY_PAGE_SIZE:
+                return group_replies(rows[turn_start(rows):]), False
+            if not complete and tokens > 2 * self.budget:
+                return group_replies(rows[turn_start(rows):]), True
+            before_id = page[0]['id']
+
+    def _fold(self, summary_text: Optional[str], messages: list[dict[str, Any]]) -> str:
+        """Fold messages into the summary, oldest first, at most a budget's worth per summarizer call."""
+        chunk: list[dict[str, Any]] = []
+        tokens = 0
+        for msg in messages:
+            if chunk and tokens + message_tokens(msg) > self.budget:
+                summary_text = self.summarize(summary_text, chunk)
+                chunk, tokens = [], 0
+            chunk.append(msg)
+            tokens += message_tokens(msg)
+        return self.summarize(summary_text, chunk)
+
+    def _tokens(self, messages: list[dict[str, Any]], summary_text: Optional[str]) -> int:
+        total = sum(message_tokens(msg) for msg in messages)
+        if summary_text:
+            total += estimate_tokens(summary_text)
+        return total
+
+    def _cut_point(self, messages: list[dict[str, Any]], start: int) -> int:
+        """Index of the oldest message to keep so the rest fits the target size.
+
+        The kept history always starts on a user message, as the API requires,
+        and always includes the newest message even if it alone is too large.
+        """
+        target = int(self.budget * self.target_ratio)
+        last = len(messages) - 1
+        cut = len(messages)
+        used = 0
+        while cut > start and used + message_tokens(messages[cut - 1]) <= target:
+            cut -= 1
+            used += message_tokens(messages[cut])
+        cut = min(max(cut, start), last)
+        while cut < last and messages[cut]['role'] != 'user':
+            cut += 1
+        return cut
+
+
+def with_summary(system_message: str, summary_text: Optional[str]) -> str:
+    """Append the rolling summary of earlier turns to the system prompt."""
+    if not summary_text:
+        return system_message
+    return f'{system_message}\n\nSummary of the earlier conversation:\n{summary_text}'
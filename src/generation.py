@@ -0,0 +1,336 @@
+"""Chat replies generated on background threads, independent of the script run that asked for them.
+
+A Streamlit rerun (any click in the sidebar) stops the script that was
+streaming a reply. Generating it on a worker thread instead lets the reply
+finish whatever the page does: start_generation() records the prompt in the
+generations table and hands the request to a process-wide pool, which
+builds the context, streams the reply and finally saves the turn. Any
+rerun of any session showing the conversation attaches with follow() and
+renders from the text so far.
+
+A heartbeat thread saves the text so far of every generation the process
+has queued or running every `generation_checkpoint_interval` seconds, even
+while it waits for a worker, a summary or the first token. A generation
+whose process stopped keeps its last checkpoint and, once that is
+`generation_stale_seconds` old, resume() asks the model to continue the
+partial reply rather than start again. Every write a worker makes is
+checked against its owner, so a generation taken over by another process
+is never saved twice.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from chat import (
+    build_request,
+    is_cacheable,
+    replay_chunks,
+    response_cache_key,
+    stream_text,
+    usage_counts,
+)
+from config import (
+    context_token_budgets,
+    default_context_token_budget,
+    generation_checkpoint_interval,
+    generation_stale_seconds,
+    generation_workers,
+    response_cache_max_age_days,
+    response_cache_max_bytes,
+    response_cache_max_entries,
+    summary_max_tokens,
+    summary_model,
+    turn_metrics_max_rows,
+)
+from context import ContextManager, make_summarizer, with_summary
+from metrics import TurnTimer
+
+# Marks the generations run by this process
+OWNER = uuid.uuid4().hex
+
+
+class Generation:
+    """A reply being generated by this process, shared by its worker and any followers.
+
+    Text only grows, as a list of deltas; wait() blocks until there are
+    more of them or the generation has ended, and returns only the new ones,
+    so following a reply costs its length once. status is 'running', then
+    'done' (the turn is saved) or 'error' (the text so far is kept for
+    resuming).
+    """
+
+    def __init__(self, generation_id: int, conversation_id: int, prompt: str, model: str, text: str = ''):
+        self.id = generation_id
+        self.conversation_id = conversation_id
+        self.prompt = prompt
+        self.model = model
+        self.status = 'running'
+        self.error: Optional[str] = None
+        self.context_stats: Optional[dict[str, Any]] = None
+        # Set by the heartbeat when the generation is gone or another process took it over
+        self._lost = False
+        self._storage = None
+        self._parts = [text] if text else []
+        self._changed = threading.Condition()
+
+    @property
+    def text(self) -> str:
+        """Everything generated so far."""
+        with self._changed:
+            return ''.join(self._parts)
+
+    def wait(self, start: int, timeout: Optional[float] = None) -> tuple[list[str], bool]:
+        """Wait for deltas after the first `start`, or for the generation to end.
+
+        Returns those deltas (possibly none, on timeout) and whether the
+        generation is still running.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: len(self._parts) > start or self.status != 'running', timeout)
+            return self._parts[start:], self.status == 'running'
+
+    def _append(self, delta: str):
+        with self._changed:
+            self._parts.append(delta)
+            self._changed.notify_all()
+
+    def _end(self, status: str, error: Optional[str] = None):
+        with self._changed:
+            self.status = status
+            self.error = error
+            self._changed.notify_all()
+
+
+# Generations queued or running in this process, by ID, the pool they run
+# on and the thread that checkpoints them
+_generations: dict[int, Generation] = {}
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_heartbeat: Optional[threading.Thread] = None
+
+
+def get_generation(generation_id: int) -> Optional[Generation]:
+    """The running Generation with this ID, if this process is generating it."""
+    with _lock:
+        return _generations.get(generation_id)
+
+
+def _stale_before() -> str:
+    return (datetime.now() - timedelta(seconds=generation_stale_seconds)).isoformat()
+
+
+def pending_generations(storage, conversation_id: int) -> list[dict[str, Any]]:
+    """A conversation's unsaved generations, each with 'live' set while some process is still generating it.
+
+    The others ended with an error or outlived their process; they can be
+    resumed, kept as they are or discarded.
+    """
+    stale_before = _stale_before()
+    pending = []
+    for row in storage.get_generations(conversation_id):
+        if row['status'] != 'running':
+            row['live'] = False
+        elif row['owner'] == OWNER:
+            row['live'] = get_generation(row['id']) is not None
+            # Finished between the two lookups
+            if not row['live'] and storage.get_generation(row['id']) is None:
+                continue
+        else:
+            row['live'] = row['updated_at'] >= stale_before
+        pending.append(row)
+    return pending
+
+
+def follow(storage, generation_id: int, poll: float = generation_checkpoint_interval):
+    """Yield the text of a running generation as it grows, piece by piece, until it ends.
+
+    The pieces joined are the whole text, starting from the first. A
+    generation of this process is followed delta by delta; one running in
+    another process is polled from its checkpoints. When another process
+    takes it over, its text restarts from that process's starting point, so
+    None is yielded to say the pieces so far are void and the text follows
+    again from the start.
+    """
+    generation = get_generation(generation_id)
+    if generation is not None:
+        seen = 0
+        running = True
+        while running:
+            deltas, running = generation.wait(seen, poll)
+            if deltas:
+                seen += len(deltas)
+                yield ''.join(deltas)
+        return
+
+    length = 0
+    owner = None
+    while True:
+        row = storage.get_generation(generation_id)
+        if row is None:
+            return
+        if length and (row['owner'] != owner or len(row['content']) < length):
+            yield None
+            length = 0
+        owner = row['owner']
+        if len(row['content']) > length:
+            yield row['content'][length:]
+            length = len(row['content'])
+        if row['status'] != 'running' or row['updated_at'] < _stale_before():
+            return
+        time.sleep(poll)
+
+
+def start_generation(client, storage, conversation_id: int, prompt: str, settings: dict[str, Any]) -> Generation:
+    """Start generating the reply to prompt in a conversation; returns at once.
+
+    settings has the sidebar's 'model', 'max_tokens', 'temperature',
+    'system_message' and 'cache_responses'.
+    """
+    generation_id = storage.create_generation(conversation_id, prompt, settings['model'], OWNER)
+    return _submit(client, storage, Generation(generation_id, conversation_id, prompt, settings['model']), settings)
+
+
+def resume(client, storage, generation_id: int, settings: dict[str, Any]) -> Optional[Generation]:
+    """Continue an interrupted generation from its last checkpoint.
+
+    The text so far is sent as the start of the assistant's reply, so the
+    model carries on from there with the model that began it. Returns None
+    if the generation is gone or another process is already resuming it.
+    """
+    row = storage.claim_generation(generation_id, OWNER, _stale_before())
+    if row is None:
+        return None
+    # The API rejects a partial reply that ends in whitespace
+    generation = Generation(row['id'], row['conversation_id'], row['prompt'], row['model'] or settings['model'],
+                            row['content'].rstrip())
+    return _submit(client, storage, generation, settings)
+
+
+def _submit(client, storage, generation: Generation, settings: dict[str, Any]) -> Generation:
+    global _executor, _heartbeat
+    generation._storage = storage
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=generation_workers, thread_name_prefix='assis-generate')
+            _heartbeat = threading.Thread(target=_checkpoint_loop, name='assis-generate-heartbeat', daemon=True)
+            _heartbeat.start()
+        _generations[generation.id] = generation
+    _executor.submit(_run, client, storage, generation, settings)
+    return generation
+
+
+def _checkpoint_loop():
+    """Checkpoint every generation of this process, forever, so none looks stale while it is alive."""
+    while True:
+        time.sleep(generation_checkpoint_interval)
+        with _lock:
+            generations = list(_generations.values())
+        for generation in generations:
+            try:
+                if not generation._storage.checkpoint_generation(generation.id, generation.text, OWNER):
+                    generation._lost = True
+            except Exception:
+                # The next beat tries again; only a long run of failures makes it stale
+                pass
+
+
+def _run(client, storage, generation: Generation, settings: dict[str, Any]):
+    """Generate and save one reply, like a chat turn of the app; the heartbeat checkpoints it meanwhile."""
+    partial = generation.text
+
+    def write(delta: str):
+        if generation._lost:
+            raise RuntimeError('Another process took over this generation')
+        generation._append(delta)
+
+    status, error = 'done', None
+    try:
+        try:
+            # Picked up: checkpoint at once, and stop if it was discarded or taken over while queued
+            if not storage.checkpoint_generation(generation.id, partial, OWNER):
+                raise RuntimeError('This generation was discarded or taken over by another process')
+            with TurnTimer() as timer:
+                storage.restore_conversation(generation.conversation_id)
+                context = ContextManager(
+                    storage,
+                    budget=context_token_budgets.get(generation.model, default_context_token_budget),
+                    summarize=make_summarizer(client, summary_model, summary_max_tokens)
+                )
+                api_messages, summary = context.build(generation.conversation_id,
+                                                      [{'role': 'user', 'content': generation.prompt}])
+                conv = storage.get_conversation(generation.conversation_id)
+                generation.context_stats = {
+                    'sent': len(api_messages),
+                    'total': (conv['message_count'] if conv else 0) + 1,
+                    'summarized': summary is not None
+                }
+                request = build_request(
+                    generation.model,
+                    settings['max_tokens'],
+                    settings['temperature'],
+                    with_summary(settings['system_message'], summary),
+                    api_messages
+                )
+
+                # Deterministic requests may already have a locally cached reply
+                cache_key = None
+                cached = None
+                if not partial and is_cacheable(settings['temperature'], settings['cache_responses']):
+                    cache_key = response_cache_key(request)
+                    cached = storage.get_cached_response(cache_key, max_age_days=response_cache_max_age_days)
+
+                on_delta = timer.on_delta(write)
+                if cached:
+                    for piece in replay_chunks(cached['response']):
+                        on_delta(piece)
+                    timer.stream_finished()
+                    model_used = cached['model']
+                    usage = usage_counts(None)
+                else:
+                    if partial:
+                        request['messages'].append({'role': 'assistant', 'content': partial})
+                    with client.messages.stream(**request) as stream:
+                        final_message = stream_text(stream, on_delta)
+                        timer.stream_finished()
+                    model_used = final_message.model
+                    usage = usage_counts(final_message.usage)
+
+                with timer.db_write():
+                    storage.finish_generation(generation.id, generation.text, **usage, model=model_used, owner=OWNER)
+        except Exception as e:
+            status, error = 'error', f'{type(e).__name__}: {e}'
+            storage.fail_generation(generation.id, generation.text, error, OWNER)
+            return
+
+        # The turn is saved; failing to cache the reply or to record where the
+        # turn's time went (off the request path) only loses those
+        with suppress(Exception):
+            if cache_key and not cached and final_message.stop_reason == 'end_turn':
+                storage.put_cached_response(
+                    cache_key,
+                    model_used,
+                    generation.text,
+                    input_tokens=usage['input_tokens'],
+                    output_tokens=usage['output_tokens'],
+                    max_entries=response_cache_max_entries,
+                    max_bytes=response_cache_max_bytes,
+                    max_age_days=response_cache_max_age_days
+                )
+        with suppress(Exception):
+            storage.record_turn_metrics(timer.metrics(
+                generation.conversation_id,
+                model_used,
+                'cache' if cached else 'api',
+                cached['output_tokens'] if cached else usage['output_tokens'],
+                generation_id=generation.id
+            ), max_rows=turn_metrics_max_rows)
+    finally:
+        # Followers stop waiting whatever happened above
+        generation._end(status, error)
+        with _lock:
+            if _generations.get(generation.id) is generation:
+                del _generations[generation.id]
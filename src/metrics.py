@@ -0,0 +1,146 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from storage import record_storage_timings
+
+# Set to a directory to write cProfile reports there (see start_profile).
+PROFILE_ENV = 'ASSIS_PROFILE'
+PROFILE_QUERY_PARAM = 'profile'
+PROFILE_TOP = 40
+
+_profile_armed = True
+
+
+class TurnTimer:
+    """Wall-clock phases of one chat turn, for the turn_metrics table.
+
+    Use as a context manager around the turn: while it is open, every
+    ConversationStorage call on this thread is timed too. Mark the first
+    token through on_delta(), the end of the stream with stream_finished(),
+    and wrap the save in db_write().
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.stream_done: Optional[float] = None
+        self.db_write_seconds = 0.0
+        self.storage: dict[str, Any] = {'total': 0.0, 'methods': {}}
+        self._recording = record_storage_timings()
+
+    def __enter__(self) -> 'TurnTimer':
+        self.storage = self._recording.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._recording.__exit__(*exc)
+
+    def on_delta(self, write: Callable[[str], Any]) -> Callable[[str], Any]:
+        """Wrap a delta writer so the first call marks time to first token."""
+        def wrapped(text: str):
+            if self.first_token is None:
+                self.first_token = time.perf_counter()
+            return write(text)
+        return wrapped
+
+    def stream_finished(self):
+        self.stream_done = time.perf_counter()
+
+    def db_write(self) -> '_Stopwatch':
+        """Context manager adding its duration to db_write_seconds."""
+        return _Stopwatch(self)
+
+    def metrics(self, conversation_id: Optional[int], model: Optional[str], source: str,
+                output_tokens: int, render_stats: Optional[dict[str, Any]] = None,
+                **overrides) -> dict[str, Any]:
+        """Build one turn_metrics row.
+
+        Keyword overrides replace measured fields; compare mode passes each
+        model's own ttft_seconds, stream_seconds and tokens_per_sec.
+        """
+        ttft = stream = None
+        if self.first_token is not None:
+            ttft = self.first_token - self.started
+            stream = (self.stream_done or time.perf_counter()) - self.first_token
+        row = {
+            'conversation_id': conversation_id,
+            'model': model,
+            'source': source,
+            'ttft_seconds': ttft,
+            'stream_seconds': stream,
+            'total_seconds': time.perf_counter() - self.started,
+            'output_tokens': output_tokens,
+            'tokens_per_sec': output_tokens / stream if output_tokens and stream else None,
+            'render_seconds': render_stats['render_seconds'] if render_stats else None,
+            'renders': render_stats['renders'] if render_stats else None,
+            'db_write_seconds': self.db_write_seconds,
+            'storage_seconds': self.storage['total'],
+            'storage_calls': {
+                name: {'calls': calls, 'seconds': round(seconds, 6)}
+                for name, (calls, seconds) in self.storage['methods'].items()
+            },
+        }
+        row.update(overrides)
+        return row
+
+
+class _Stopwatch:
+    def __init__(self, timer: TurnTimer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.db_write_seconds += time.perf_counter() - self.start
+
+
+def start_profile(query_params) -> Optional[cProfile.Profile]:
+    """Start profiling this rerun if ASSIS_PROFILE is set and a profile is due.
+
+    The first rerun after start-up is profiled, then any rerun whose URL
+    carries ?profile (the parameter is removed again, so it counts once).
+    Without ASSIS_PROFILE this does nothing.
+    """
+    global _profile_armed
+    if not os.environ.get(PROFILE_ENV):
+        return None
+    if PROFILE_QUERY_PARAM in query_params:
+        del query_params[PROFILE_QUERY_PARAM]
+        _profile_armed = True
+    if not _profile_armed:
+        return None
+    _profile_armed = False
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def finish_profile(profiler: Optional[cProfile.Profile]) -> Optional[str]:
+    """Stop a profile from start_profile() and write it to the ASSIS_PROFILE directory.
+
+    Writes a .prof dump (for pstats or snakeviz) and a .txt report of the
+    top functions by cumulative time; returns the .prof path.
+    """
+    if profiler is None:
+        return None
+    profiler.disable()
+
+    out_dir = os.environ[PROFILE_ENV]
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, f'assis-{datetime.now():%Y%m%d-%H%M%S-%f}')
+    profiler.dump_stats(base + '.prof')
+
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP)
+    with open(base + '.txt', 'w', encoding='utf-8') as f:
+        f.write(report.getvalue())
+    sys.stderr.write(f'assis: profile written to {base}.prof\n')
+    return base + '.prof'
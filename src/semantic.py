@@ -0,0 +1,236 @@
+"""Offline semantic search over stored messages with hashed n-gram vectors.
+
+HashingEmbedder turns text into a fixed-size float32 vector without any
+model or network: words, word pairs and character trigrams are hashed into
+`dimensions` signed buckets, counts are dampened and the vector is
+L2-normalized, so cosine similarity is a dot product. It catches shared
+vocabulary and word forms ("indexes" / "indexing"), not true synonyms.
+
+VectorIndex keeps every message vector of one database in a NumPy matrix
+and answers top-k cosine queries with one matrix-vector product. It only
+ever reads vectors added since its last refresh.
+"""
+import os
+import re
+import threading
+import zlib
+from typing import Any, Optional
+
+import numpy as np
+
+WORD = re.compile(r'\w+')
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'can', 'do', 'does', 'for', 'from',
+    'had', 'has', 'have', 'how', 'i', 'if', 'in', 'into', 'is', 'it', 'its', 'me', 'my', 'no',
+    'not', 'of', 'on', 'or', 'so', 'than', 'that', 'the', 'their', 'them', 'then', 'there',
+    'these', 'they', 'this', 'to', 'was', 'we', 'were', 'what', 'when', 'which', 'who', 'why',
+    'will', 'with', 'you', 'your',
+})
+
+# Relative weight of each feature kind in a vector
+WORD_WEIGHT = 1.0
+PAIR_WEIGHT = 0.5
+TRIGRAM_WEIGHT = 0.25
+
+
+class HashingEmbedder:
+    """Callable mapping text to a float32 vector blob for ConversationStorage(embedder=...).
+
+    Hashes are CRC32, so vectors are identical across processes and runs.
+    Vectors from embedders with different dimensions can't be compared;
+    VectorIndex skips stored vectors of the wrong size.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def vector(self, text: str) -> np.ndarray:
+        words = [word for word in WORD.findall(text.lower()) if word not in STOPWORDS]
+        features = [(word, WORD_WEIGHT) for word in words]
+        features += [(f'{a} {b}', PAIR_WEIGHT) for a, b in zip(words, words[1:])]
+        features += [(f'#{word[i:i + 3]}', TRIGRAM_WEIGHT)
+                     for word in words if len(word) > 3 for i in range(len(word) - 2)]
+        if not features:
+            return np.zeros(self.dimensions, dtype=np.float32)
+
+        hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature, _ in features),
+                             dtype=np.uint32, count=len(features))
+        weights = np.fromiter((weight for _, weight in features), dtype=np.float32, count=len(features))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        vector = np.bincount(hashes % self.dimensions, weights=weights * signs,
+                             minlength=self.dimensions).astype(np.float32)
+        vector = np.sign(vector) * np.sqrt(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def __call__(self, text: str) -> bytes:
+        return self.vector(text).tobytes()
+
+
+class VectorIndex:
+    """In-memory matrix of one database's message vectors for top-k cosine search.
+
+    refresh() appends vectors stored since the last call (a keyset scan
+    on message_vectors.id) into spare rows of preallocated arrays, which
+    double in size when full, so the index grows without being rebuilt.
+    Queries work on a snapshot, so a concurrent refresh never changes the
+    rows under them. Row ids only grow, so once fewer rows than were read
+    are left up to last_id (messages were deleted or archived), the index
+    is reloaded; restored messages come back as new rows. related() is
+    memoized until the rows change.
+    """
+
+    def __init__(self, storage, embedder: HashingEmbedder, batch_size: int = 10_000):
+        self.storage = storage
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.last_id = 0
+        # Rows read up to last_id, including any skipped for their size
+        self._read = 0
+        self._related: dict[tuple[int, int], list[tuple[int, float, int]]] = {}
+        self._lock = threading.Lock()
+        self._allocate(0, 1024)
+
+    def _allocate(self, size: int, capacity: int):
+        """Move the first `size` rows into new arrays of `capacity` rows."""
+        message_ids = np.empty(capacity, dtype=np.int64)
+        conversation_ids = np.empty(capacity, dtype=np.int64)
+        matrix = np.empty((capacity, self.embedder.dimensions), dtype=np.float32)
+        if size:
+            old_messages, old_conversations, old_matrix = self.snapshot()
+            message_ids[:size] = old_messages
+            conversation_ids[:size] = old_conversations
+            matrix[:size] = old_matrix
+        self._state = (message_ids, conversation_ids, matrix, size)
+
+    def snapshot(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(message_ids, conversation_ids, matrix) views of the rows loaded so far."""
+        message_ids, conversation_ids, matrix, size = self._state
+        return message_ids[:size], conversation_ids[:size], matrix[:size]
+
+    def __len__(self) -> int:
+        return self._state[3]
+
+    def refresh(self) -> int:
+        """Load vectors added since the last refresh; returns how many were added."""
+        with self._lock:
+            if self.storage.count_message_vectors(through_id=self.last_id) != self._read:
+                self.last_id = self._read = 0
+                self._allocate(0, 1024)
+                self._related = {}
+            width = self.embedder.dimensions * 4
+            added = 0
+            while True:
+                rows = self.storage.get_message_vectors(self.last_id, self.batch_size)
+                if not rows:
+                    return added
+                self.last_id = rows[-1][0]
+                self._read += len(rows)
+                rows = [row for row in rows if len(row[3]) == width]
+                if not rows:
+                    continue
+                size = len(self)
+                if size + len(rows) > len(self._state[0]):
+                    self._allocate(size, max(2 * len(self._state[0]), size + len(rows)))
+                message_ids, conversation_ids, matrix, _ = self._state
+                end = size + len(rows)
+                message_ids[size:end] = [row[1] for row in rows]
+                conversation_ids[size:end] = [row[2] for row in rows]
+                matrix[size:end] = np.frombuffer(b''.join(row[3] for row in rows),
+                                                 dtype=np.float32).reshape(len(rows), -1)
+                # Publish the new rows only once they are written
+                self._state = (message_ids, conversation_ids, matrix, end)
+                self._related = {}
+                added += len(rows)
+
+    @staticmethod
+    def _top(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indexes of the k highest scores, best first."""
+        if len(scores) <= k:
+            return np.argsort(-scores)
+        top = np.argpartition(-scores, k)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def _best_conversations(self, snapshot, scores: np.ndarray, k: int,
+                            exclude: Optional[int] = None) -> list[tuple[int, float, int]]:
+        """(conversation_id, score, message_id) of the k conversations with the best-scoring message."""
+        message_ids, conversation_ids, _ = snapshot
+        # Enough candidates that k distinct conversations are almost always among them
+        best: dict[int, tuple[float, int]] = {}
+        for i in self._top(scores, k * 20):
+            if scores[i] <= 0:
+                break
+            conversation_id = int(conversation_ids[i])
+            if conversation_id != exclude and conversation_id not in best:
+                best[conversation_id] = (float(scores[i]), int(message_ids[i]))
+                if len(best) == k:
+                    break
+        return [(conversation_id, score, message_id) for conversation_id, (score, message_id) in best.items()]
+
+    def search(self, query: str, k: int = 10) -> list[tuple[int, int, float]]:
+        """(message_id, conversation_id, score) of the k messages closest to query."""
+        self.refresh()
+        message_ids, conversation_ids, matrix = self.snapshot()
+        vector = self.embedder.vector(query)
+        if not len(matrix) or not vector.any():
+            return []
+        scores = matrix @ vector
+        return [(int(message_ids[i]), int(conversation_ids[i]), float(scores[i]))
+                for i in self._top(scores, k) if scores[i] > 0]
+
+    def search_conversations(self, query: str, k: int = 10) -> list[tuple[int, float, int]]:
+        """(conversation_id, score, message_id) of the k conversations with a message closest to query."""
+        self.refresh()
+        snapshot = self.snapshot()
+        vector = self.embedder.vector(query)
+        if not len(snapshot[2]) or not vector.any():
+            return []
+        return self._best_conversations(snapshot, snapshot[2] @ vector, k)
+
+    def related(self, conversation_id: int, k: int = 5) -> list[tuple[int, float, int]]:
+        """(conversation_id, score, message_id) of the conversations most like one.
+
+        The conversation is represented by the centroid of its message
+        vectors; others are ranked by their closest message to it.
+        """
+        self.refresh()
+        # Taken before the snapshot: refresh() replaces it after the rows
+        memo = self._related
+        if (conversation_id, k) not in memo:
+            memo[conversation_id, k] = self._rank_related(self.snapshot(), conversation_id, k)
+        return list(memo[conversation_id, k])
+
+    def _rank_related(self, snapshot, conversation_id: int, k: int) -> list[tuple[int, float, int]]:
+        mine = snapshot[1] == conversation_id
+        if not mine.any():
+            return []
+        centroid = snapshot[2][mine].mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        if not norm:
+            return []
+        return self._best_conversations(snapshot, snapshot[2] @ (centroid / norm), k, exclude=conversation_id)
+
+# One index per database file, shared by every session in the process
+_indexes: dict[str, VectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(storage, embedder: HashingEmbedder) -> VectorIndex:
+    """The process-wide VectorIndex for storage's database."""
+    key = os.path.abspath(storage.db_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = VectorIndex(storage, embedder)
+        return index
+
+
+def describe(storage, hits: list[tuple[int, float, int]]) -> list[dict[str, Any]]:
+    """Attach titles to (conversation_id, score, message_id) hits, dropping deleted conversations."""
+    results = []
+    for conversation_id, score, message_id in hits:
+        conv = storage.get_conversation(conversation_id)
+        if conv:
+            results.append({'conversation_id': conversation_id, 'title': conv['title'],
+                            'score': score, 'message_id': message_id})
+    return results
@@ -1,8 +1,244 @@
-import json
-
 import streamlit as st
 
-from config import model_options, system_presets
+from chat import message_window
+from config import (
+    archive_after_days,
+    default_max_tokens,
+    default_preset,
+    default_temperature,
+    max_tokens_range,
+    message_window_size,
+    model_options,
+    related_conversations_limit,
+    system_presets,
+    turn_metrics_window,
+)
+from semantic import describe, get_index
+
+USAGE_PERIODS = {'Last 7 days': 7, 'Last 30 days': 30, 'Last 90 days': 90, 'All time': None}
+CONVERSATION_PAGE_SIZE = 10
+SEARCH_RESULT_LIMIT = 10
+ARCHIVED_LIST_LIMIT = 20
+
+
+def load_conversation(storage, conv):
+    """Make a stored conversation the active chat in session state.
+
+    An archived conversation is moved back to the hot tables first.
+    """
+    storage.restore_conversation(conv['id'])
+    st.session_state.current_conversation_id = conv['id']
+    # Only the newest window of messages; the chat view loads earlier ones on request
+    st.session_state.messages, st.session_state.earlier_messages_id = message_window(
+        storage, conv['id'], message_window_size
+    )
+    st.session_state.token_usage = {
+        'input_tokens': conv['total_input_tokens'],
+        'output_tokens': conv['total_output_tokens'],
+        'cache_creation_tokens': conv['total_cache_creation_tokens'],
+        'cache_read_tokens': conv['total_cache_read_tokens']
+    }
+    st.session_state.model_used = conv['model_used']
+
+
+def render_search(storage):
+    """Search box over all stored messages and titles.
+
+    With "Similar meaning" on (and an embedder configured), conversations
+    are ranked by their closest message vector instead of keyword matches.
+    """
+    query = st.text_input('🔍 Search conversations', key='search_query', placeholder='Search messages and titles')
+    semantic = storage.embedder is not None and st.toggle(
+        'Similar meaning', key='search_semantic', help='Rank by meaning rather than exact words'
+    )
+    if not query.strip():
+        return
+
+    if semantic:
+        index = get_index(storage, storage.embedder)
+        results = describe(storage, index.search_conversations(query, SEARCH_RESULT_LIMIT))
+        for hit in results:
+            hit['snippet'] = f"Similarity {hit['score']:.2f}"
+    else:
+        results = storage.search(query, limit=SEARCH_RESULT_LIMIT)
+    if not results:
+        st.caption('No matches.')
+        return
+
+    for i, hit in enumerate(results):
+        title = hit['title'][:30] + '...' if len(hit['title']) > 30 else hit['title']
+        if st.button(title, key=f"search_{i}_{hit['conversation_id']}", use_container_width=True):
+            conv = storage.get_conversation(hit['conversation_id'])
+            if conv:
+                load_conversation(storage, conv)
+            st.rerun()
+        st.caption(hit['snippet'])
+
+
+def render_related(storage):
+    """Conversations most similar to the active one, by message vectors."""
+    conversation_id = st.session_state.get('current_conversation_id')
+    if storage.embedder is None or not conversation_id:
+        return
+
+    index = get_index(storage, storage.embedder)
+    related = describe(storage, index.related(conversation_id, related_conversations_limit))
+    if not related:
+        return
+
+    with st.expander('🔗 Related conversations'):
+        for hit in related:
+            title = hit['title'][:30] + '...' if len(hit['title']) > 30 else hit['title']
+            if st.button(title, key=f"related_{hit['conversation_id']}", use_container_width=True,
+                         help=f"Similarity {hit['score']:.2f}"):
+                conv = storage.get_conversation(hit['conversation_id'])
+                if conv:
+                    load_conversation(storage, conv)
+                st.rerun()
+
+
+def render_branches(storage):
+    """Switch between the branches of the active conversation, once it has more than one."""
+    conversation_id = st.session_state.get('current_conversation_id')
+    conv = storage.get_conversation(conversation_id) if conversation_id else None
+    if not conv or conv['branch_count'] < 2:
+        return
+
+    with st.expander(f"🌿 Branches ({conv['branch_count']})"):
+        for branch in storage.list_branches(conversation_id):
+            preview = branch['preview'][:30] + '...' if len(branch['preview']) > 30 else branch['preview']
+            label = f"{'▶ ' if branch['active'] else ''}{preview}"
+            if st.button(label, key=f"branch_{branch['head_id']}", use_container_width=True,
+                         help=f"{branch['message_count']} messages · last {branch['updated_at'][:16]}"):
+                storage.switch_branch(conversation_id, branch['head_id'])
+                load_conversation(storage, storage.get_conversation(conversation_id))
+                st.rerun()
+
+
+def render_export_button(storage, fmt, label, extension, mime):
+    """Download button for the current conversation's export, prepared on demand."""
+    conversation_id = st.session_state.get('current_conversation_id')
+    current_conv = storage.get_conversation(conversation_id) if conversation_id else None
+    if not current_conv:
+        st.button(label, key=f'export_{fmt}', disabled=True, use_container_width=True, help='No conversation to export')
+        return
+
+    data = storage.get_cached_export(conversation_id, fmt, current_conv)
+    if data is None:
+        if st.button(label, key=f'export_{fmt}', use_container_width=True, help='Prepare export'):
+            storage.export_conversation(conversation_id, fmt, current_conv)
+            st.rerun()
+        return
+
+    st.download_button(
+        label,
+        data,
+        file_name=f"{current_conv['title']}.{extension}",
+        mime=mime,
+        key=f'download_{fmt}',
+        use_container_width=True
+    )
+
+
+def format_percentiles(p50, p95, scale=1.0, digits=2):
+    """'p50 / p95' for the latency table, with a dash for missing values."""
+    def fmt(value):
+        return '–' if value is None else f'{value * scale:.{digits}f}'
+    return f'{fmt(p50)} / {fmt(p95)}'
+
+
+def render_turn_metrics(storage):
+    """Rolling p50 / p95 of recent turn timings, one row per model."""
+    summary = storage.turn_metrics_summary(window=turn_metrics_window)
+    if not summary:
+        return
+
+    with st.expander('⏱️ Turn latency (p50 / p95)'):
+        st.dataframe(
+            [
+                {
+                    'Model': entry['model'],
+                    'Turns': entry['turns'],
+                    'First token (s)': format_percentiles(entry['ttft_p50'], entry['ttft_p95']),
+                    'Total (s)': format_percentiles(entry['total_p50'], entry['total_p95']),
+                    'Tokens/s': format_percentiles(entry['tokens_per_sec_p50'], entry['tokens_per_sec_p95'], digits=0),
+                    'Render (ms)': format_percentiles(entry['render_p50'], entry['render_p95'], 1000, 0),
+                    'DB write (ms)': format_percentiles(entry['db_write_p50'], entry['db_write_p95'], 1000, 1),
+                }
+                for entry in summary
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+        st.caption(f'Last {turn_metrics_window} turns per model, excluding cached replies')
+
+
+def render_usage(storage):
+    """Token and estimated cost dashboard, read from the daily usage rollups."""
+    with st.expander('💰 Usage & cost'):
+        period = st.selectbox('Period', list(USAGE_PERIODS), index=1, key='usage_period')
+        days = USAGE_PERIODS[period]
+        by_model = storage.usage_totals(days, group_by='model')
+        if not by_model:
+            st.caption('No usage recorded in this period.')
+            return
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric('Estimated cost', f"${sum(row['cost'] for row in by_model):,.2f}")
+        with col2:
+            st.metric('Tokens', f"{sum(row['input_tokens'] + row['output_tokens'] for row in by_model):,}")
+
+        st.bar_chart(
+            [
+                {'Day': row['day'], 'Model': row['model'] or 'unknown', 'Cost ($)': row['cost']}
+                for row in storage.usage_by_day(days)
+            ],
+            x='Day', y='Cost ($)', color='Model'
+        )
+        st.dataframe(
+            [
+                {
+                    'Model': row['model'] or 'unknown',
+                    'Replies': row['messages'],
+                    'Input': row['input_tokens'],
+                    'Output': row['output_tokens'],
+                    'Cache writes': row['cache_creation_tokens'],
+                    'Cache reads': row['cache_read_tokens'],
+                    'Cost ($)': round(row['cost'], 2),
+                }
+                for row in by_model
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+        st.caption('Estimated from the prices in config.py; includes deleted conversations')
+
+
+def render_archive(storage):
+    """Archive idle conversations and list archived ones; loading one restores it."""
+    with st.expander('🗄️ Archive'):
+        days = st.number_input('Archive conversations idle for (days)', min_value=1,
+                               value=archive_after_days, step=1)
+        if st.button('Archive idle conversations', use_container_width=True):
+            current_id = st.session_state.get('current_conversation_id')
+            archived = storage.archive_conversations(days, exclude=[current_id] if current_id else ())
+            st.session_state.conversation_cursors = [None]
+            st.toast(f'Archived {archived} conversation(s)')
+            st.rerun()
+
+        conversations, more = storage.list_conversations(limit=ARCHIVED_LIST_LIMIT, archived=True)
+        if not conversations:
+            st.caption('No archived conversations.')
+        for conv in conversations:
+            title = conv['title'][:30] + '...' if len(conv['title']) > 30 else conv['title']
+            if st.button(title, key=f"archived_{conv['id']}", use_container_width=True,
+                         help=f"Last updated {conv['updated_at'][:10]}"):
+                load_conversation(storage, conv)
+                st.session_state.conversation_cursors = [None]
+                st.rerun()
+        if more is not None:
+            st.caption(f'Showing the {ARCHIVED_LIST_LIMIT} most recent.')
 
 
 def render_sidebar(storage):
@@ -17,6 +253,7 @@ def render_sidebar(storage):
             new_id = storage.create_conversation('New Conversation')
             st.session_state.current_conversation_id = new_id
             st.session_state.messages = []
+            st.session_state.earlier_messages_id = None
             st.session_state.token_usage = {'input_tokens': 0, 'output_tokens': 0}
             st.session_state.model_used = None
             st.rerun()
@@ -24,17 +261,28 @@ def render_sidebar(storage):
     with col2:
         if st.button('🗑️', use_container_width=True, help='Clear current conversation'):
             st.session_state.messages = []
+            st.session_state.earlier_messages_id = None
             st.session_state.token_usage = {'input_tokens': 0, 'output_tokens': 0}
             st.session_state.model_used = None
             if 'current_conversation_id' in st.session_state:
                 del st.session_state.current_conversation_id
             st.rerun()
 
-    # List existing conversations
-    conversations = storage.get_all_conversations()
+    render_search(storage)
+    render_related(storage)
+    render_branches(storage)
+
+    # List existing conversations, one keyset page at a time. The stack holds
+    # the cursor of every page visited so far; None is the newest page.
+    if 'conversation_cursors' not in st.session_state:
+        st.session_state.conversation_cursors = [None]
+    conversations, next_cursor = storage.list_conversations(
+        limit=CONVERSATION_PAGE_SIZE,
+        cursor=st.session_state.conversation_cursors[-1]
+    )
     if conversations:
         st.write('**Recent Conversations:**')
-        for conv in conversations[:10]:  # Show last 10
+        for conv in conversations:
             col1, col2 = st.columns([4, 1])
             with col1:
                 # Truncate title if too long
@@ -43,18 +291,7 @@ def render_sidebar(storage):
                 button_label = f"{'▶ ' if is_current else ''}{display_title}"
 
                 if st.button(button_label, key=f"load_{conv['id']}", use_container_width=True):
-                    # Load conversation
-                    st.session_state.current_conversation_id = conv['id']
-                    messages = storage.get_messages(conv['id'])
-                    st.session_state.messages = [
-                        {'role': msg['role'], 'content': msg['content']}
-                        for msg in messages
-                    ]
-                    st.session_state.token_usage = {
-                        'input_tokens': conv['total_input_tokens'],
-                        'output_tokens': conv['total_output_tokens']
-                    }
-                    st.session_state.model_used = conv['model_used']
+                    load_conversation(storage, conv)
                     st.rerun()
 
             with col2:
@@ -62,10 +299,25 @@ def render_sidebar(storage):
                     storage.delete_conversation(conv['id'])
                     if st.session_state.get('current_conversation_id') == conv['id']:
                         st.session_state.messages = []
+                        st.session_state.earlier_messages_id = None
                         st.session_state.token_usage = {'input_tokens': 0, 'output_tokens': 0}
                         del st.session_state.current_conversation_id
                     st.rerun()
 
+    if len(st.session_state.conversation_cursors) > 1 or next_cursor is not None:
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button('⬆️ Newer', use_container_width=True,
+                         disabled=len(st.session_state.conversation_cursors) == 1):
+                st.session_state.conversation_cursors.pop()
+                st.rerun()
+        with col2:
+            if st.button('⬇️ Load more', use_container_width=True, disabled=next_cursor is None):
+                st.session_state.conversation_cursors.append(next_cursor)
+                st.rerun()
+
+    render_archive(storage)
+
     st.divider()
 
     # Rename current conversation
@@ -81,47 +333,25 @@ def render_sidebar(storage):
                 storage.update_conversation_title(st.session_state.current_conversation_id, new_title)
                 st.rerun()
 
-    # Export options
+    # Export options: built only on request, then reused until the conversation changes
     st.write('**Export:**')
     col1, col2 = st.columns(2)
     with col1:
-        if st.session_state.current_conversation_id:
-            markdown_export = storage.export_conversation_to_markdown(st.session_state.current_conversation_id)
-            current_conv = storage.get_conversation(st.session_state.current_conversation_id)
-            file_name = f"{current_conv['title']}.md" if current_conv else 'conversation.md'
-            st.download_button(
-                '📄 Markdown',
-                markdown_export,
-                file_name=file_name,
-                mime='text/markdown',
-                use_container_width=True
-            )
-        else:
-            st.button('📄 Markdown', disabled=True, use_container_width=True, help='No conversation to export')
+        render_export_button(storage, 'markdown', '📄 Markdown', 'md', 'text/markdown')
     with col2:
-        if st.session_state.current_conversation_id:
-            json_export = storage.export_conversation_to_json(st.session_state.current_conversation_id)
-            current_conv = storage.get_conversation(st.session_state.current_conversation_id)
-            file_name = f"{current_conv['title']}.json" if current_conv else 'conversation.json'
-            st.download_button(
-                '📋 JSON',
-                json.dumps(json_export, indent=2),
-                file_name=file_name,
-                mime='application/json',
-                use_container_width=True
-            )
-        else:
-            st.button('📋 JSON', disabled=True, use_container_width=True, help='No conversation to export')
+        render_export_button(storage, 'json', '📋 JSON', 'json', 'application/json')
 
     st.divider()
 
     st.header('⚙️ Configuration')
 
     # Load saved settings
-    saved_model = storage.get_setting('model', model_options[0])
-    saved_temp = storage.get_setting('temperature', 0.7)
-    saved_max_tokens = storage.get_setting('max_tokens', 1024)
-    saved_preset = storage.get_setting('preset', 'Default')
+    settings = storage.get_all_settings()
+    saved_model = settings.get('model', model_options[0])
+    saved_temp = settings.get('temperature', default_temperature)
+    saved_max_tokens = settings.get('max_tokens', default_max_tokens)
+    saved_preset = settings.get('preset', default_preset)
+    saved_cache_responses = settings.get('cache_responses', False)
 
     # Model selection
     model = st.selectbox(
@@ -155,18 +385,35 @@ def render_sidebar(storage):
     # Max tokens
     max_tokens = st.number_input(
         'Max Tokens',
-        min_value=100,
-        max_value=4096,
+        min_value=max_tokens_range[0],
+        max_value=max_tokens_range[1],
         value=int(saved_max_tokens),
         step=100
     )
 
+    # Compare mode: every prompt goes to all selected models at once
+    compare_models = st.multiselect(
+        '🔀 Compare models',
+        model_options,
+        default=[],
+        max_selections=4,
+        help='Pick two or more models to answer each prompt side by side'
+    )
+
+    # Temperature 0 replies are always cached; this opts other requests in too
+    cache_responses = st.checkbox(
+        'Cache responses',
+        value=bool(saved_cache_responses),
+        help='Reuse stored replies for identical requests at any temperature'
+    )
+
     # Save settings button
     if st.button('💾 Save Settings', use_container_width=True):
         storage.save_setting('model', model)
         storage.save_setting('temperature', temperature)
         storage.save_setting('max_tokens', max_tokens)
         storage.save_setting('preset', preset_selection)
+        storage.save_setting('cache_responses', cache_responses)
         st.success('Settings saved!')
 
     st.divider()
@@ -185,6 +432,38 @@ def render_sidebar(storage):
         with col3:
           st.metric('Total Tokens', st.session_state.token_usage['input_tokens'] + st.session_state.token_usage['output_tokens'])
 
+        # Prompt caching: tokens written to and served from the cache
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric('Cache Writes', st.session_state.token_usage.get('cache_creation_tokens', 0))
+        with col2:
+            st.metric('Cache Reads', st.session_state.token_usage.get('cache_read_tokens', 0))
+
+    if st.session_state.get('context_stats'):
+        stats = st.session_state.context_stats
+        if stats['sent'] < stats['total']:
+            note = ' + summary of earlier turns' if stats['summarized'] else ''
+            st.caption(f"Context: last {stats['sent']} of {stats['total']} messages{note}")
+
+    cache_stats = storage.response_cache_stats()
+    if cache_stats['hits'] or cache_stats['misses'] or cache_stats['entries']:
+        st.caption(
+            f"Response cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries ({cache_stats['bytes'] // 1024} KB)"
+        )
+
+    if st.session_state.get('stream_stats'):
+        stats = st.session_state.stream_stats
+        st.caption(f"Last reply: {stats['deltas']} deltas → {stats['renders']} renders in {stats['seconds']}s")
+
+    if compare_models and st.session_state.get('compare_stats'):
+        st.write('**Last comparison:**')
+        for compare_model, stats in st.session_state.compare_stats.items():
+            st.caption(f"{compare_model}: first token {stats['ttft']}s, total {stats['latency']}s")
+
+    render_turn_metrics(storage)
+    render_usage(storage)
+
     st.divider()
 
     # Add this in the sidebar stats section to display the model used
@@ -198,5 +477,7 @@ def render_sidebar(storage):
         'model': model,
         'temperature': temperature,
         'max_tokens': max_tokens,
-        'system_message': system_message
+        'system_message': system_message,
+        'cache_responses': cache_responses,
+        'compare_models': compare_models if len(compare_models) > 1 else []
     }
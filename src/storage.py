@@ -1,20 +1,1118 @@
+import atexit
+import functools
+import gzip
+import hashlib
+import inspect
 import json
+import math
+import os
+import queue
 import sqlite3
-from datetime import datetime
-from typing import Any, Optional
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
 
+# Applied to every pooled connection. WAL lets readers run alongside a writer,
+# NORMAL sync is durable under WAL, and busy_timeout waits out short write
+# locks instead of failing with "database is locked".
+CONNECTION_PRAGMAS = (
+    # Lets archive_conversations() hand freed pages back to the filesystem.
+    # Must precede journal_mode to apply to a new file; an existing database
+    # switches over at its next VACUUM.
+    'PRAGMA auto_vacuum = INCREMENTAL',
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',  # 16 MB page cache per connection
+    'PRAGMA mmap_size = 268435456',  # 256 MB memory-mapped reads
+)
 
+# Per-connection prepared statement cache; every query below uses a constant
+# SQL string so repeated calls reuse the compiled statement.
+STATEMENT_CACHE_SIZE = 256
+
+# Keep the FTS5 tables in step with the rows they index.
+SEARCH_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+        INSERT INTO conversations_fts (rowid, title) VALUES (new.id, new.title);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN
+        INSERT INTO conversations_fts (conversations_fts, rowid, title)
+        VALUES ('delete', old.id, old.title);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE OF title ON conversations BEGIN
+        INSERT INTO conversations_fts (conversations_fts, rowid, title)
+        VALUES ('delete', old.id, old.title);
+        INSERT INTO conversations_fts (rowid, title) VALUES (new.id, new.title);
+    END
+    """,
+)
+
+# Schema version 4 moves long message bodies into message_blobs, so the search
+# index reads text through the message_bodies view and these replace the
+# message triggers above. Text is removed from the index before a row goes
+# (BEFORE triggers) since its blob may be released with it. Moving an inline
+# body into a blob keeps its text, so that update leaves the index alone.
+MESSAGE_BODY_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content)
+        SELECT id, content FROM message_bodies WHERE id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete BEFORE DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content)
+        SELECT 'delete', id, content FROM message_bodies WHERE id = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update_old BEFORE UPDATE OF content, blob_id ON messages
+    WHEN old.blob_id IS NOT NULL OR new.blob_id IS NULL BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content)
+        SELECT 'delete', id, content FROM message_bodies WHERE id = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, blob_id ON messages
+    WHEN old.blob_id IS NOT NULL OR new.blob_id IS NULL BEGIN
+        INSERT INTO messages_fts (rowid, content)
+        SELECT id, content FROM message_bodies WHERE id = new.id;
+    END
+    """,
+)
+
+# Long message bodies, stored once per distinct text (see BLOB_MIN_BYTES), and
+# the view that reads messages back as text whichever way they are stored.
+# Both the hot database and the archive have them; {schema} is 'main' or
+# 'archive'. Blobs are reference counted and dropped with their last message.
+MESSAGE_BLOB_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.message_blobs (
+        id INTEGER PRIMARY KEY,
+        hash BLOB NOT NULL UNIQUE,
+        codec TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        refs INTEGER NOT NULL DEFAULT 0,
+        data BLOB NOT NULL
+    )
+    """,
+    """
+    CREATE VIEW IF NOT EXISTS {schema}.message_bodies AS
+    SELECT m.id, m.conversation_id, m.role,
+           CASE WHEN m.blob_id IS NULL THEN m.content
+                ELSE (SELECT assis_unpack(b.codec, b.data) FROM message_blobs b WHERE b.id = m.blob_id)
+           END AS content,
+           m.timestamp, m.input_tokens, m.output_tokens,
+           m.cache_creation_tokens, m.cache_read_tokens, m.model
+    FROM messages m
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.messages_blob_insert AFTER INSERT ON messages
+    WHEN new.blob_id IS NOT NULL BEGIN
+        UPDATE message_blobs SET refs = refs + 1 WHERE id = new.blob_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.messages_blob_delete AFTER DELETE ON messages
+    WHEN old.blob_id IS NOT NULL BEGIN
+        UPDATE message_blobs SET refs = refs - 1 WHERE id = old.blob_id;
+        DELETE FROM message_blobs WHERE id = old.blob_id AND refs <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.messages_blob_update AFTER UPDATE OF blob_id ON messages
+    WHEN old.blob_id IS NOT new.blob_id BEGIN
+        UPDATE message_blobs SET refs = refs + 1 WHERE id = new.blob_id;
+        UPDATE message_blobs SET refs = refs - 1 WHERE id = old.blob_id;
+        DELETE FROM message_blobs WHERE id = old.blob_id AND refs <= 0;
+    END
+    """,
+)
+
+# Conversations idle for a while can be moved to a second database file, the
+# archive (see archive_conversations()), which is ATTACHed as schema 'archive'
+# only when a lookup misses the hot tables or the archive itself is used. It
+# keeps the hot schema's IDs, so a conversation moves back unchanged.
+ARCHIVE_DB_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.conversations (
+        id INTEGER PRIMARY KEY,
+        uuid TEXT UNIQUE,
+        title TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        updated_at TIMESTAMP NOT NULL,
+        total_input_tokens INTEGER DEFAULT 0,
+        total_output_tokens INTEGER DEFAULT 0,
+        model_used TEXT,
+        message_count INTEGER DEFAULT 0,
+        total_cache_creation_tokens INTEGER DEFAULT 0,
+        total_cache_read_tokens INTEGER DEFAULT 0,
+        head_id INTEGER,
+        branch_count INTEGER DEFAULT 1
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.messages (
+        id INTEGER PRIMARY KEY,
+        conversation_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        input_tokens INTEGER DEFAULT 0,
+        output_tokens INTEGER DEFAULT 0,
+        cache_creation_tokens INTEGER DEFAULT 0,
+        cache_read_tokens INTEGER DEFAULT 0,
+        model TEXT,
+        blob_id INTEGER,
+        parent_id INTEGER,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.conversation_summaries (
+        id INTEGER PRIMARY KEY,
+        conversation_id INTEGER NOT NULL,
+        message_count INTEGER NOT NULL,
+        summary TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        last_message_id INTEGER,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_conversations_updated_id ON conversations(updated_at DESC, id DESC)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_messages_conversation_time ON messages(conversation_id, timestamp, id)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_summaries_conversation ON conversation_summaries(conversation_id)',
+)
+
+# Columns the archive schema gained after archive files were first written;
+# an older archive gets them (and the message tree backfilled) when attached.
+ARCHIVE_ADDED_COLUMNS = (
+    ('conversations', 'head_id', 'INTEGER'),
+    ('conversations', 'branch_count', 'INTEGER DEFAULT 1'),
+    ('messages', 'parent_id', 'INTEGER'),
+)
+
+# Columns copied when a conversation moves between the hot tables and the
+# archive; messages also get their blob_id remapped.
+CONVERSATION_COLUMNS = (
+    'id', 'uuid', 'title', 'created_at', 'updated_at', 'total_input_tokens', 'total_output_tokens',
+    'model_used', 'message_count', 'total_cache_creation_tokens', 'total_cache_read_tokens',
+    'head_id', 'branch_count',
+)
+MESSAGE_COLUMNS = (
+    'id', 'conversation_id', 'role', 'content', 'timestamp', 'input_tokens', 'output_tokens',
+    'cache_creation_tokens', 'cache_read_tokens', 'model', 'parent_id',
+)
+SUMMARY_COLUMNS = ('id', 'conversation_id', 'message_count', 'summary', 'created_at', 'last_message_id')
+
+# Messages form a tree: each has a parent_id (NULL for a first message) and a
+# conversation's head_id is the last message of its current branch, which the
+# next message saved continues from. Forking only moves head_id back, so a
+# new branch stores just its own messages. branch_count is the number of
+# leaves, kept so a conversation that never forked needs no tree query to
+# say so.
+MESSAGE_TREE_INDEX = 'CREATE INDEX IF NOT EXISTS {schema}.idx_messages_parent ON messages(conversation_id, parent_id)'
+
+# path(id, parent_id, depth): the message {start} selects and its ancestors,
+# depth 0 at the start, one primary-key lookup per step. Parameters: those
+# of {start}, the conversation ID, a message ID the walk stops before (twice;
+# None walks to the first message) and a row limit (-1 for none).
+BRANCH_PATH = """
+    WITH RECURSIVE path(id, parent_id, depth) AS (
+        SELECT id, parent_id, 0 FROM {schema}.messages
+        WHERE id = {start} AND conversation_id = ? AND id IS NOT ?
+        UNION ALL
+        SELECT m.id, m.parent_id, path.depth + 1
+        FROM {schema}.messages m JOIN path ON m.id = path.parent_id
+        WHERE m.id IS NOT ?
+        LIMIT ?
+    )
+"""
+# Linear parents and heads for messages stored before the tree existed; the
+# outer table is the one being updated
+MESSAGE_PARENT_BACKFILL = """
+    parent_id = (
+        SELECT p.id FROM {schema}.messages p
+        WHERE p.conversation_id = messages.conversation_id
+          AND (p.timestamp, p.id) < (messages.timestamp, messages.id)
+        ORDER BY p.timestamp DESC, p.id DESC
+        LIMIT 1
+    )
+"""
+CONVERSATION_HEAD_BACKFILL = """
+    head_id = (
+        SELECT id FROM {schema}.messages
+        WHERE conversation_id = conversations.id
+        ORDER BY timestamp DESC, id DESC
+        LIMIT 1
+    )
+"""
+
+# BRANCH_PATH starts: a conversation's head, the message before another, a given message
+BRANCH_HEAD = '(SELECT head_id FROM {schema}.conversations WHERE id = ?)'
+BRANCH_BEFORE = '(SELECT parent_id FROM {schema}.messages WHERE id = ?)'
+BRANCH_AT = '?'
+
+# Message bodies of at least BLOB_MIN_BYTES (UTF-8) are stored once per
+# distinct text in message_blobs, found by SHA-256, and compressed with the
+# storage's codec ('zlib', or 'zstd' with the zstandard package) whenever that
+# makes them smaller. Shorter bodies stay inline in messages.content.
+BLOB_MIN_BYTES = 512
+BLOB_CODECS = ('zlib', 'zstd')
+BLOB_CODEC = 'zlib'
+
+
+# Line format for bulk export/import. The first line is a header; each
+# conversation line is followed by the lines of its messages. Version 2 adds
+# the message tree: messages carry their 'id' and 'parent_id' and
+# conversations their 'head_id', all as IDs of the exporting database.
+# Messages without them follow one another, as in version 1.
+ARCHIVE_FORMAT = 'assis-jsonl'
+ARCHIVE_VERSION = 2
+
+ARCHIVE_CONVERSATION_FIELDS = (
+    'uuid', 'title', 'created_at', 'updated_at', 'model_used',
+)
+ARCHIVE_MESSAGE_FIELDS = (
+    'role', 'content', 'timestamp', 'input_tokens', 'output_tokens',
+    'cache_creation_tokens', 'cache_read_tokens', 'model',
+)
+
+# SQLite's default limit on bound parameters is 999 before 3.32.
+MAX_QUERY_PARAMS = 900
+
+# Per-message token counters, in column order.
+TOKEN_FIELDS = ('input_tokens', 'output_tokens', 'cache_creation_tokens', 'cache_read_tokens')
+
+# Columns of turn_metrics written by record_turn_metrics(), in order. source is
+# 'api' for a streamed reply, 'cache' for a response-cache replay,
+# 'compare' for one reply of a compare-mode turn and 'batch' for a prompt
+# run by scripts/run_batch.py. generation_id links a background reply's row
+# to the render timing its follower adds later.
+TURN_METRIC_FIELDS = (
+    'conversation_id', 'model', 'source', 'ttft_seconds', 'stream_seconds', 'total_seconds',
+    'output_tokens', 'tokens_per_sec', 'render_seconds', 'renders', 'db_write_seconds',
+    'storage_seconds', 'storage_calls', 'generation_id',
+)
+
+
+# Schema version kept in PRAGMA user_version. Version 1 is the schema as it
+# stood before versioning; each entry is (version, name, ConversationStorage
+# method, PLAN_QUERIES recorded around it) and is applied once, in order.
+MIGRATIONS = (
+    (1, 'baseline', '_create_baseline_schema', ()),
+    (2, 'message windows', '_migrate_message_windows',
+     ('get_messages[newest]', 'get_messages[before_id]', 'save_summary')),
+    (3, 'covering conversation list index', '_migrate_listing_index',
+     ('list_conversations[first page]', 'list_conversations[cursor]')),
+    (4, 'message blobs', '_migrate_message_blobs', ('get_messages[newest]',)),
+    (5, 'usage rollups', '_migrate_usage_rollups', ('usage_by_day',)),
+    (6, 'message vectors', '_migrate_message_vectors', ()),
+    (7, 'message tree', '_migrate_message_tree', ('get_messages[branch]',)),
+    (8, 'generations', '_migrate_generations', ()),
+    (9, 'read cache epoch', '_migrate_cache_epoch', ()),
+    (10, 'generation ids never reused', '_migrate_generation_ids', ()),
+    (11, 'turn metrics per generation', '_migrate_turn_metrics_generation', ()),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Backfills update this many rows per transaction, so sessions that are
+# already running can write between chunks.
+MIGRATION_CHUNK_SIZE = 5000
+
+# Queries whose EXPLAIN QUERY PLAN is recorded before and after the
+# migrations that target them; the parameters are placeholders.
+PLAN_QUERIES = {
+    'list_conversations[first page]': ("""
+        SELECT id, title, created_at, updated_at,
+               total_input_tokens, total_output_tokens, model_used, message_count,
+               total_cache_creation_tokens, total_cache_read_tokens
+        FROM conversations
+        ORDER BY updated_at DESC, id DESC
+        LIMIT ?
+    """, (11,)),
+    'list_conversations[cursor]': ("""
+        SELECT id, title, created_at, updated_at,
+               total_input_tokens, total_output_tokens, model_used, message_count,
+               total_cache_creation_tokens, total_cache_read_tokens
+        FROM conversations
+        WHERE (updated_at, id) < (?, ?)
+        ORDER BY updated_at DESC, id DESC
+        LIMIT ?
+    """, ('', 0, 11)),
+    'get_messages[newest]': ("""
+        SELECT id, role, content, timestamp, input_tokens, output_tokens,
+               cache_creation_tokens, cache_read_tokens, model
+        FROM messages
+        WHERE conversation_id = ?
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    """, (0, 50)),
+    'get_messages[before_id]': ("""
+        SELECT id, role, content, timestamp, input_tokens, output_tokens,
+               cache_creation_tokens, cache_read_tokens, model
+        FROM messages
+        WHERE conversation_id = ? AND (timestamp, id) < (SELECT timestamp, id FROM messages WHERE id = ?)
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    """, (0, 0, 50)),
+    'get_messages[branch]': (BRANCH_PATH.format(schema='main', start=BRANCH_HEAD.format(schema='main')) + """
+        SELECT b.id, path.parent_id, b.role, b.content, b.timestamp, b.input_tokens, b.output_tokens,
+               b.cache_creation_tokens, b.cache_read_tokens, b.model
+        FROM path JOIN main.message_bodies b ON b.id = path.id
+        ORDER BY path.depth DESC
+    """, (0, 0, None, None, 50)),
+    'save_summary': ("""
+        SELECT COUNT(*)
+        FROM messages
+        WHERE conversation_id = ?
+          AND (timestamp, id) <= (SELECT timestamp, id FROM messages WHERE id = ?)
+    """, (0, 0)),
+    'usage_by_day': ("""
+        SELECT day, model, messages, input_tokens, output_tokens,
+               cache_creation_tokens, cache_read_tokens, cost
+        FROM usage_daily
+        WHERE day >= ?
+        ORDER BY day, model
+    """, ('',)),
+}
+
+
+def open_archive(path: str, mode: str = 'r'):
+    """Open a JSONL archive as text, compressed by extension (.gz, or .zst with zstandard)."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError('Reading or writing .zst archives requires the zstandard package') from e
+        return zstandard.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError('The zstd codec requires the zstandard package') from e
+    return zstandard
+
+
+def _fcntl():
+    try:
+        import fcntl
+    except ImportError as e:
+        raise ImportError('The cross-process write lock needs fcntl, which this platform lacks') from e
+    return fcntl
+
+
+def _pack_body(data: bytes, codec: str) -> tuple[str, bytes]:
+    """Compress a message body with codec, or keep it 'raw' if that isn't smaller."""
+    if codec == 'zstd':
+        packed = _zstandard().ZstdCompressor(level=6).compress(data)
+    else:
+        packed = zlib.compress(data, 6)
+    if len(packed) < len(data):
+        return codec, packed
+    return 'raw', data
+
+
+def _unpack_body(codec: str, data: bytes) -> str:
+    """SQL function assis_unpack(codec, data): the text of a message_blobs row."""
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+    elif codec == 'zstd':
+        data = _zstandard().ZstdDecompressor().decompress(data)
+    return data.decode('utf-8')
+
+
+class _ConnectionPool:
+    """Thread-safe pool of reusable SQLite connections for one database file."""
+
+    def __init__(self, db_path: str, max_idle: int = 8):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=5.0,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function('assis_unpack', 2, _unpack_body, deterministic=True)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commit on success, roll back on error.
+
+        Nested calls on the same thread reuse the outer connection and join
+        its transaction, so composite writes commit once at the outermost level.
+        """
+        active = getattr(self._local, 'conn', None)
+        if active is not None:
+            yield active
+            return
+
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._open()
+        self._local.conn = conn
+        changes = conn.total_changes
+        self._local.publish = False
+        epoch = None
+        try:
+            yield conn
+            publish = self._local.publish or getattr(self._local, 'published', 0)
+            if publish and conn.total_changes != changes:
+                epoch = _bump_epoch(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        if epoch is not None:
+            _get_read_cache(self.db_path).committed(epoch)
+
+    @contextmanager
+    def published(self):
+        """Make the writes committed on this thread meanwhile drop other processes' cached reads.
+
+        Each transaction that changed anything also moves the shared
+        cache_epoch, which _ReadCache.sync() compares. Inside a transaction
+        that began outside, its commit publishes.
+        """
+        if getattr(self._local, 'conn', None) is not None:
+            self._local.publish = True
+        self._local.published = getattr(self._local, 'published', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.published -= 1
+
+    def close_all(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+# Pools are process-wide so connections survive Streamlit reruns and are
+# shared between browser sessions pointing at the same file.
+_pools: dict[str, _ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _bump_epoch(conn) -> int:
+    """Move cache_epoch on in the current write transaction; returns its new value."""
+    return conn.execute('UPDATE main.cache_epoch SET version = version + 1 RETURNING version').fetchall()[0][0]
+
+
+def _get_pool(db_path: str) -> _ConnectionPool:
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = _ConnectionPool(db_path)
+        return pool
+
+
+class _ReadCache:
+    """Process-wide memo of read results for one database file.
+
+    Every mutating ConversationStorage method bumps `version` after it
+    commits, which drops all memoized reads. A read records the version it
+    started under and is only kept if no write landed while it ran, so a
+    cached result is never older than the last committed write. Settings are
+    held separately: loaded in one query and updated write-through.
+
+    Writes by other processes are caught by sync(), which every cached read
+    calls first. SQLite's `PRAGMA data_version` changes whenever another
+    connection commits, including this process's own; only then is the
+    shared cache_epoch row read. Every transaction of a write that drops
+    cached reads (or a setting) moves that epoch on, and this process notes
+    the values its own commits moved it to (committed()), so only another
+    process's writes make sync() drop everything, settings included.
+    Checkpoints and other writes no read is memoized from leave it alone.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 256):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.version = 0
+        self.settings: Optional[dict[str, Any]] = None
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # Private connection that only watches data_version; it never holds a transaction
+        self._watch: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self._epoch: Optional[int] = None
+
+    def sync(self):
+        """Drop every cached read if another process has published writes since the last sync."""
+        if self.db_path is None:
+            return
+        with self._lock:
+            if self._watch is None:
+                self._watch = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            data_version = self._watch.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._data_version:
+                return
+            self._data_version = data_version
+            try:
+                epoch = self._watch.execute('SELECT version FROM cache_epoch').fetchone()[0]
+            except sqlite3.Error:
+                # Not created yet by the schema upgrade; assume the worst
+                epoch = None
+            if epoch is None or epoch != self._epoch:
+                self._epoch = epoch
+                self._clear()
+
+    def committed(self, epoch: int):
+        """Note that a commit of this process moved cache_epoch to epoch."""
+        with self._lock:
+            if self._epoch is not None and epoch <= self._epoch:
+                return
+            if self._epoch != epoch - 1:
+                # Another process published writes since the last sync
+                self._clear()
+            self._epoch = epoch
+
+    def _clear(self):
+        self.version += 1
+        self.settings = None
+        self._entries.clear()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return _MISSING
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, version: int, value):
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+_MISSING = object()
+_read_caches: dict[str, _ReadCache] = {}
+
+# Databases whose schema this process has already brought up to date, so
+# further ConversationStorage instances (one per Streamlit rerun) skip the check.
+_initialized: set[str] = set()
+
+
+def _get_read_cache(db_path: str) -> _ReadCache:
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        cache = _read_caches.get(key)
+        if cache is None:
+            cache = _read_caches[key] = _ReadCache(key)
+        return cache
+
+
+def _clone(value):
+    """Copy cached containers so callers can't mutate the cached value."""
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_clone(v) for v in value)
+    return value
+
+
+def _cached_read(method):
+    """Memoize a read-only ConversationStorage method until the next write."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self._read_cache
+        cache.sync()
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        value = cache.get(key)
+        if value is _MISSING:
+            version = cache.version
+            value = method(self, *args, **kwargs)
+            cache.put(key, version, value)
+        return _clone(value)
+    return wrapper
+
+
+# Stack of active record_storage_timings() collectors, per thread.
+_timings = threading.local()
+
+
+@contextmanager
+def record_storage_timings() -> Iterator[dict[str, Any]]:
+    """Collect timings of ConversationStorage calls made on this thread.
+
+    Yields {'total': seconds, 'methods': {name: [calls, seconds]}}, filled
+    in as calls return. Nested calls (save_turn calling save_compare_turn)
+    count towards each method but only once towards the total. Collectors
+    nest too; every active one sees every call.
+    """
+    timings: dict[str, Any] = {'total': 0.0, 'methods': {}}
+    if not hasattr(_timings, 'stack'):
+        _timings.stack = []
+        _timings.depth = 0
+    _timings.stack.append(timings)
+    try:
+        yield timings
+    finally:
+        _timings.stack.remove(timings)
+
+
+def _timed(method):
+    """Report a ConversationStorage method's wall time to active collectors."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not getattr(_timings, 'stack', None):
+            return method(self, *args, **kwargs)
+        _timings.depth += 1
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _timings.depth -= 1
+            for timings in _timings.stack:
+                calls = timings['methods'].setdefault(name, [0, 0.0])
+                calls[0] += 1
+                calls[1] += elapsed
+                if _timings.depth == 0:
+                    timings['total'] += elapsed
+    return wrapper
+
+
+def _instrument(cls):
+    """Time every public method of cls for record_storage_timings().
+
+    Generators are left alone: their work happens after the call returns.
+    """
+    for name, member in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(member) or inspect.isgeneratorfunction(member):
+            continue
+        setattr(cls, name, _timed(member))
+    return cls
+
+
+def _percentile(values: list[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile, q in 0..100; None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+
+def _invalidates(method):
+    """Mark a ConversationStorage method as a write that invalidates cached reads, in every process."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            with self._pool.published():
+                return method(self, *args, **kwargs)
+        finally:
+            self._read_cache.bump()
+    return wrapper
+
+
+def _serialized(method):
+    """Run a ConversationStorage write on the writer thread in single-writer mode.
+
+    The caller blocks until the write is committed and gets its result or
+    exception. A call made inside an open connection on this thread (the
+    writer's own, or a nested write) runs in place and joins that transaction.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.single_writer and getattr(self._pool._local, 'conn', None) is None:
+            return _get_writer(self._pool).call(method, self, *args, **kwargs)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _serialized_alone(method):
+    """Like _serialized, for a write that commits in steps of its own (or ATTACHes).
+
+    In single-writer mode it runs on the writer thread between batches, on
+    no transaction of the writer's, so other writes queue behind it rather
+    than contending with it for the SQLite write lock.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.single_writer and getattr(self._pool._local, 'conn', None) is None:
+            return _get_writer(self._pool).call_alone(method, self, *args, **kwargs)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class _FileLock:
+    """Exclusive advisory lock on a file, held by one process at a time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fcntl = _fcntl()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def __enter__(self):
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+
+class _BatchWriter:
+    """Background thread that applies queued writes as group commits.
+
+    Writes submitted from any thread or session are drained in batches of up
+    to `max_batch`, waiting at most `max_delay` seconds for a batch to fill;
+    a batch holding a call() that someone is blocked on takes only what is
+    already queued. Each batch runs in one transaction with a savepoint per
+    write, so a failing write is rolled back alone and reported through its
+    Future. With a file_lock, processes sharing the database take turns
+    holding it for a batch rather than polling SQLite's lock. A call_alone()
+    write runs as a batch of its own outside any transaction, and whatever
+    it calls back into the writer runs in place.
+    """
+
+    def __init__(self, pool: _ConnectionPool, max_batch: int = 64, max_delay: float = 0.05):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.file_lock: Optional[_FileLock] = None
+        self._queue: queue.Queue = queue.Queue()
+        # A call_alone() write taken from the queue while a batch was filling
+        self._held = None
+        self._thread = threading.Thread(target=self._run, name='assis-batch-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs) for the writer thread."""
+        future: Future = Future()
+        self._queue.put((fn, args, kwargs, future, False, False))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the writer thread and wait for its committed result."""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)
+        future: Future = Future()
+        self._queue.put((fn, args, kwargs, future, True, False))
+        return future.result()
+
+    def call_alone(self, fn, *args, **kwargs):
+        """call() fn outside any batch transaction; it commits its own."""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)
+        future: Future = Future()
+        self._queue.put((fn, args, kwargs, future, True, True))
+        return future.result()
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until everything queued so far has been committed."""
+        # On the writer thread, everything queued before has been
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self.submit(lambda: None).result(timeout)
+
+    def _next_batch(self) -> list:
+        batch = [self._held or self._queue.get()]
+        self._held = None
+        if batch[0][5]:
+            return batch
+        waiting = batch[0][4]
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait() if waiting else self._queue.get(timeout=self.max_delay)
+            except queue.Empty:
+                break
+            if item[5]:
+                self._held = item
+                break
+            batch.append(item)
+            waiting = waiting or item[4]
+        return batch
+
+    def _run_alone(self, fn, args, kwargs, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            with self.file_lock or nullcontext():
+                result = fn(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch[0][5]:
+                self._run_alone(*batch[0][:4])
+                continue
+            done = []
+            try:
+                with self.file_lock or nullcontext(), self.pool.published(), self.pool.connection() as conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    for fn, args, kwargs, future, _, _ in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        conn.execute('SAVEPOINT batch_write')
+                        try:
+                            result = fn(*args, **kwargs)
+                        except Exception as e:
+                            conn.execute('ROLLBACK TO batch_write')
+                            conn.execute('RELEASE batch_write')
+                            future.set_exception(e)
+                        else:
+                            conn.execute('RELEASE batch_write')
+                            done.append((future, result))
+            except Exception as e:
+                # The whole batch was rolled back, including writes that had succeeded
+                for _, _, _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            # Writes inside the batch bumped the read cache before this commit
+            _get_read_cache(self.pool.db_path).bump()
+            for future, result in done:
+                future.set_result(result)
+
+
+_writers: dict[str, _BatchWriter] = {}
+
+# Serialized exports keyed by (database, conversation id, format), each stored
+# with the conversation row it was built from so edits invalidate it.
+EXPORT_CACHE_SIZE = 16
+_export_cache: OrderedDict = OrderedDict()
+_export_cache_lock = threading.Lock()
+
+# Response cache hit/miss counters since process start, per database file.
+_response_cache_counters: dict[str, dict[str, int]] = {}
+
+
+def _get_writer(pool: _ConnectionPool, file_lock: bool = False) -> _BatchWriter:
+    key = os.path.abspath(pool.db_path)
+    with _pools_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = _BatchWriter(pool)
+        if file_lock and writer.file_lock is None:
+            writer.file_lock = _FileLock(key + '.lock')
+        return writer
+
+
+@atexit.register
+def _flush_writers():
+    for writer in list(_writers.values()):
+        writer.flush(timeout=10)
+
+
+@_instrument
 class ConversationStorage:
     """Manages persistent storage for conversations and settings using SQLite."""
 
-    def __init__(self, db_path: str = 'assis_data.db'):
-        """Initialize the storage with a database path."""
+    def __init__(self, db_path: str = 'assis_data.db', write_behind: bool = False, codec: str = BLOB_CODEC,
+                 archive_path: Optional[str] = None, single_writer: bool = False, write_lock: bool = False,
+                 pricing: Optional[dict[str, tuple[float, float, float, float]]] = None,
+                 embedder: Optional[Callable[[str], bytes]] = None):
+        """Initialize the storage with a database path.
+
+        With write_behind, queue_turn() hands turns to a process-wide
+        background writer instead of committing them on the caller's thread.
+        With single_writer, every other write goes through that writer too
+        and the caller waits for its commit, so sessions in one process never
+        contend for the SQLite write lock; reads stay on the caller's thread.
+        write_lock makes the writers of all processes using db_path take
+        turns on a lock file (POSIX only). codec compresses new message
+        blobs; blobs written with any codec stay readable. archive_path is
+        the archive database for idle conversations, by default next to
+        db_path with an .archive.db suffix. pricing maps a model to its USD
+        price per million input, output, cache write and cache read tokens,
+        for the cost column of the usage rollups; other models cost nothing.
+        embedder turns message text into a vector blob (see semantic.py),
+        stored for each new message; without one no vectors are written.
+        """
+        if codec not in BLOB_CODECS:
+            raise ValueError(f'Unknown codec {codec!r}; expected one of {", ".join(BLOB_CODECS)}')
+        if codec == 'zstd':
+            _zstandard()
         self.db_path = db_path
-        self._init_database()
+        self.write_behind = write_behind
+        self.single_writer = single_writer
+        self.codec = codec
+        self.pricing = pricing or {}
+        self.embedder = embedder
+        self.archive_path = archive_path or os.path.splitext(db_path)[0] + '.archive.db'
+        self._pool = _get_pool(db_path)
+        self._read_cache = _get_read_cache(db_path)
+        if write_lock:
+            _get_writer(self._pool, file_lock=True)
+        key = os.path.abspath(db_path)
+        if key not in _initialized or not os.path.exists(key):
+            self._init_database()
+            _initialized.add(key)
+
+    def _connection(self):
+        """Borrow a pooled connection as a transaction context manager."""
+        return self._pool.connection()
 
     def _init_database(self):
-        """Create tables if they don't exist."""
-        with sqlite3.connect(self.db_path) as conn:
+        """Bring the schema up to SCHEMA_VERSION, applying pending migrations in order.
+
+        Each step is idempotent, so a migration interrupted part-way (or run
+        by two processes at once) is simply run again; user_version only
+        moves once a migration has fully completed.
+        """
+        with self._connection() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL,
+                    seconds REAL NOT NULL,
+                    query_plans TEXT
+                )
+            """)
+        # Writes in earlier migrations already publish through it
+        self._migrate_cache_epoch()
+        for target, name, method, queries in MIGRATIONS:
+            if target > version:
+                self._apply_migration(target, name, getattr(self, method), queries)
+        with self._pool.published(), self._connection() as conn:
+            _bump_epoch(conn)
+        self._read_cache.bump()
+
+    def _apply_migration(self, version: int, name: str, migrate, queries: tuple[str, ...]):
+        """Run one migration and record it, with the plans of `queries` before and after."""
+        before = self._explain(queries)
+        started = time.perf_counter()
+        migrate()
+        seconds = time.perf_counter() - started
+        plans = {query: {'before': before[query], 'after': plan}
+                 for query, plan in self._explain(queries).items()}
+
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+                return  # another process finished it first
+            conn.execute("""
+                INSERT OR REPLACE INTO schema_migrations (version, name, applied_at, seconds, query_plans)
+                VALUES (?, ?, ?, ?, ?)
+            """, (version, name, datetime.now().isoformat(), seconds, json.dumps(plans)))
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+
+    def _explain(self, queries: tuple[str, ...]) -> dict[str, list[str]]:
+        """EXPLAIN QUERY PLAN for the named PLAN_QUERIES, one line per plan step."""
+        plans = {}
+        with self._connection() as conn:
+            for query in queries:
+                sql, params = PLAN_QUERIES[query]
+                try:
+                    rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                except sqlite3.OperationalError as e:
+                    plans[query] = [f'error: {e}']
+                else:
+                    plans[query] = [row['detail'] for row in rows]
+        return plans
+
+    def _backfill(self, table: str, assignment: str, where: str,
+                  chunk_size: int = MIGRATION_CHUNK_SIZE) -> int:
+        """UPDATE table SET assignment WHERE where, one id range of chunk_size rows per transaction.
+
+        Short transactions let running sessions write between chunks instead
+        of waiting out one update of the whole table. `where` must exclude
+        rows already done, so an interrupted backfill resumes where it stopped.
+        """
+        with self._connection() as conn:
+            low, high = conn.execute(f'SELECT MIN(id), MAX(id) FROM {table}').fetchone()
+        if low is None:
+            return 0
+
+        updated = 0
+        for start in range(low, high + 1, chunk_size):
+            with self._connection() as conn:
+                updated += conn.execute(f"""
+                    UPDATE {table} SET {assignment}
+                    WHERE id >= ? AND id < ? AND ({where})
+                """, (start, start + chunk_size)).rowcount
+        return updated
+
+    # ==================== Migrations ====================
+
+    def _create_baseline_schema(self):
+        """Version 1: the schema as it stood before versioning.
+
+        Creates a new database, and brings one from any earlier release up to
+        date through the column checks that predate migrations.
+        """
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
             cursor = conn.cursor()
 
             # Conversations table
@@ -26,10 +1124,16 @@ class ConversationStorage:
                     updated_at TIMESTAMP NOT NULL,
                     total_input_tokens INTEGER DEFAULT 0,
                     total_output_tokens INTEGER DEFAULT 0,
-                    model_used TEXT
+                    model_used TEXT,
+                    message_count INTEGER DEFAULT 0,
+                    total_cache_creation_tokens INTEGER DEFAULT 0,
+                    total_cache_read_tokens INTEGER DEFAULT 0
                 )
             """)
 
+            # Databases created before message_count existed get it backfilled below
+            self._add_column_if_missing(cursor, 'conversations', 'message_count', 'INTEGER DEFAULT 0')
+
             # Messages table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS messages (
@@ -40,10 +1144,25 @@ class ConversationStorage:
                     timestamp TIMESTAMP NOT NULL,
                     input_tokens INTEGER DEFAULT 0,
                     output_tokens INTEGER DEFAULT 0,
+                    cache_creation_tokens INTEGER DEFAULT 0,
+                    cache_read_tokens INTEGER DEFAULT 0,
+                    model TEXT,
                     FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
                 )
             """)
 
+            # Prompt-cache accounting, added after the first release
+            for table, column in (
+                ('conversations', 'total_cache_creation_tokens'),
+                ('conversations', 'total_cache_read_tokens'),
+                ('messages', 'cache_creation_tokens'),
+                ('messages', 'cache_read_tokens'),
+            ):
+                self._add_column_if_missing(cursor, table, column, 'INTEGER DEFAULT 0')
+
+            # Model that wrote each assistant reply (compare mode stores several per turn)
+            self._add_column_if_missing(cursor, 'messages', 'model', 'TEXT')
+
             # Settings table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS settings (
@@ -52,6 +1171,55 @@ class ConversationStorage:
                 )
             """)
 
+            # Rolling summaries of older messages, reused across turns
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_summaries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id INTEGER NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    summary TEXT NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+                )
+            """)
+
+            # Replies to deterministic requests, keyed by a hash of the request
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT NOT NULL,
+                    input_tokens INTEGER DEFAULT 0,
+                    output_tokens INTEGER DEFAULT 0,
+                    size_bytes INTEGER NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    last_used_at TIMESTAMP NOT NULL,
+                    hits INTEGER DEFAULT 0
+                )
+            """)
+
+            # Timings of each chat turn, written by the background writer
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS turn_metrics (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id INTEGER,
+                    model TEXT,
+                    source TEXT NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    ttft_seconds REAL,
+                    stream_seconds REAL,
+                    total_seconds REAL,
+                    output_tokens INTEGER DEFAULT 0,
+                    tokens_per_sec REAL,
+                    render_seconds REAL,
+                    renders INTEGER,
+                    db_write_seconds REAL,
+                    storage_seconds REAL,
+                    storage_calls TEXT,
+                    FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE SET NULL
+                )
+            """)
+
             # Create indexes for better query performance
             cursor.execute("""
                 CREATE INDEX IF NOT EXISTS idx_messages_conversation
@@ -59,174 +1227,1916 @@ class ConversationStorage:
             """)
 
             cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_conversations_updated
-                ON conversations(updated_at DESC)
+                CREATE INDEX IF NOT EXISTS idx_summaries_conversation
+                ON conversation_summaries(conversation_id, message_count)
             """)
 
-            conn.commit()
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_response_cache_last_used
+                ON response_cache(last_used_at)
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_turn_metrics_model
+                ON turn_metrics(model, id)
+            """)
+
+            # Keyset index for paginated listing (replaces idx_conversations_updated)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conversations_updated_id
+                ON conversations(updated_at DESC, id DESC)
+            """)
+            cursor.execute('DROP INDEX IF EXISTS idx_conversations_updated')
+
+            # Stable identity for export/import; new rows get a random one, older
+            # rows theirs from the backfill below
+            self._add_column_if_missing(cursor, 'conversations', 'uuid', 'TEXT')
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_conversations_uuid
+                ON conversations(uuid)
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS conversations_uuid AFTER INSERT ON conversations
+                WHEN new.uuid IS NULL BEGIN
+                    UPDATE conversations SET uuid = lower(hex(randomblob(16))) WHERE id = new.id;
+                END
+            """)
+
+            self._init_search_index(cursor)
+
+        # Backfills for databases from before these columns, a chunk of rows
+        # per transaction so sessions on the database can write in between
+        self._backfill('conversations', """
+            message_count = (
+                SELECT COUNT(*) FROM messages WHERE conversation_id = conversations.id
+            )
+        """, 'message_count = 0')
+        self._backfill('conversations', 'uuid = lower(hex(randomblob(16)))', 'uuid IS NULL')
+
+    def _migrate_message_windows(self):
+        """Version 2: index messages in display order and key summaries by message ID.
+
+        idx_messages_conversation_time replaces idx_messages_conversation, so
+        a window of the newest messages is a range scan with no sort. Older
+        summaries get the ID of their message_count-th message.
+        """
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._add_column_if_missing(conn.cursor(), 'conversation_summaries', 'last_message_id', 'INTEGER')
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_conversation_time
+                ON messages(conversation_id, timestamp, id)
+            """)
+            conn.execute('DROP INDEX IF EXISTS idx_messages_conversation')
+
+        self._backfill('conversation_summaries', """
+            last_message_id = (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (ORDER BY timestamp, id) AS position
+                    FROM messages
+                    WHERE conversation_id = conversation_summaries.conversation_id
+                )
+                WHERE position = conversation_summaries.message_count
+            )
+        """, 'last_message_id IS NULL')
+
+    def _migrate_listing_index(self):
+        """Version 3: serve the conversation list from the index alone.
+
+        idx_conversations_listing carries every listed column after its
+        (updated_at, id) key, so a page never touches the table; it replaces
+        idx_conversations_updated_id.
+        """
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conversations_listing
+                ON conversations(updated_at DESC, id DESC, title, created_at,
+                                 total_input_tokens, total_output_tokens, model_used, message_count,
+                                 total_cache_creation_tokens, total_cache_read_tokens)
+            """)
+            conn.execute('DROP INDEX IF EXISTS idx_conversations_updated_id')
+
+    def _migrate_message_blobs(self):
+        """Version 4: content-addressed, compressed storage for long message bodies.
+
+        Adds message_blobs and messages.blob_id, and the message_bodies view
+        that reads either form back as text. The search index is recreated
+        over that view, which re-reads every message once; bodies already
+        stored stay inline until rewrite_message_bodies() moves them.
+
+        The index is filled one id range of MIGRATION_CHUNK_SIZE messages per
+        transaction. Its triggers are created with the last range, which also
+        indexes any message saved while the earlier ones ran.
+        """
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._add_column_if_missing(conn.cursor(), 'messages', 'blob_id', 'INTEGER')
+            for statement in MESSAGE_BLOB_SCHEMA:
+                conn.execute(statement.format(schema='main'))
+
+            for trigger in ('messages_fts_insert', 'messages_fts_delete', 'messages_fts_update'):
+                conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            conn.execute('DROP TABLE IF EXISTS messages_fts')
+            conn.execute("""
+                CREATE VIRTUAL TABLE messages_fts USING fts5(
+                    content,
+                    content='message_bodies',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='2 3'
+                )
+            """)
+            high = conn.execute('SELECT MAX(id) FROM messages').fetchone()[0] or 0
+
+        index_range = 'INSERT INTO messages_fts (rowid, content) SELECT id, content FROM message_bodies WHERE id >= ?'
+        for start in range(1, high + 1, MIGRATION_CHUNK_SIZE):
+            with self._connection() as conn:
+                conn.execute(f'{index_range} AND id < ?', (start, min(start + MIGRATION_CHUNK_SIZE, high + 1)))
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(index_range, (high + 1,))
+            for trigger in MESSAGE_BODY_TRIGGERS:
+                conn.execute(trigger)
+
+    def _migrate_usage_rollups(self):
+        """Version 5: per-day, per-model token and cost rollups.
+
+        usage_daily is kept up to date as messages are added, so usage
+        analytics never scan messages. It is filled from existing messages
+        (hot and archived) once, here.
+        """
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage_daily (
+                    day TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    messages INTEGER NOT NULL DEFAULT 0,
+                    input_tokens INTEGER NOT NULL DEFAULT 0,
+                    output_tokens INTEGER NOT NULL DEFAULT 0,
+                    cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+                    cache_read_tokens INTEGER NOT NULL DEFAULT 0,
+                    cost REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, model)
+                ) WITHOUT ROWID
+            """)
+        self.rebuild_usage_rollups()
+
+    def _migrate_message_vectors(self):
+        """Version 6: one embedding per message, for semantic search.
+
+        Rows get an AUTOINCREMENT id so an in-memory index can pick up new
+        vectors (including those of restored, older messages) with a keyset
+        scan. Existing messages are embedded later by index_message_vectors().
+        """
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS message_vectors (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message_id INTEGER NOT NULL UNIQUE,
+                    conversation_id INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
+                )
+            """)
+
+    def _migrate_message_tree(self):
+        """Version 7: messages as a tree, so a conversation can branch without copying its prefix.
+
+        Adds messages.parent_id, conversations.head_id and branch_count. Each
+        existing message gets the one before it in display order as parent and
+        each conversation its newest message as head: one branch, as before.
+        """
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.cursor()
+            self._add_column_if_missing(cursor, 'messages', 'parent_id', 'INTEGER')
+            self._add_column_if_missing(cursor, 'conversations', 'head_id', 'INTEGER')
+            self._add_column_if_missing(cursor, 'conversations', 'branch_count', 'INTEGER DEFAULT 1')
+            conn.execute(MESSAGE_TREE_INDEX.format(schema='main'))
+
+        # First messages keep a NULL parent and are simply looked at again on a rerun
+        self._backfill('messages', MESSAGE_PARENT_BACKFILL.format(schema='main'), 'parent_id IS NULL')
+        self._backfill('conversations', CONVERSATION_HEAD_BACKFILL.format(schema='main'), 'head_id IS NULL')
+
+    def _migrate_generations(self):
+        """Version 8: replies being generated in the background, with their text so far.
+
+        A row lives from the request until its turn is saved. owner is the
+        process generating it; a row that stops being checkpointed outlived
+        its process and can be resumed from its content.
+        """
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id INTEGER NOT NULL,
+                    prompt TEXT NOT NULL,
+                    model TEXT,
+                    content TEXT NOT NULL DEFAULT '',
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    owner TEXT,
+                    started_at TIMESTAMP NOT NULL,
+                    updated_at TIMESTAMP NOT NULL,
+                    FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_generations_conversation ON generations(conversation_id)')
+
+    def _migrate_generation_ids(self):
+        """Version 10: never hand out the ID of a generation that has ended.
+
+        Its worker may still be tidying up under that ID after the row is
+        gone. Version 8 created the table without AUTOINCREMENT, so its few
+        rows are copied to one created with it.
+        """
+        with self._connection() as conn:
+            sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'generations'").fetchone()
+            if 'AUTOINCREMENT' in sql['sql']:
+                return
+            conn.execute('DROP INDEX IF EXISTS idx_generations_conversation')
+            conn.execute('ALTER TABLE generations RENAME TO generations_old')
+            self._migrate_generations()
+            conn.execute('INSERT INTO generations SELECT * FROM generations_old')
+            conn.execute('DROP TABLE generations_old')
+
+    def _migrate_turn_metrics_generation(self):
+        """Version 11: the background reply a turn_metrics row was timed for."""
+        with self._connection() as conn:
+            self._add_column_if_missing(conn.cursor(), 'turn_metrics', 'generation_id', 'INTEGER')
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_turn_metrics_generation
+                ON turn_metrics(generation_id) WHERE generation_id IS NOT NULL
+            """)
+
+    def _migrate_cache_epoch(self):
+        """Add the row that counts writes which drop other processes' cached reads."""
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_epoch (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL
+                )
+            """)
+            conn.execute('INSERT OR IGNORE INTO cache_epoch (id, version) VALUES (1, 0)')
+
+    def _init_search_index(self, cursor):
+        """Create the FTS5 tables that mirror message content and titles.
+
+        Both are external-content tables: the text lives only in messages and
+        conversations, and triggers keep the token index in step with every
+        insert, update and delete. The title index is rebuilt once when the
+        tables are first created, which backfills databases that predate
+        search; the message index is filled by _migrate_message_blobs(),
+        which always follows and recreates it over message_bodies.
+        """
+        cursor.execute("""
+            SELECT COUNT(*) FROM sqlite_master
+            WHERE type = 'table' AND name IN ('messages_fts', 'conversations_fts')
+        """)
+        needs_backfill = cursor.fetchone()[0] < 2
+
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content,
+                content='messages',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+                title,
+                content='conversations',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+
+        for trigger in SEARCH_TRIGGERS:
+            cursor.execute(trigger)
+
+        if needs_backfill:
+            cursor.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('rebuild')")
+
+    @staticmethod
+    def _add_column_if_missing(cursor, table: str, column: str, definition: str, schema: str = 'main') -> bool:
+        """Add a column to an existing table; return True if it was added."""
+        cursor.execute(f'PRAGMA {schema}.table_info({table})')
+        if any(row['name'] == column for row in cursor.fetchall()):
+            return False
+        cursor.execute(f'ALTER TABLE {schema}.{table} ADD COLUMN {column} {definition}')
+        return True
+
+    def schema_migrations(self) -> list[dict[str, Any]]:
+        """Get the applied migrations, oldest first, with the query plans recorded around each."""
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT version, name, applied_at, seconds, query_plans
+                FROM schema_migrations
+                ORDER BY version
+            """).fetchall()
+        return [{**dict(row), 'query_plans': json.loads(row['query_plans'] or '{}')} for row in rows]
 
     # ==================== Conversation Management ====================
 
+    @_serialized
+    @_invalidates
     def create_conversation(self, title: str = 'New Conversation') -> int:
         """Create a new conversation and return its ID."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connection() as conn:
             cursor = conn.cursor()
             now = datetime.now().isoformat()
             cursor.execute("""
                 INSERT INTO conversations (title, created_at, updated_at)
                 VALUES (?, ?, ?)
             """, (title, now, now))
-            conn.commit()
             return cursor.lastrowid
 
+    @_serialized
+    @_invalidates
     def update_conversation_title(self, conversation_id: int, title: str):
         """Update the title of a conversation."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE conversations
                 SET title = ?, updated_at = ?
                 WHERE id = ?
             """, (title, datetime.now().isoformat(), conversation_id))
-            conn.commit()
 
+    @_serialized
+    def _delete_hot_conversation(self, conversation_id: int) -> bool:
+        with self._connection() as conn:
+            return conn.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,)).rowcount > 0
+
+    @_invalidates
     def delete_conversation(self, conversation_id: int):
-        """Delete a conversation and all its messages."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,))
-            conn.commit()
+        """Delete a conversation and all its messages, whether hot or archived."""
+        # The archive fallback stays on this thread: ATTACH can't run inside the writer's transaction
+        if not self._delete_hot_conversation(conversation_id):
+            with self._archive_connection() as conn:
+                if conn is not None:
+                    conn.execute('DELETE FROM archive.conversations WHERE id = ?', (conversation_id,))
 
+    @_cached_read
     def get_all_conversations(self) -> list[dict[str, Any]]:
         """Get all conversations ordered by most recently updated."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT id, title, created_at, updated_at,
-                       total_input_tokens, total_output_tokens, model_used,
-                       (SELECT COUNT(*) FROM messages WHERE conversation_id = conversations.id) as message_count
+                       total_input_tokens, total_output_tokens, model_used, message_count,
+                       total_cache_creation_tokens, total_cache_read_tokens
                 FROM conversations
-                ORDER BY updated_at DESC
+                ORDER BY updated_at DESC, id DESC
             """)
             return [dict(row) for row in cursor.fetchall()]
 
+    @_cached_read
+    def list_conversations(self, limit: int = 10,
+                           cursor: Optional[tuple[str, int]] = None, archived: bool = False
+                           ) -> tuple[list[dict[str, Any]], Optional[tuple[str, int]]]:
+        """Get one page of conversations, most recently updated first.
+
+        Pass the returned cursor back in to fetch the next (older) page; it is
+        None once there are no more conversations. Each page is a range scan on
+        idx_conversations_listing, so its cost doesn't depend on table size.
+        With archived, pages through the archive instead.
+        """
+        schema = 'archive' if archived else 'main'
+        with self._tier_connection(archived) as conn:
+            if conn is None:
+                return [], None
+            if cursor is None:
+                rows = conn.execute(f"""
+                    SELECT id, title, created_at, updated_at,
+                           total_input_tokens, total_output_tokens, model_used, message_count,
+                           total_cache_creation_tokens, total_cache_read_tokens
+                    FROM {schema}.conversations
+                    ORDER BY updated_at DESC, id DESC
+                    LIMIT ?
+                """, (limit + 1,)).fetchall()
+            else:
+                rows = conn.execute(f"""
+                    SELECT id, title, created_at, updated_at,
+                           total_input_tokens, total_output_tokens, model_used, message_count,
+                           total_cache_creation_tokens, total_cache_read_tokens
+                    FROM {schema}.conversations
+                    WHERE (updated_at, id) < (?, ?)
+                    ORDER BY updated_at DESC, id DESC
+                    LIMIT ?
+                """, (cursor[0], cursor[1], limit + 1)).fetchall()
+
+        page = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = (last['updated_at'], last['id'])
+        return page, next_cursor
+
+    @_cached_read
     def get_conversation(self, conversation_id: int) -> Optional[dict[str, Any]]:
-        """Get a specific conversation by ID."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, title, created_at, updated_at,
-                       total_input_tokens, total_output_tokens, model_used
-                FROM conversations
-                WHERE id = ?
-            """, (conversation_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        """Get a specific conversation by ID, looking in the archive if it isn't hot.
+
+        Unlike the listings it includes head_id and branch_count.
+        """
+        for archived in (False, True):
+            with self._tier_connection(archived) as conn:
+                if conn is None:
+                    return None
+                row = conn.execute(f"""
+                    SELECT id, title, created_at, updated_at,
+                           total_input_tokens, total_output_tokens, model_used, message_count,
+                           total_cache_creation_tokens, total_cache_read_tokens, head_id, branch_count
+                    FROM {'archive' if archived else 'main'}.conversations
+                    WHERE id = ?
+                """, (conversation_id,)).fetchone()
+            if row:
+                return dict(row)
+        return None
 
     # ==================== Message Management ====================
 
+    @_serialized
+    @_invalidates
     def add_message(self, conversation_id: int, role: str, content: str,
-                   input_tokens: int = 0, output_tokens: int = 0):
-        """Add a message to a conversation."""
-        with sqlite3.connect(self.db_path) as conn:
+                   input_tokens: int = 0, output_tokens: int = 0,
+                   cache_creation_tokens: int = 0, cache_read_tokens: int = 0,
+                   model: Optional[str] = None):
+        """Add a message to a conversation, continuing its current branch."""
+        with self._connection() as conn:
             cursor = conn.cursor()
             now = datetime.now().isoformat()
 
             # Insert message
-            cursor.execute("""
-                INSERT INTO messages (conversation_id, role, content, timestamp, input_tokens, output_tokens)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (conversation_id, role, content, now, input_tokens, output_tokens))
+            cursor.execute('SELECT head_id FROM conversations WHERE id = ?', (conversation_id,))
+            row = cursor.fetchone()
+            message_id = self._insert_message(cursor, conversation_id, role, content, now, input_tokens,
+                                              output_tokens, cache_creation_tokens, cache_read_tokens, model,
+                                              parent_id=row['head_id'] if row else None)
 
             # Update conversation stats
             cursor.execute("""
                 UPDATE conversations
                 SET updated_at = ?,
                     total_input_tokens = total_input_tokens + ?,
-                    total_output_tokens = total_output_tokens + ?
+                    total_output_tokens = total_output_tokens + ?,
+                    total_cache_creation_tokens = total_cache_creation_tokens + ?,
+                    total_cache_read_tokens = total_cache_read_tokens + ?,
+                    message_count = message_count + 1,
+                    head_id = ?
                 WHERE id = ?
-            """, (now, input_tokens, output_tokens, conversation_id))
+            """, (now, input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens, message_id,
+                  conversation_id))
 
-            conn.commit()
+    def _insert_message(self, cursor, conversation_id: int, role: str, content: str, timestamp: str,
+                        input_tokens: int = 0, output_tokens: int = 0,
+                        cache_creation_tokens: int = 0, cache_read_tokens: int = 0,
+                        model: Optional[str] = None, parent_id: Optional[int] = None) -> int:
+        text = content
+        content, blob_id = self._store_body(cursor, content)
+        # A second child of the same parent starts a new branch
+        cursor.execute('SELECT 1 FROM messages WHERE conversation_id = ? AND parent_id IS ? LIMIT 1',
+                       (conversation_id, parent_id))
+        if cursor.fetchone():
+            cursor.execute('UPDATE conversations SET branch_count = branch_count + 1 WHERE id = ?',
+                           (conversation_id,))
+        cursor.execute("""
+            INSERT INTO messages (conversation_id, role, content, timestamp, input_tokens, output_tokens,
+                                  cache_creation_tokens, cache_read_tokens, model, blob_id, parent_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (conversation_id, role, content, timestamp, input_tokens, output_tokens,
+              cache_creation_tokens, cache_read_tokens, model, blob_id, parent_id))
+        message_id = cursor.lastrowid
+        if self.embedder is not None:
+            cursor.execute("""
+                INSERT INTO message_vectors (message_id, conversation_id, vector) VALUES (?, ?, ?)
+            """, (message_id, conversation_id, self.embedder(text)))
+
+        counts = (input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens)
+        if any(counts):
+            if model is None:
+                cursor.execute('SELECT model_used FROM conversations WHERE id = ?', (conversation_id,))
+                model = cursor.fetchone()['model_used']
+            self._add_usage(cursor, timestamp[:10], model or '', 1, counts)
+        return message_id
+
+    def _store_body(self, cursor, content: str) -> tuple[str, Optional[int]]:
+        """Return the (content, blob_id) to store for a message body.
+
+        Bodies under BLOB_MIN_BYTES stay inline. Longer ones are looked up by
+        hash in message_blobs and added, compressed, if new; the message then
+        keeps an empty content. A new blob starts with no references: the
+        insert trigger on messages counts them.
+        """
+        data = content.encode('utf-8')
+        if len(data) < BLOB_MIN_BYTES:
+            return content, None
+
+        digest = hashlib.sha256(data).digest()
+        cursor.execute('SELECT id FROM message_blobs WHERE hash = ?', (digest,))
+        row = cursor.fetchone()
+        if row:
+            return '', row['id']
+        codec, packed = _pack_body(data, self.codec)
+        cursor.execute("""
+            INSERT INTO message_blobs (hash, codec, size, data)
+            VALUES (?, ?, ?, ?)
+        """, (digest, codec, len(data), packed))
+        return '', cursor.lastrowid
+
+    @_serialized
+    @_invalidates
+    def save_turn(self, conversation_id: Optional[int], user_content: str, assistant_content: str,
+                  input_tokens: int = 0, output_tokens: int = 0,
+                  cache_creation_tokens: int = 0, cache_read_tokens: int = 0,
+                  model: Optional[str] = None, title: Optional[str] = None) -> int:
+        """Save a user message and the assistant reply in one transaction.
 
-    def get_messages(self, conversation_id: int) -> list[dict[str, Any]]:
-        """Get all messages for a conversation."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        Creates the conversation first when conversation_id is None (titled
+        `title`, or the start of the user message). Token usage is attributed
+        to the assistant reply. Returns the conversation ID.
+        """
+        reply = {
+            'content': assistant_content,
+            'model': model,
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'cache_creation_tokens': cache_creation_tokens,
+            'cache_read_tokens': cache_read_tokens,
+        }
+        return self.save_compare_turn(conversation_id, user_content, [reply], title=title)
+
+    @_serialized
+    @_invalidates
+    def save_compare_turn(self, conversation_id: Optional[int], user_content: str,
+                          replies: list[dict[str, Any]], title: Optional[str] = None) -> int:
+        """Save a user message and one reply per model in one transaction.
+
+        Each reply is a dict with 'content' and optionally 'model' and the
+        token counts taken by add_message. Replies are stored in order, so the
+        first one is the reply that continues the conversation. The
+        conversation's model_used becomes the first reply's model.
+        The turn continues the conversation's current branch; its messages
+        follow one another, so the last reply becomes the branch head.
+        Returns the conversation ID.
+        """
+        with self._connection() as conn:
             cursor = conn.cursor()
+            now = datetime.now().isoformat()
+
+            current = None
+            if conversation_id is None:
+                cursor.execute("""
+                    INSERT INTO conversations (title, created_at, updated_at)
+                    VALUES (?, ?, ?)
+                """, (title or user_content[:50], now, now))
+                conversation_id = cursor.lastrowid
+            else:
+                cursor.execute('SELECT head_id, model_used FROM conversations WHERE id = ?', (conversation_id,))
+                current = cursor.fetchone()
+
+            head_id = self._insert_message(cursor, conversation_id, 'user', user_content, now,
+                                           parent_id=current['head_id'] if current else None)
+            totals = dict.fromkeys(TOKEN_FIELDS, 0)
+            for reply in replies:
+                counts = {field: reply.get(field, 0) for field in TOKEN_FIELDS}
+                head_id = self._insert_message(cursor, conversation_id, 'assistant', reply['content'], now,
+                                               **counts, model=reply.get('model'), parent_id=head_id)
+                for field, count in counts.items():
+                    totals[field] += count
+
+            # A new model_used takes over the usage of messages that don't name one
+            model = replies[0].get('model') if replies else None
+            moves_usage = model is not None and current is not None and current['model_used'] != model
+            if moves_usage:
+                self._roll_up_usage(cursor, 'm.conversation_id = ? AND m.model IS NULL', (conversation_id,), sign=-1)
+
             cursor.execute("""
-                SELECT id, role, content, timestamp, input_tokens, output_tokens
-                FROM messages
-                WHERE conversation_id = ?
-                ORDER BY timestamp ASC
-            """, (conversation_id,))
-            return [dict(row) for row in cursor.fetchall()]
+                UPDATE conversations
+                SET updated_at = ?,
+                    total_input_tokens = total_input_tokens + ?,
+                    total_output_tokens = total_output_tokens + ?,
+                    total_cache_creation_tokens = total_cache_creation_tokens + ?,
+                    total_cache_read_tokens = total_cache_read_tokens + ?,
+                    message_count = message_count + ?,
+                    model_used = COALESCE(?, model_used),
+                    head_id = ?
+                WHERE id = ?
+            """, (now, totals['input_tokens'], totals['output_tokens'],
+                  totals['cache_creation_tokens'], totals['cache_read_tokens'],
+                  1 + len(replies), model, head_id, conversation_id))
+            if moves_usage:
+                self._roll_up_usage(cursor, 'm.conversation_id = ? AND m.model IS NULL', (conversation_id,))
+            return conversation_id
+
+    def queue_turn(self, conversation_id: Optional[int], user_content: str, assistant_content: str,
+                   **kwargs) -> Future:
+        """Save a turn like save_turn(), returning a Future of the conversation ID.
+
+        With write_behind enabled the turn is group-committed by the background
+        writer; otherwise it is saved immediately and the Future is already done.
+        """
+        args = (conversation_id, user_content, assistant_content)
+        if self.write_behind:
+            return _get_writer(self._pool).submit(self.save_turn, *args, **kwargs)
+
+        future: Future = Future()
+        try:
+            future.set_result(self.save_turn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def flush_writes(self, timeout: Optional[float] = None):
+        """Wait until all queued writes for this database are committed."""
+        writer = _writers.get(os.path.abspath(self.db_path))
+        if writer is not None:
+            writer.flush(timeout)
+
+    def get_messages(self, conversation_id: int, limit: Optional[int] = None,
+                     before_id: Optional[int] = None, after_id: Optional[int] = None,
+                     head_id: Optional[int] = None) -> list[dict[str, Any]]:
+        """Get the messages of a conversation's current branch, oldest first.
+
+        The branch is the path from its head back to the first message, or
+        the path ending at head_id when given. Each message has its
+        parent_id. With limit, only the newest `limit` messages are returned.
+        before_id and after_id keep messages older / newer than the message
+        with that ID on the path, so passing the oldest returned ID back as
+        before_id pages further back. The path is walked from its newest
+        message by primary key, so a window's cost depends on the window
+        size, not the conversation length or its number of branches.
+        Archived conversations are read from the archive.
+        """
+        schema = self._locate(conversation_id)
+        if schema is None:
+            return []
+        if before_id is not None:
+            start, start_params = BRANCH_BEFORE.format(schema=schema), [before_id]
+        elif head_id is not None:
+            start, start_params = BRANCH_AT, [head_id]
+        else:
+            start, start_params = BRANCH_HEAD.format(schema=schema), [conversation_id]
+        params = [*start_params, conversation_id, after_id, after_id, -1 if limit is None else limit]
 
+        with self._tier_connection(schema == 'archive') as conn:
+            rows = conn.execute(BRANCH_PATH.format(schema=schema, start=start) + f"""
+                SELECT b.id, path.parent_id, b.role, b.content, b.timestamp, b.input_tokens, b.output_tokens,
+                       b.cache_creation_tokens, b.cache_read_tokens, b.model
+                FROM path JOIN {schema}.message_bodies b ON b.id = path.id
+                ORDER BY path.depth DESC
+            """, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_messages(self, conversation_id: int, batch_size: int = 500,
+                      head_id: Optional[int] = None) -> Iterator[dict[str, Any]]:
+        """Yield the messages of a conversation's current branch in order, reading batch_size bodies at a time.
+
+        The branch's message IDs are walked once (head_id picks another
+        branch, as in get_messages()); bodies are then read in batches, each
+        a separate query, so no connection is held while the caller consumes
+        rows and memory for bodies stays bounded by the batch size.
+        """
+        schema = self._locate(conversation_id)
+        if schema is None:
+            return
+        if head_id is None:
+            start, start_params = BRANCH_HEAD.format(schema=schema), [conversation_id]
+        else:
+            start, start_params = BRANCH_AT, [head_id]
+        with self._tier_connection(schema == 'archive') as conn:
+            path = conn.execute(BRANCH_PATH.format(schema=schema, start=start) + """
+                SELECT id, parent_id FROM path ORDER BY depth DESC
+            """, [*start_params, conversation_id, None, None, -1]).fetchall()
+
+        batch_size = min(batch_size, MAX_QUERY_PARAMS)
+        for i in range(0, len(path), batch_size):
+            batch = path[i:i + batch_size]
+            with self._tier_connection(schema == 'archive') as conn:
+                rows = conn.execute(f"""
+                    SELECT id, role, content, timestamp, input_tokens, output_tokens,
+                           cache_creation_tokens, cache_read_tokens, model
+                    FROM {schema}.message_bodies
+                    WHERE id IN ({', '.join('?' * len(batch))})
+                """, [row['id'] for row in batch]).fetchall()
+            bodies = {row['id']: row for row in rows}
+            for message_id, parent_id in batch:
+                body = bodies[message_id]
+                yield {'id': message_id, 'parent_id': parent_id, **{key: body[key] for key in body.keys()[1:]}}
+
+    @_serialized
+    @_invalidates
     def update_conversation_model(self, conversation_id: int, model: str):
-        """Update the model used for a conversation."""
-        with sqlite3.connect(self.db_path) as conn:
+        """Update the model used for a conversation.
+
+        Usage of its messages that don't name a model moves to the new model
+        in the rollups.
+        """
+        with self._connection() as conn:
             cursor = conn.cursor()
+            self._roll_up_usage(cursor, 'm.conversation_id = ? AND m.model IS NULL', (conversation_id,), sign=-1)
             cursor.execute("""
                 UPDATE conversations
                 SET model_used = ?
                 WHERE id = ?
             """, (model, conversation_id))
-            conn.commit()
+            self._roll_up_usage(cursor, 'm.conversation_id = ? AND m.model IS NULL', (conversation_id,))
+
+    # ==================== Branches ====================
+
+    @_serialized
+    @_invalidates
+    def switch_branch(self, conversation_id: int, message_id: Optional[int]):
+        """Make the branch ending at message_id current; the next message saved continues it.
+
+        message_id can be any message of the conversation: saving after an
+        earlier one forks a new branch there. None forks at the start, so
+        the next message begins a branch of its own. Archived conversations
+        must be restored first.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            if message_id is not None:
+                cursor.execute('SELECT 1 FROM messages WHERE id = ? AND conversation_id = ?',
+                               (message_id, conversation_id))
+                if cursor.fetchone() is None:
+                    raise ValueError(f'Message {message_id} is not in conversation {conversation_id}')
+            cursor.execute('UPDATE conversations SET head_id = ? WHERE id = ?', (message_id, conversation_id))
+
+    @_cached_read
+    def list_branches(self, conversation_id: int) -> list[dict[str, Any]]:
+        """List a conversation's branches, oldest first.
+
+        Each has its head_id (last message), message_count, start_id (the
+        first message it doesn't share with an earlier branch), its start's
+        preview text, updated_at (time of its last message) and whether it
+        is the active branch. Reads the whole tree, one index lookup per
+        message.
+        """
+        schema = self._locate(conversation_id)
+        if schema is None:
+            return []
+        with self._tier_connection(schema == 'archive') as conn:
+            head = conn.execute(f'SELECT head_id FROM {schema}.conversations WHERE id = ?',
+                                (conversation_id,)).fetchone()
+            rows = conn.execute(f"""
+                WITH RECURSIVE tree(id, start_id, depth) AS (
+                    SELECT id, id, 1 FROM {schema}.messages
+                    WHERE conversation_id = ? AND parent_id IS NULL
+                    UNION ALL
+                    SELECT m.id,
+                           CASE WHEN EXISTS (
+                               SELECT 1 FROM {schema}.messages s
+                               WHERE s.conversation_id = ? AND s.parent_id = m.parent_id AND s.id < m.id
+                           ) THEN m.id ELSE tree.start_id END,
+                           tree.depth + 1
+                    FROM {schema}.messages m JOIN tree ON m.parent_id = tree.id
+                    WHERE m.conversation_id = ?
+                )
+                SELECT tree.id AS head_id, tree.depth AS message_count, tree.start_id,
+                       leaf.timestamp AS updated_at, substr(start.content, 1, 200) AS preview
+                FROM tree
+                JOIN {schema}.messages leaf ON leaf.id = tree.id
+                JOIN {schema}.message_bodies start ON start.id = tree.start_id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {schema}.messages c WHERE c.conversation_id = ? AND c.parent_id = tree.id
+                )
+                ORDER BY tree.id
+            """, (conversation_id,) * 4).fetchall()
+        head_id = head['head_id'] if head else None
+        return [{**dict(row), 'active': row['head_id'] == head_id} for row in rows]
+
+    # ==================== Generations ====================
+
+    @_serialized
+    def create_generation(self, conversation_id: int, prompt: str, model: Optional[str], owner: str) -> int:
+        """Record a reply to prompt that `owner` has started generating; returns its ID."""
+        with self._connection() as conn:
+            now = datetime.now().isoformat()
+            return conn.execute("""
+                INSERT INTO generations (conversation_id, prompt, model, status, owner, started_at, updated_at)
+                VALUES (?, ?, ?, 'running', ?, ?, ?)
+            """, (conversation_id, prompt, model, owner, now, now)).lastrowid
+
+    @_serialized
+    def checkpoint_generation(self, generation_id: int, content: str, owner: str) -> bool:
+        """Store the text generated so far, and show that owner is still at it.
+
+        Returns False if the generation is gone or another process has taken
+        it over. Generations are never memoized, so checkpoints leave cached
+        reads alone, in this process and every other.
+        """
+        with self._connection() as conn:
+            return conn.execute('UPDATE generations SET content = ?, updated_at = ? WHERE id = ? AND owner = ?',
+                                (content, datetime.now().isoformat(), generation_id, owner)).rowcount > 0
+
+    @_serialized
+    def fail_generation(self, generation_id: int, content: str, error: str, owner: str):
+        """Keep the text of a generation that stopped with an error, for resuming or keeping.
+
+        Does nothing if another process has taken the generation over.
+        """
+        with self._connection() as conn:
+            conn.execute("""
+                UPDATE generations SET content = ?, status = 'error', error = ?, updated_at = ?
+                WHERE id = ? AND owner = ?
+            """, (content, error, datetime.now().isoformat(), generation_id, owner))
+
+    @_serialized
+    def claim_generation(self, generation_id: int, owner: str, stale_before: str) -> Optional[dict[str, Any]]:
+        """Take over a failed generation, or one not checkpointed since stale_before, to resume it.
+
+        A process checkpoints each of its generations at a steady interval,
+        queued or waiting on the model alike, so one that missed them up to
+        stale_before belongs to a process that has stopped. Returns the
+        generation, or None if it is gone or still running elsewhere, so
+        only one process resumes it.
+        """
+        with self._connection() as conn:
+            claimed = conn.execute("""
+                UPDATE generations SET status = 'running', error = NULL, owner = ?, updated_at = ?
+                WHERE id = ? AND (status = 'error' OR updated_at < ?)
+            """, (owner, datetime.now().isoformat(), generation_id, stale_before)).rowcount
+            return self.get_generation(generation_id) if claimed else None
+
+    @_serialized
+    @_invalidates
+    def finish_generation(self, generation_id: int, content: str,
+                          input_tokens: int = 0, output_tokens: int = 0,
+                          cache_creation_tokens: int = 0, cache_read_tokens: int = 0,
+                          model: Optional[str] = None, owner: Optional[str] = None) -> int:
+        """Save a generation's prompt and its reply as a turn and drop the generation, in one transaction.
+
+        Returns the conversation ID. Raises ValueError if the generation is
+        gone (discarded, or its conversation deleted), or if owner is given
+        and another process has taken it over.
+        """
+        with self._connection() as conn:
+            row = conn.execute('SELECT conversation_id, prompt, owner FROM generations WHERE id = ?',
+                               (generation_id,)).fetchone()
+            if row is None:
+                raise ValueError(f'Generation {generation_id} no longer exists')
+            if owner is not None and row['owner'] != owner:
+                raise ValueError(f'Generation {generation_id} was taken over by another process')
+            conn.execute('DELETE FROM generations WHERE id = ?', (generation_id,))
+            return self.save_turn(row['conversation_id'], row['prompt'], content, input_tokens, output_tokens,
+                                  cache_creation_tokens, cache_read_tokens, model=model)
+
+    @_serialized
+    def discard_generation(self, generation_id: int):
+        """Drop a generation without saving anything."""
+        with self._connection() as conn:
+            conn.execute('DELETE FROM generations WHERE id = ?', (generation_id,))
+
+    def get_generation(self, generation_id: int) -> Optional[dict[str, Any]]:
+        """Get one generation with its latest checkpoint, or None once it is saved or discarded."""
+        with self._connection() as conn:
+            row = conn.execute("""
+                SELECT id, conversation_id, prompt, model, content, status, error, owner, started_at, updated_at
+                FROM generations
+                WHERE id = ?
+            """, (generation_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_generations(self, conversation_id: int) -> list[dict[str, Any]]:
+        """Get a conversation's unsaved generations, oldest first. Not memoized: they change every checkpoint."""
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT id, conversation_id, prompt, model, content, status, error, owner, started_at, updated_at
+                FROM generations
+                WHERE conversation_id = ?
+                ORDER BY id
+            """, (conversation_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    # ==================== Summaries ====================
+
+    @_serialized
+    @_invalidates
+    def save_summary(self, conversation_id: int, last_message_id: int, summary: str):
+        """Store a summary covering the branch of a conversation up to and including last_message_id."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(BRANCH_PATH.format(schema='main', start=BRANCH_AT) + """
+                INSERT INTO conversation_summaries
+                    (conversation_id, last_message_id, message_count, summary, created_at)
+                SELECT ?, ?, COUNT(*), ?, ?
+                FROM path
+            """, (last_message_id, conversation_id, None, None, -1,
+                  conversation_id, last_message_id, summary, datetime.now().isoformat()))
+
+    @_cached_read
+    def get_latest_summary(self, conversation_id: int) -> Optional[dict[str, Any]]:
+        """Get the latest summary of a conversation's current branch.
+
+        That is the summary ending at the newest message of the branch that
+        has one; summaries of other branches after a fork don't apply. The
+        branch is walked back from its head only as far as that message.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT 1 FROM conversation_summaries
+                WHERE conversation_id = ? AND last_message_id IS NOT NULL
+                LIMIT 1
+            """, (conversation_id,))
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("""
+                WITH RECURSIVE path(id, parent_id, depth) AS (
+                    SELECT id, parent_id, 0 FROM messages
+                    WHERE id = (SELECT head_id FROM conversations WHERE id = ?)
+                    UNION ALL
+                    SELECT m.id, m.parent_id, path.depth + 1
+                    FROM messages m JOIN path ON m.id = path.parent_id
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM conversation_summaries
+                        WHERE conversation_id = ? AND last_message_id = path.id
+                    )
+                )
+                SELECT s.last_message_id, s.message_count, s.summary, s.created_at
+                FROM path JOIN conversation_summaries s ON s.last_message_id = path.id
+                WHERE s.conversation_id = ?
+                ORDER BY path.depth, s.id DESC
+                LIMIT 1
+            """, (conversation_id, conversation_id, conversation_id))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    # ==================== Search ====================
+
+    @staticmethod
+    def _fts_query(text: str) -> str:
+        """Turn free text into an FTS5 query: every word must match, the last as a prefix."""
+        terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+        if terms:
+            terms[-1] += '*'
+        return ' '.join(terms)
+
+    @_cached_read
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> list[dict[str, Any]]:
+        """Full-text search over message content and conversation titles.
+
+        Returns the best matches first. Each hit has the conversation_id and
+        title, the matching message_id and role (None for title matches) and a
+        snippet with the matched terms in **bold**.
+        """
+        fts_query = self._fts_query(query)
+        if not fts_query:
+            return []
+
+        # Each side is ranked and cut to limit + offset inside FTS5 before the
+        # joins, so only the final hits are ever looked up or snippeted.
+        window = limit + offset
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT conversation_id, title, message_id, role, snippet, rank FROM (
+                    SELECT m.conversation_id, c.title, m.id AS message_id, m.role,
+                           hits.snippet, hits.rank
+                    FROM (
+                        SELECT rowid, rank,
+                               snippet(messages_fts, 0, '**', '**', '…', 16) AS snippet
+                        FROM messages_fts
+                        WHERE messages_fts MATCH ?
+                        ORDER BY rank
+                        LIMIT ?
+                    ) AS hits
+                    JOIN messages m ON m.id = hits.rowid
+                    JOIN conversations c ON c.id = m.conversation_id
+                    UNION ALL
+                    SELECT c.id, c.title, NULL, NULL, hits.snippet, hits.rank
+                    FROM (
+                        SELECT rowid, rank,
+                               snippet(conversations_fts, 0, '**', '**', '…', 16) AS snippet
+                        FROM conversations_fts
+                        WHERE conversations_fts MATCH ?
+                        ORDER BY rank
+                        LIMIT ?
+                    ) AS hits
+                    JOIN conversations c ON c.id = hits.rowid
+                )
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            """, (fts_query, window, fts_query, window, limit, offset))
+            return [dict(row) for row in cursor.fetchall()]
+
+    # ==================== Message Vectors ====================
+
+    def _embed_messages(self, cursor, where: str, params: tuple = ()) -> int:
+        """Store vectors for the messages matching `where` that don't have one yet."""
+        if self.embedder is None:
+            return 0
+        cursor.execute(f"""
+            SELECT id, conversation_id, content FROM message_bodies
+            WHERE {where} AND NOT EXISTS (SELECT 1 FROM message_vectors v WHERE v.message_id = message_bodies.id)
+        """, params)
+        rows = [(row['id'], row['conversation_id'], self.embedder(row['content'])) for row in cursor.fetchall()]
+        cursor.executemany("""
+            INSERT INTO message_vectors (message_id, conversation_id, vector) VALUES (?, ?, ?)
+        """, rows)
+        return len(rows)
+
+    def index_message_vectors(self, batch_size: int = 500) -> int:
+        """Embed every stored message that has no vector yet; returns how many.
+
+        Walks messages in id order, batch_size per transaction, so it can run
+        alongside the app. Needs an embedder.
+        """
+        if self.embedder is None:
+            raise ValueError('index_message_vectors() needs a ConversationStorage with an embedder')
+        indexed = 0
+        last_id = 0
+        while True:
+            with self._connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                cursor = conn.cursor()
+                cursor.execute('SELECT id FROM messages WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?',
+                               (last_id, batch_size - 1))
+                row = cursor.fetchone()
+                end = row['id'] if row else None
+                if end is None:
+                    indexed += self._embed_messages(cursor, 'id > ?', (last_id,))
+                    return indexed
+                indexed += self._embed_messages(cursor, 'id > ? AND id <= ?', (last_id, end))
+            last_id = end
+
+    def get_message_vectors(self, after_id: int = 0, limit: int = 10_000) -> list[tuple[int, int, int, bytes]]:
+        """(id, message_id, conversation_id, vector) rows added after row id `after_id`, oldest first."""
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT id, message_id, conversation_id, vector
+                FROM message_vectors
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (after_id, limit)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def count_message_vectors(self, through_id: Optional[int] = None) -> int:
+        """Number of stored message vectors, or of those with row id up to through_id."""
+        with self._connection() as conn:
+            if through_id is None:
+                return conn.execute('SELECT COUNT(*) FROM message_vectors').fetchone()[0]
+            return conn.execute('SELECT COUNT(*) FROM message_vectors WHERE id <= ?', (through_id,)).fetchone()[0]
+
+    # ==================== Response Cache ====================
+
+    def _cache_counters(self) -> dict[str, int]:
+        return _response_cache_counters.setdefault(os.path.abspath(self.db_path), {'hits': 0, 'misses': 0})
+
+    def get_cached_response(self, key: str, max_age_days: Optional[float] = None) -> Optional[dict[str, Any]]:
+        """Look up a cached reply and mark it as recently used."""
+        now = datetime.now()
+        oldest = (now - timedelta(days=max_age_days)).isoformat() if max_age_days is not None else ''
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT key, model, response, input_tokens, output_tokens, created_at, hits
+                FROM response_cache
+                WHERE key = ? AND created_at >= ?
+            """, (key, oldest))
+            row = cursor.fetchone()
+        if row is None:
+            self._cache_counters()['misses'] += 1
+            return None
+        self._touch_cached_response(key, now.isoformat())
+        self._cache_counters()['hits'] += 1
+        return dict(row)
+
+    @_serialized
+    def _touch_cached_response(self, key: str, now: str):
+        with self._connection() as conn:
+            conn.execute('UPDATE response_cache SET last_used_at = ?, hits = hits + 1 WHERE key = ?', (now, key))
+
+    @_serialized
+    def put_cached_response(self, key: str, model: Optional[str], response: str,
+                            input_tokens: int = 0, output_tokens: int = 0,
+                            max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                            max_age_days: Optional[float] = None):
+        """Cache a reply, then evict expired and least recently used entries over the limits."""
+        now = datetime.now()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO response_cache
+                    (key, model, response, input_tokens, output_tokens, size_bytes, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (key, model, response, input_tokens, output_tokens,
+                  len(response.encode('utf-8')), now.isoformat(), now.isoformat()))
+
+            if max_age_days is not None:
+                cursor.execute(
+                    'DELETE FROM response_cache WHERE created_at < ?',
+                    ((now - timedelta(days=max_age_days)).isoformat(),)
+                )
+
+            if max_entries is None and max_bytes is None:
+                return
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM response_cache')
+            entries, total_bytes = cursor.fetchone()
+            if (max_entries is None or entries <= max_entries) and (max_bytes is None or total_bytes <= max_bytes):
+                return
+
+            # Walk from least to most recently used until both limits hold
+            cursor.execute('SELECT key, size_bytes FROM response_cache ORDER BY last_used_at ASC')
+            evict = []
+            for row in cursor.fetchall():
+                if (max_entries is None or entries <= max_entries) and (max_bytes is None or total_bytes <= max_bytes):
+                    break
+                evict.append((row['key'],))
+                entries -= 1
+                total_bytes -= row['size_bytes']
+            cursor.executemany('DELETE FROM response_cache WHERE key = ?', evict)
+
+    def response_cache_stats(self) -> dict[str, int]:
+        """Hits and misses since process start, plus current entry count and size."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM response_cache')
+            entries, total_bytes = cursor.fetchone()
+        return {**self._cache_counters(), 'entries': entries, 'bytes': total_bytes}
+
+    @_serialized
+    def clear_response_cache(self):
+        """Delete every cached reply."""
+        with self._connection() as conn:
+            conn.execute('DELETE FROM response_cache')
+
+    # ==================== Turn Metrics ====================
+
+    def record_turn_metrics(self, metrics: dict[str, Any], max_rows: Optional[int] = None) -> Future:
+        """Queue one turn's timings (TURN_METRIC_FIELDS) for the background writer.
+
+        Metrics are always written off the request path, whatever
+        write_behind says. Rows beyond the newest max_rows are pruned.
+        """
+        return _get_writer(self._pool).submit(self._insert_turn_metrics, metrics, max_rows)
+
+    def record_render_stats(self, generation_id: int, render_stats: dict[str, Any]) -> Future:
+        """Queue the render timing (StreamRenderer.stats()) of a background reply for its turn_metrics row.
+
+        The row must have been queued first by this process, as its worker
+        does before the reply ends; otherwise nothing is updated.
+        """
+        return _get_writer(self._pool).submit(self._update_render_stats, generation_id, render_stats)
+
+    def _update_render_stats(self, generation_id: int, render_stats: dict[str, Any]):
+        with self._connection() as conn:
+            conn.execute('UPDATE turn_metrics SET render_seconds = ?, renders = ? WHERE generation_id = ?',
+                         (render_stats['render_seconds'], render_stats['renders'], generation_id))
+
+    def _insert_turn_metrics(self, metrics: dict[str, Any], max_rows: Optional[int]):
+        values = [metrics.get(field) for field in TURN_METRIC_FIELDS]
+        if isinstance(metrics.get('storage_calls'), dict):
+            values[TURN_METRIC_FIELDS.index('storage_calls')] = json.dumps(metrics['storage_calls'])
+        with self._connection() as conn:
+            conn.execute(f"""
+                INSERT INTO turn_metrics (created_at, {', '.join(TURN_METRIC_FIELDS)})
+                VALUES (?{', ?' * len(TURN_METRIC_FIELDS)})
+            """, (datetime.now().isoformat(), *values))
+            if max_rows is not None:
+                conn.execute(
+                    'DELETE FROM turn_metrics WHERE id <= (SELECT MAX(id) FROM turn_metrics) - ?',
+                    (max_rows,)
+                )
+
+    @_cached_read
+    def turn_metrics_summary(self, window: int = 100) -> list[dict[str, Any]]:
+        """Rolling p50/p95 timings per model over each model's last `window` turns.
+
+        Response-cache replays are left out: they say nothing about the model.
+        """
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT model, ttft_seconds, total_seconds, tokens_per_sec,
+                       render_seconds, db_write_seconds
+                FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY model ORDER BY id DESC) AS recency
+                    FROM turn_metrics
+                    WHERE source != 'cache'
+                )
+                WHERE recency <= ?
+                ORDER BY model
+            """, (window,)).fetchall()
+
+        by_model: dict[Optional[str], list] = {}
+        for row in rows:
+            by_model.setdefault(row['model'], []).append(row)
+
+        summary = []
+        for model, turns in by_model.items():
+            entry: dict[str, Any] = {'model': model, 'turns': len(turns)}
+            for column in ('ttft_seconds', 'total_seconds', 'tokens_per_sec',
+                           'render_seconds', 'db_write_seconds'):
+                values = [turn[column] for turn in turns if turn[column] is not None]
+                name = column.replace('_seconds', '')
+                entry[f'{name}_p50'] = _percentile(values, 50)
+                entry[f'{name}_p95'] = _percentile(values, 95)
+            summary.append(entry)
+        return summary
+
+    # ==================== Usage Rollups ====================
+
+    def _usage_cost(self, model: str, counts) -> float:
+        """Estimated USD cost of token counts (in TOKEN_FIELDS order) on model."""
+        prices = self.pricing.get(model)
+        if not prices:
+            return 0.0
+        return sum(count * price for count, price in zip(counts, prices)) / 1_000_000
+
+    def _add_usage(self, cursor, day: str, model: str, messages: int, counts):
+        """Add (or with negative values, take away) usage in one usage_daily row."""
+        cursor.execute("""
+            INSERT INTO usage_daily (day, model, messages, input_tokens, output_tokens,
+                                     cache_creation_tokens, cache_read_tokens, cost)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (day, model) DO UPDATE SET
+                messages = messages + excluded.messages,
+                input_tokens = input_tokens + excluded.input_tokens,
+                output_tokens = output_tokens + excluded.output_tokens,
+                cache_creation_tokens = cache_creation_tokens + excluded.cache_creation_tokens,
+                cache_read_tokens = cache_read_tokens + excluded.cache_read_tokens,
+                cost = cost + excluded.cost
+        """, (day, model, messages, *counts, self._usage_cost(model, counts)))
+
+    def _roll_up_usage(self, cursor, where: str = '1', params: tuple = (), sign: int = 1, schema: str = 'main'):
+        """Add the usage of the messages matching `where` (alias m) to the rollups.
+
+        A message without its own model counts towards its conversation's
+        model_used. sign=-1 takes the usage away again, dropping rows left
+        empty.
+        """
+        cursor.execute(f"""
+            SELECT substr(m.timestamp, 1, 10) AS day, COALESCE(m.model, c.model_used, '') AS model,
+                   COUNT(*) AS messages, SUM(m.input_tokens), SUM(m.output_tokens),
+                   SUM(m.cache_creation_tokens), SUM(m.cache_read_tokens)
+            FROM {schema}.messages m
+            JOIN {schema}.conversations c ON c.id = m.conversation_id
+            WHERE ({where})
+              AND (m.input_tokens != 0 OR m.output_tokens != 0
+                   OR m.cache_creation_tokens != 0 OR m.cache_read_tokens != 0)
+            GROUP BY day, model
+        """, params)
+        for row in cursor.fetchall():
+            self._add_usage(cursor, row[0], row[1], sign * row[2], [sign * count for count in row[3:]])
+        if sign < 0:
+            cursor.execute('DELETE FROM usage_daily WHERE messages <= 0')
+
+    @_invalidates
+    def rebuild_usage_rollups(self):
+        """Recompute usage_daily from every stored message, hot and archived.
+
+        Needed only after changing pricing, to re-cost past usage. Usage of
+        deleted conversations is kept by the running rollups but lost here.
+        """
+        with self._archive_connection() as archive, self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM usage_daily')
+            for schema in ('main', 'archive') if archive is not None else ('main',):
+                self._roll_up_usage(cursor, schema=schema)
+
+    @_cached_read
+    def usage_by_day(self, days: Optional[int] = 30, model: Optional[str] = None) -> list[dict[str, Any]]:
+        """Daily token and cost rollups per model, oldest day first.
+
+        Covers the last `days` days including today (all of them for None),
+        optionally for one model. Messages without a model are under ''.
+        """
+        since = '' if days is None else (datetime.now() - timedelta(days=days - 1)).date().isoformat()
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT day, model, messages, input_tokens, output_tokens,
+                       cache_creation_tokens, cache_read_tokens, cost
+                FROM usage_daily
+                WHERE day >= ? AND (? IS NULL OR model = ?)
+                ORDER BY day, model
+            """, (since, model, model)).fetchall()
+        return [dict(row) for row in rows]
+
+    @_cached_read
+    def usage_totals(self, days: Optional[int] = 30, group_by: str = 'model') -> list[dict[str, Any]]:
+        """Token and cost totals over the last `days` days, grouped by 'model' or 'day'.
+
+        Models are ordered by cost, highest first; days oldest first.
+        """
+        if group_by not in ('model', 'day'):
+            raise ValueError(f"group_by must be 'model' or 'day', not {group_by!r}")
+        order = 'cost DESC, model' if group_by == 'model' else 'day'
+        since = '' if days is None else (datetime.now() - timedelta(days=days - 1)).date().isoformat()
+        with self._connection() as conn:
+            rows = conn.execute(f"""
+                SELECT {group_by}, SUM(messages) AS messages, SUM(input_tokens) AS input_tokens,
+                       SUM(output_tokens) AS output_tokens, SUM(cache_creation_tokens) AS cache_creation_tokens,
+                       SUM(cache_read_tokens) AS cache_read_tokens, SUM(cost) AS cost
+                FROM usage_daily
+                WHERE day >= ?
+                GROUP BY {group_by}
+                ORDER BY {order}
+            """, (since,)).fetchall()
+        return [dict(row) for row in rows]
 
     # ==================== Settings Management ====================
 
+    @_serialized
     def save_setting(self, key: str, value: Any):
         """Save a setting (converts value to JSON)."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._pool.published(), self._connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT OR REPLACE INTO settings (key, value)
                 VALUES (?, ?)
             """, (key, json.dumps(value)))
-            conn.commit()
+        settings = self._read_cache.settings
+        if settings is not None:
+            settings[key] = json.loads(json.dumps(value))
+
+    def get_all_settings(self) -> dict[str, Any]:
+        """Get every setting, loading them all in one query on first use."""
+        cache = self._read_cache
+        cache.sync()
+        settings = cache.settings
+        if settings is None:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT key, value FROM settings')
+                settings = cache.settings = {row['key']: json.loads(row['value']) for row in cursor.fetchall()}
+        return _clone(settings)
 
     def get_setting(self, key: str, default: Any = None) -> Any:
         """Get a setting (converts from JSON)."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-            row = cursor.fetchone()
-            if row:
-                return json.loads(row[0])
-            return default
+        self._read_cache.sync()
+        settings = self._read_cache.settings
+        if settings is None:
+            settings = self.get_all_settings()
+        return _clone(settings[key]) if key in settings else default
 
+    @_serialized
     def delete_setting(self, key: str):
         """Delete a setting."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._pool.published(), self._connection() as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM settings WHERE key = ?', (key,))
-            conn.commit()
+        settings = self._read_cache.settings
+        if settings is not None:
+            settings.pop(key, None)
+
+    # ==================== Maintenance ====================
+
+    @_invalidates
+    def rewrite_message_bodies(self, batch_size: int = 1000) -> dict[str, int]:
+        """Move inline message bodies into message_blobs and recompress blobs to this codec.
+
+        For databases written before blob storage, or after changing codec.
+        Rows are rewritten batch_size at a time, one short transaction each,
+        so the app can keep running; the file only shrinks after vacuum().
+        Returns how many messages were moved, how many blobs that added
+        (fewer when bodies repeat) and how many blobs were recompressed.
+        """
+        counts = {'messages': 0, 'blobs': 0, 'recompressed': 0}
+        with self._connection() as conn:
+            blobs_before = conn.execute('SELECT COUNT(*) FROM message_blobs').fetchone()[0]
+
+        last_id = 0
+        while True:
+            with self._connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                cursor = conn.cursor()
+                rows = cursor.execute("""
+                    SELECT id, content FROM messages
+                    WHERE id > ? AND blob_id IS NULL
+                    ORDER BY id
+                    LIMIT ?
+                """, (last_id, batch_size)).fetchall()
+                for row in rows:
+                    content, blob_id = self._store_body(cursor, row['content'])
+                    if blob_id is not None:
+                        cursor.execute('UPDATE messages SET content = ?, blob_id = ? WHERE id = ?',
+                                       (content, blob_id, row['id']))
+                        counts['messages'] += 1
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1]['id']
+
+        with self._connection() as conn:
+            counts['blobs'] = conn.execute('SELECT COUNT(*) FROM message_blobs').fetchone()[0] - blobs_before
+
+        last_id = 0
+        while True:
+            with self._connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                cursor = conn.cursor()
+                rows = cursor.execute("""
+                    SELECT id, codec, data FROM message_blobs
+                    WHERE id > ? AND codec NOT IN ('raw', ?)
+                    ORDER BY id
+                    LIMIT ?
+                """, (last_id, self.codec, batch_size)).fetchall()
+                for row in rows:
+                    data = _unpack_body(row['codec'], row['data']).encode('utf-8')
+                    codec, packed = _pack_body(data, self.codec)
+                    if codec != row['codec']:
+                        cursor.execute('UPDATE message_blobs SET codec = ?, data = ? WHERE id = ?',
+                                       (codec, packed, row['id']))
+                        counts['recompressed'] += 1
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1]['id']
+        return counts
+
+    def vacuum(self):
+        """Rebuild the database file, returning free pages to the filesystem.
+
+        Takes an exclusive lock for the length of a full copy of the
+        database, so run it while the app is idle. A database created before
+        auto_vacuum=incremental only switches to it here, and until it does,
+        archiving can't shrink the file.
+        """
+        with self._connection() as conn:
+            conn.execute('PRAGMA main.auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+
+    # ==================== Archive ====================
+
+    @contextmanager
+    def _archive_connection(self, create: bool = False):
+        """Borrow a connection with the archive attached as schema 'archive'.
+
+        Yields None if there is no archive file yet, unless create is set.
+        ATTACH can't run inside a transaction, so the first use on a pooled
+        connection must not be nested in another _connection() block.
+        """
+        with self._connection() as conn:
+            if not any(row['name'] == 'archive' for row in conn.execute('PRAGMA database_list')):
+                if not create and not os.path.exists(self.archive_path):
+                    yield None
+                    return
+                conn.execute('ATTACH DATABASE ? AS archive', (self.archive_path,))
+                conn.execute('PRAGMA archive.auto_vacuum = INCREMENTAL')
+                conn.execute('PRAGMA archive.journal_mode = WAL')
+                for statement in ARCHIVE_DB_SCHEMA + MESSAGE_BLOB_SCHEMA:
+                    conn.execute(statement.format(schema='archive'))
+                self._upgrade_archive(conn)
+            yield conn
+
+    def _upgrade_archive(self, conn):
+        """Add ARCHIVE_ADDED_COLUMNS to an archive written by an earlier release.
+
+        Its conversations become single branches, as the hot ones did in
+        version 7. Commits, so callers can begin their own transaction.
+        """
+        cursor = conn.cursor()
+        added = {column for table, column, definition in ARCHIVE_ADDED_COLUMNS
+                 if self._add_column_if_missing(cursor, table, column, definition, schema='archive')}
+        conn.execute(MESSAGE_TREE_INDEX.format(schema='archive'))
+        if 'parent_id' in added:
+            conn.execute('UPDATE archive.messages SET ' + MESSAGE_PARENT_BACKFILL.format(schema='archive'))
+        if 'head_id' in added:
+            conn.execute('UPDATE archive.conversations SET ' + CONVERSATION_HEAD_BACKFILL.format(schema='archive'))
+        conn.commit()
+
+    def _tier_connection(self, archived: bool):
+        """_archive_connection() for archived reads, a plain connection otherwise."""
+        return self._archive_connection() if archived else self._connection()
+
+    def _locate(self, conversation_id: int) -> Optional[str]:
+        """Schema holding a conversation: 'main', 'archive', or None if it doesn't exist."""
+        with self._connection() as conn:
+            if conn.execute('SELECT 1 FROM conversations WHERE id = ?', (conversation_id,)).fetchone():
+                return 'main'
+        with self._archive_connection() as conn:
+            if conn is not None and conn.execute('SELECT 1 FROM archive.conversations WHERE id = ?',
+                                                 (conversation_id,)).fetchone():
+                return 'archive'
+        return None
+
+    @staticmethod
+    def _move_conversations(conn, ids: list[int], source: str, target: str) -> list[int]:
+        """Move conversations with their messages, blobs and summaries from one schema to another.
+
+        Expects the caller to have begun a transaction. Blobs are matched by
+        hash, so a body already stored on the other side is shared rather
+        than copied. Returns the IDs that were actually found in source.
+
+        A commit spanning two WAL databases isn't atomic, so the copy commits
+        before the source rows are deleted: an interruption leaves at worst
+        a stale copy in target, which the next move replaces.
+        """
+        marks = ','.join('?' * len(ids))
+        ids = [row['id'] for row in conn.execute(
+            f'SELECT id FROM {source}.conversations WHERE id IN ({marks})', ids)]
+        if not ids:
+            return ids
+        marks = ','.join('?' * len(ids))
+        conversation_columns = ', '.join(CONVERSATION_COLUMNS)
+        message_columns = ', '.join(MESSAGE_COLUMNS)
+        summary_columns = ', '.join(SUMMARY_COLUMNS)
+
+        conn.execute(f'DELETE FROM {target}.conversations WHERE id IN ({marks})', ids)
+        conn.execute(f"""
+            INSERT INTO {target}.conversations ({conversation_columns})
+            SELECT {conversation_columns} FROM {source}.conversations WHERE id IN ({marks})
+        """, ids)
+        conn.execute(f"""
+            INSERT INTO {target}.message_blobs (hash, codec, size, data)
+            SELECT hash, codec, size, data FROM {source}.message_blobs
+            WHERE id IN (SELECT blob_id FROM {source}.messages WHERE conversation_id IN ({marks}))
+            ON CONFLICT (hash) DO NOTHING
+        """, ids)
+        conn.execute(f"""
+            INSERT INTO {target}.messages ({message_columns}, blob_id)
+            SELECT {', '.join('m.' + column for column in MESSAGE_COLUMNS)}, t.id
+            FROM {source}.messages m
+            LEFT JOIN {source}.message_blobs b ON b.id = m.blob_id
+            LEFT JOIN {target}.message_blobs t ON t.hash = b.hash
+            WHERE m.conversation_id IN ({marks})
+        """, ids)
+        conn.execute(f"""
+            INSERT INTO {target}.conversation_summaries ({summary_columns})
+            SELECT {summary_columns} FROM {source}.conversation_summaries WHERE conversation_id IN ({marks})
+        """, ids)
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(f'DELETE FROM {source}.conversations WHERE id IN ({marks})', ids)
+        return ids
+
+    @_serialized_alone
+    @_invalidates
+    def archive_conversations(self, older_than_days: float, exclude=(), batch_size: int = 100) -> int:
+        """Move conversations not updated for older_than_days into the archive.
+
+        Conversations in exclude (e.g. the one open in the UI) and those
+        with a reply still being generated stay hot. They move batch_size
+        per transaction, and the freed pages are then returned to the
+        filesystem (with auto_vacuum=incremental). Turn metrics of archived
+        conversations lose their conversation link. Returns the number
+        archived.
+        """
+        self.flush_writes()
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        excluded = json.dumps(list(exclude))
+        archived = 0
+        while True:
+            with self._archive_connection(create=True) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                ids = [row['id'] for row in conn.execute("""
+                    SELECT id FROM main.conversations
+                    WHERE updated_at < ? AND id NOT IN (SELECT value FROM json_each(?))
+                      AND id NOT IN (SELECT conversation_id FROM main.generations)
+                    ORDER BY updated_at, id
+                    LIMIT ?
+                """, (cutoff, excluded, batch_size))]
+                if ids:
+                    archived += len(self._move_conversations(conn, ids, 'main', 'archive'))
+            if len(ids) < batch_size:
+                break
+
+        with self._connection() as conn:
+            # execute() stops after freeing one page; executescript() runs it to the end
+            conn.executescript('PRAGMA main.incremental_vacuum;')
+        return archived
+
+    def restore_conversation(self, conversation_id: int) -> bool:
+        """Move an archived conversation back to the hot tables.
+
+        Returns False if it isn't archived (already hot, or unknown). Called
+        before every turn, so cached reads are only dropped when rows moved.
+        """
+        if self._locate(conversation_id) != 'archive':
+            return False
+        return self._restore_conversation(conversation_id)
+
+    @_serialized_alone
+    def _restore_conversation(self, conversation_id: int) -> bool:
+        try:
+            with self._pool.published(), self._archive_connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                if not self._move_conversations(conn, [conversation_id], 'archive', 'main'):
+                    return False
+                # Vectors aren't archived; restored messages are embedded again
+                self._embed_messages(conn.cursor(), 'conversation_id = ?', (conversation_id,))
+                return True
+        finally:
+            # The move commits in steps, so even a failed one may have changed rows
+            self._read_cache.bump()
 
     # ==================== Export/Import ====================
 
-    def export_conversation_to_markdown(self, conversation_id: int) -> str:
-        """Export a conversation to markdown format."""
-        conversation = self.get_conversation(conversation_id)
-        if not conversation:
-            return ''
+    def export_all(self, stream, batch_size: int = 500) -> dict[str, int]:
+        """Write every conversation and its messages to a text stream as JSONL.
+
+        Conversations are read in id order batch_size at a time and messages
+        one conversation at a time, so memory stays flat for any database size.
+        Every branch is exported, parents before their children. Archived
+        conversations follow the hot ones. Use open_archive() for a gzip or
+        zstd compressed stream.
+        """
+        stream.write(json.dumps({'type': 'header', 'format': ARCHIVE_FORMAT, 'version': ARCHIVE_VERSION}) + '\n')
+        counts = {'conversations': 0, 'messages': 0}
+        for archived in (False, True):
+            last_id = 0
+            while True:
+                with self._tier_connection(archived) as conn:
+                    if conn is None:
+                        return counts
+                    conversations = conn.execute(f"""
+                        SELECT id, uuid, title, created_at, updated_at, model_used, head_id
+                        FROM {'archive' if archived else 'main'}.conversations
+                        WHERE id > ?
+                        ORDER BY id
+                        LIMIT ?
+                    """, (last_id, batch_size)).fetchall()
+                if not conversations:
+                    break
+
+                for conv in conversations:
+                    record = {'type': 'conversation'}
+                    record.update((field, conv[field]) for field in ARCHIVE_CONVERSATION_FIELDS)
+                    record['head_id'] = conv['head_id']
+                    stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    counts['conversations'] += 1
+
+                    for msg in self._iter_tree(conv['id'], archived):
+                        record = {'type': 'message', 'conversation_uuid': conv['uuid'],
+                                  'id': msg['id'], 'parent_id': msg['parent_id']}
+                        record.update((field, msg[field]) for field in ARCHIVE_MESSAGE_FIELDS)
+                        stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+                        counts['messages'] += 1
+                last_id = conversations[-1]['id']
+        return counts
+
+    def _iter_tree(self, conversation_id: int, archived: bool, batch_size: int = 500) -> Iterator[dict[str, Any]]:
+        """Yield all of a conversation's messages, every branch, in time order, batch_size rows at a time."""
+        schema = 'archive' if archived else 'main'
+        after = ('', 0)
+        while True:
+            with self._tier_connection(archived) as conn:
+                rows = conn.execute(f"""
+                    SELECT b.id, m.parent_id, b.role, b.content, b.timestamp, b.input_tokens, b.output_tokens,
+                           b.cache_creation_tokens, b.cache_read_tokens, b.model
+                    FROM {schema}.message_bodies b JOIN {schema}.messages m ON m.id = b.id
+                    WHERE b.conversation_id = ? AND (b.timestamp, b.id) > (?, ?)
+                    ORDER BY b.timestamp ASC, b.id ASC
+                    LIMIT ?
+                """, (conversation_id, after[0], after[1], batch_size)).fetchall()
+            for row in rows:
+                yield dict(row)
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1]['timestamp'], rows[-1]['id'])
+
+    @_invalidates
+    def import_all(self, stream, batch_size: int = 5000) -> dict[str, int]:
+        """Import a JSONL archive written by export_all().
+
+        Lines are applied in transactions of batch_size records with
+        executemany. Re-importing is safe: conversations are matched by uuid
+        and messages already present (same conversation, timestamp, role and
+        content) are skipped. Conversation totals are recomputed from their
+        messages afterwards. Branches are rebuilt from the archive's message
+        IDs; a conversation's messages must follow its line.
+        """
+        counts = {'conversations': 0, 'messages': 0, 'skipped_messages': 0}
+        conversations: list[dict[str, Any]] = []
+        messages: list[dict[str, Any]] = []
+        # Carried across batches: archive message IDs -> local IDs, archive
+        # head IDs and the last message imported, per conversation uuid
+        tree: dict[str, Any] = {'ids': {}, 'heads': {}, 'last': {}}
+
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            kind = record.get('type')
+            if kind == 'header':
+                if record.get('format') != ARCHIVE_FORMAT or record.get('version', 0) > ARCHIVE_VERSION:
+                    raise ValueError(f'Unsupported archive format on line {line_number}')
+            elif kind == 'conversation':
+                conversations.append(record)
+            elif kind == 'message':
+                messages.append(record)
+            else:
+                raise ValueError(f'Unknown record type {kind!r} on line {line_number}')
+
+            if len(conversations) + len(messages) >= batch_size:
+                self._import_batch(conversations, messages, counts, tree)
+                conversations, messages = [], []
+
+        if conversations or messages:
+            self._import_batch(conversations, messages, counts, tree)
+        return counts
+
+    @_serialized
+    def _import_batch(self, conversations: list[dict[str, Any]], messages: list[dict[str, Any]],
+                      counts: dict[str, int], tree: dict[str, Any]):
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        messages = self.get_messages(conversation_id)
+            uuids = {conv['uuid'] for conv in conversations} | {msg['conversation_uuid'] for msg in messages}
+            ids = self._conversation_ids_by_uuid(cursor, uuids)
 
-        md = f"# {conversation['title']}\n\n"
-        md += f"**Created:** {conversation['created_at']}\n"
-        md += f"**Updated:** {conversation['updated_at']}\n"
+            new_conversations = {conv['uuid']: conv for conv in conversations if conv['uuid'] not in ids}
+            cursor.executemany("""
+                INSERT INTO conversations (uuid, title, created_at, updated_at, model_used)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (uuid) DO NOTHING
+            """, [tuple(conv.get(field) for field in ARCHIVE_CONVERSATION_FIELDS)
+                  for conv in new_conversations.values()])
+            counts['conversations'] += len(new_conversations)
+            ids.update(self._conversation_ids_by_uuid(cursor, new_conversations))
+            tree['heads'].update((conv['uuid'], conv.get('head_id')) for conv in conversations)
+
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM messages')
+            last_id = cursor.fetchone()[0]
+            received = set()
+            gained = {}
+            blob_ids = set()
+            for msg in messages:
+                uuid = msg['conversation_uuid']
+                conversation_id = ids.get(uuid)
+                if conversation_id is None:
+                    counts['skipped_messages'] += 1
+                    continue
+                received.add(conversation_id)
+                if uuid not in tree['last']:
+                    cursor.execute('SELECT head_id FROM conversations WHERE id = ?', (conversation_id,))
+                    tree['last'][uuid] = cursor.fetchone()['head_id']
+                local_ids = tree['ids'].setdefault(uuid, {})
+                # Without a known parent the message continues from the one before it
+                if 'parent_id' in msg and msg['parent_id'] is None:
+                    parent_id = None
+                else:
+                    parent_id = local_ids.get(msg.get('parent_id'), tree['last'][uuid])
+
+                content, blob_id = self._store_body(cursor, msg['content'])
+                blob_ids.add(blob_id)
+                values = tuple(content if field == 'content' else msg.get(field, 0 if field in TOKEN_FIELDS else None)
+                               for field in ARCHIVE_MESSAGE_FIELDS)
+                cursor.execute("""
+                    INSERT INTO messages (conversation_id, role, content, timestamp, input_tokens, output_tokens,
+                                          cache_creation_tokens, cache_read_tokens, model, blob_id, parent_id)
+                    SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM message_bodies
+                        WHERE conversation_id = ? AND timestamp = ? AND role = ? AND content = ?
+                    )
+                """, (conversation_id, *values, blob_id, parent_id,
+                      conversation_id, msg['timestamp'], msg['role'], msg['content']))
+                if cursor.rowcount:
+                    message_id = cursor.lastrowid
+                    counts['messages'] += 1
+                    gained[uuid] = conversation_id
+                else:
+                    cursor.execute("""
+                        SELECT id FROM message_bodies
+                        WHERE conversation_id = ? AND timestamp = ? AND role = ? AND content = ?
+                    """, (conversation_id, msg['timestamp'], msg['role'], msg['content']))
+                    message_id = cursor.fetchone()['id']
+                    counts['skipped_messages'] += 1
+                if 'id' in msg:
+                    local_ids[msg['id']] = message_id
+                tree['last'][uuid] = message_id
+
+            self._roll_up_usage(cursor, 'm.id > ?', (last_id,))
+            self._embed_messages(cursor, 'id > ?', (last_id,))
+
+            # Conversations that gained messages continue from the archive's head
+            cursor.executemany('UPDATE conversations SET head_id = ? WHERE id = ?', [
+                (tree['ids'][uuid].get(tree['heads'].get(uuid), tree['last'][uuid]), conversation_id)
+                for uuid, conversation_id in gained.items()
+            ])
+            # Only the last conversation can continue into the next batch
+            current = messages[-1]['conversation_uuid'] if messages else None
+            for uuid in {msg['conversation_uuid'] for msg in messages} - {current}:
+                for state in tree.values():
+                    state.pop(uuid, None)
+
+            # Blobs added for messages that turned out to be duplicates
+            blob_ids.discard(None)
+            cursor.executemany('DELETE FROM message_blobs WHERE id = ? AND refs = 0',
+                               [(blob_id,) for blob_id in blob_ids])
+
+            # Recompute totals and branches for every conversation that received messages
+            cursor.executemany("""
+                UPDATE conversations
+                SET (message_count, total_input_tokens, total_output_tokens,
+                     total_cache_creation_tokens, total_cache_read_tokens) = (
+                    SELECT COUNT(*), COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0),
+                           COALESCE(SUM(cache_creation_tokens), 0), COALESCE(SUM(cache_read_tokens), 0)
+                    FROM messages
+                    WHERE conversation_id = conversations.id
+                ),
+                branch_count = MAX(1, (
+                    SELECT COUNT(*) FROM messages leaf
+                    WHERE leaf.conversation_id = conversations.id AND NOT EXISTS (
+                        SELECT 1 FROM messages c
+                        WHERE c.conversation_id = leaf.conversation_id AND c.parent_id = leaf.id
+                    )
+                ))
+                WHERE id = ?
+            """, [(conversation_id,) for conversation_id in received])
+
+    @staticmethod
+    def _conversation_ids_by_uuid(cursor, uuids) -> dict[str, int]:
+        uuids = list(uuids)
+        ids = {}
+        for start in range(0, len(uuids), MAX_QUERY_PARAMS):
+            chunk = uuids[start:start + MAX_QUERY_PARAMS]
+            cursor.execute(
+                f"SELECT uuid, id FROM conversations WHERE uuid IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            ids.update((row['uuid'], row['id']) for row in cursor.fetchall())
+        return ids
+
+    def iter_conversation_markdown(self, conversation_id: int,
+                                   conversation: Optional[dict[str, Any]] = None) -> Iterator[str]:
+        """Yield a conversation's markdown export piece by piece."""
+        conversation = conversation or self.get_conversation(conversation_id)
+        if not conversation:
+            return
+
+        yield f"# {conversation['title']}\n\n"
+        yield f"**Created:** {conversation['created_at']}\n"
+        yield f"**Updated:** {conversation['updated_at']}\n"
         if conversation['model_used']:
-            md += f"**Model:** {conversation['model_used']}\n"
-        md += f"**Total Tokens:** {conversation['total_input_tokens'] + conversation['total_output_tokens']}\n\n"
-        md += '---\n\n'
+            yield f"**Model:** {conversation['model_used']}\n"
+        yield f"**Total Tokens:** {conversation['total_input_tokens'] + conversation['total_output_tokens']}\n\n"
+        yield '---\n\n'
 
-        for msg in messages:
+        for msg in self.iter_messages(conversation_id):
             role = '**You:**' if msg['role'] == 'user' else '**Assistant:**'
-            md += f"{role}\n\n{msg['content']}\n\n---\n\n"
+            yield f"{role}\n\n{msg['content']}\n\n---\n\n"
+
+    def iter_conversation_json(self, conversation_id: int,
+                               conversation: Optional[dict[str, Any]] = None) -> Iterator[str]:
+        """Yield a conversation's JSON export (as json.dumps(..., indent=2)) piece by piece."""
+        conversation = conversation or self.get_conversation(conversation_id)
+        if not conversation:
+            yield '{}'
+            return
 
-        return md
+        def nested(value, depth):
+            return json.dumps(value, indent=2).replace('\n', '\n' + '  ' * depth)
+
+        yield '{\n  "conversation": ' + nested(conversation, 1) + ',\n  "messages": ['
+        separator = '\n    '
+        for msg in self.iter_messages(conversation_id):
+            yield separator + nested(msg, 2)
+            separator = ',\n    '
+        yield '\n  ]\n}' if separator != '\n    ' else ']\n}'
+
+    def export_conversation(self, conversation_id: int, fmt: str = 'markdown',
+                            conversation: Optional[dict[str, Any]] = None) -> str:
+        """Export a conversation as 'markdown' or 'json' text.
+
+        The result is cached in memory against the conversation row, so an
+        unchanged conversation is never serialized twice.
+        """
+        conversation = conversation or self.get_conversation(conversation_id)
+        if not conversation:
+            return ''
+
+        cached = self.get_cached_export(conversation_id, fmt, conversation)
+        if cached is not None:
+            return cached
+
+        pieces = {
+            'markdown': self.iter_conversation_markdown,
+            'json': self.iter_conversation_json,
+        }[fmt](conversation_id, conversation)
+        data = ''.join(pieces)
+
+        key = (os.path.abspath(self.db_path), conversation_id, fmt)
+        with _export_cache_lock:
+            _export_cache[key] = (conversation, data)
+            _export_cache.move_to_end(key)
+            while len(_export_cache) > EXPORT_CACHE_SIZE:
+                _export_cache.popitem(last=False)
+        return data
+
+    def get_cached_export(self, conversation_id: int, fmt: str = 'markdown',
+                          conversation: Optional[dict[str, Any]] = None) -> Optional[str]:
+        """Return a cached export if the conversation hasn't changed since it was built."""
+        key = (os.path.abspath(self.db_path), conversation_id, fmt)
+        with _export_cache_lock:
+            cached = _export_cache.get(key)
+        if cached is None:
+            return None
+        conversation = conversation or self.get_conversation(conversation_id)
+        if cached[0] != conversation:
+            return None
+        return cached[1]
+
+    def export_conversation_to_markdown(self, conversation_id: int) -> str:
+        """Export a conversation to markdown format."""
+        return self.export_conversation(conversation_id, 'markdown')
 
     def export_conversation_to_json(self, conversation_id: int) -> dict[str, Any]:
         """Export a conversation to JSON format."""
@@ -234,9 +3144,7 @@ class ConversationStorage:
         if not conversation:
             return {}
 
-        messages = self.get_messages(conversation_id)
-
         return {
             'conversation': conversation,
-            'messages': messages
+            'messages': list(self.iter_messages(conversation_id))
         }
@@ -0,0 +1,84 @@
+import time
+from typing import Any, Optional
+
+
+class StreamRenderer:
+    """Buffers streamed text and redraws a Streamlit placeholder at a set cadence.
+
+    Redrawing on every delta re-sends the whole reply each time, which is
+    quadratic in the reply length. Deltas are collected in a list and the
+    placeholder is only redrawn once `interval` seconds have passed or
+    `min_chars` new characters are buffered, whichever comes first.
+    """
+
+    def __init__(self, placeholder, interval: Optional[float] = 0.1,
+                 min_chars: Optional[int] = None, cursor: str = '▌'):
+        if interval is None and min_chars is None:
+            raise ValueError('StreamRenderer needs an interval, min_chars or both')
+        self.placeholder = placeholder
+        self.interval = interval
+        self.min_chars = min_chars
+        self.cursor = cursor
+
+        self._parts: list[str] = []
+        self._pending_chars = 0
+        self._started_at = time.monotonic()
+        self._last_render = float('-inf')  # show the first delta immediately
+        self.delta_count = 0
+        self.render_count = 0
+        self.char_count = 0
+        self.render_seconds = 0.0
+
+    @property
+    def text(self) -> str:
+        """Everything written so far."""
+        if len(self._parts) > 1:
+            self._parts = [''.join(self._parts)]
+        return self._parts[0] if self._parts else ''
+
+    def write(self, delta: str):
+        """Buffer a text delta and redraw if the cadence allows it."""
+        if not delta:
+            return
+        self._parts.append(delta)
+        self._pending_chars += len(delta)
+        self.char_count += len(delta)
+        self.delta_count += 1
+
+        now = time.monotonic()
+        due = (
+            (self.interval is not None and now - self._last_render >= self.interval)
+            or (self.min_chars is not None and self._pending_chars >= self.min_chars)
+        )
+        if due:
+            self._render(self.text + self.cursor, now)
+
+    def reset(self):
+        """Forget the text written so far; the next write starts it over."""
+        self._parts = []
+        self._pending_chars = 0
+        self._last_render = float('-inf')
+
+    def finish(self) -> str:
+        """Draw the complete text without the cursor and return it."""
+        text = self.text
+        self._render(text, time.monotonic())
+        return text
+
+    def _render(self, markdown: str, now: float):
+        start = time.perf_counter()
+        self.placeholder.markdown(markdown)
+        self.render_seconds += time.perf_counter() - start
+        self.render_count += 1
+        self._pending_chars = 0
+        self._last_render = now
+
+    def stats(self) -> dict[str, Any]:
+        """Counters for comparing render cost against the number of deltas."""
+        return {
+            'deltas': self.delta_count,
+            'renders': self.render_count,
+            'chars': self.char_count,
+            'render_seconds': round(self.render_seconds, 4),
+            'seconds': round(time.monotonic() - self._started_at, 3),
+        }